@@ -0,0 +1,145 @@
+import time
+import hashlib
+import threading
+from typing import Dict, List, Optional
+import numpy as np
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class SemanticAnswerCache:
+    """
+    Cache of generated answers, looked up by query similarity.
+
+    A cached answer is reused for a new query when both queries' embeddings have a cosine
+    similarity above similarity_threshold, the entry is younger than ttl and the asker's own
+    search for the query returns the same chunks, with the same content, the answer was
+    generated from. A session whose uploads rank higher, or that hid a cited page, gets
+    its own answer.
+    """
+
+    def __init__(self, similarity_threshold: float = 0.92, ttl: float = 6 * 3600, max_entries: int = 5000):
+        """
+        Args:
+            similarity_threshold: Minimum cosine similarity between the new and the cached query
+            ttl: Seconds an answer stays valid
+            max_entries: Number of answers kept, the oldest are dropped first
+        """
+        self.similarity_threshold = similarity_threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: List[Dict] = []
+        self._matrix: Optional[np.ndarray] = None
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.stale = 0
+        self.invalidated = 0
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _drop(self, entries: List[Dict]) -> None:
+        dropped = {id(entry) for entry in entries}
+        self._entries = [entry for entry in self._entries if id(entry) not in dropped]
+        self._matrix = None
+
+    @staticmethod
+    def _chunk_keys(chunks: List[Dict]) -> frozenset:
+        return frozenset((chunk['chunk_id'], content_hash(chunk['content'])) for chunk in chunks)
+
+    def lookup(self, query_vector, chunks: List[Dict]) -> Optional[Dict]:
+        """
+        Find a reusable answer for a query.
+
+        Args:
+            query_vector: Embedding of the query
+            chunks: Search results of the asker for the query, the context its answer would be generated from
+
+        Returns:
+            Optional[Dict]: Cached {'response', 'citations'}, or None on a miss
+        """
+        query_vector = self._normalize(query_vector)
+        chunk_keys = self._chunk_keys(chunks)
+        with self._lock:
+            if not self._entries:
+                self.misses += 1
+                return None
+            if self._matrix is None:
+                self._matrix = np.stack([entry['vector'] for entry in self._entries])
+
+            similarities = self._matrix @ query_vector
+            now = time.time()
+            expired = []
+            result = None
+            for position in np.argsort(-similarities):
+                if similarities[position] < self.similarity_threshold:
+                    break
+                entry = self._entries[position]
+                if now - entry['created'] > self.ttl:
+                    expired.append(entry)
+                    continue
+                if entry['chunks'] == chunk_keys:
+                    result = entry['result']
+                    break
+                self.stale += 1
+
+            if expired:
+                self.expired += len(expired)
+                self._drop(expired)
+            if result is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return result
+
+    def store(self, query: str, query_vector, result: Dict, chunks: List[Dict]) -> None:
+        """
+        Remember the answer generated for a query.
+
+        Args:
+            query: Query text (kept for debugging)
+            query_vector: Embedding of the query
+            result: {'response', 'citations'} returned by generate_response
+            chunks: Search results the answer was generated from
+        """
+        entry = {
+            'query': query,
+            'vector': self._normalize(query_vector),
+            'result': result,
+            'chunks': self._chunk_keys(chunks),
+            'doc_ids': {chunk['doc_id'] for chunk in chunks},
+            'created': time.time(),
+        }
+        with self._lock:
+            self._entries.append(entry)
+            if len(self._entries) > self.max_entries:
+                self._entries = self._entries[-self.max_entries:]
+            self._matrix = None
+
+    def invalidate_document(self, doc_id: str) -> None:
+        """Forget every answer that cited a removed document"""
+        with self._lock:
+            invalid = [entry for entry in self._entries if doc_id in entry['doc_ids']]
+            if invalid:
+                self.invalidated += len(invalid)
+                self._drop(invalid)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'expired': self.expired,
+                'stale': self.stale,
+                'invalidated': self.invalidated,
+                'entries': len(self._entries),
+            }
@@ -3,6 +3,8 @@ from flask import Flask, render_template, request, jsonify, send_file
 import os
 from dotenv import load_dotenv
 import threading
+import time
+import shutil
 import uuid
 from datetime import datetime
 import fitz
@@ -16,37 +18,155 @@ from langchain_community.vectorstores import FAISS
 from langchain_huggingface.embeddings import HuggingFaceEmbeddings
 import numpy as np
 from LaIA_web_search import WebSearchAgent
+from LaIA_fetcher import Fetcher, UrlStatusCache, BodyTooLarge, UnsupportedContentType
+from LaIA_page_cache import PageCache
+from LaIA_crawl_archive import CrawlArchive
 import io
-from LaIA_document_manager import DocumentManager
+from LaIA_document_manager import DocumentManager, NO_CONTEXT_RESPONSE
+from LaIA_document_store import DocumentStore
+from LaIA_embedding_cache import EmbeddingCache
+from LaIA_embedding_service import EmbeddingService
+from LaIA_vector_index import IndexConfig
+from LaIA_answer_cache import SemanticAnswerCache
+from LaIA_job_queue import JobQueue, JobCancelled, QueueFull
 from LaIA_select_best_sources import SelectBestSources
+from LaIA_source_ranker import EmbeddingRanker, BM25Ranker
+from LaIA_llm_gateway import LLMGateway
+from LaIA_llm_cache import LLMResponseCache
+from LaIA_timing import stage, timings, request_timing
 from LaIA_dialogue import LaIA_dialogue
 from LaIA_video import LaIA_video
 import re
+import logging
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = 'uploads/'
 app.config['AUDIO_FOLDER'] = 'static/audio/'
 app.config['VIDEO_FOLDER'] = 'static/video/'
+app.config['INDEX_FOLDER'] = 'faiss_index/'
+app.config['EMBEDDING_CACHE_FOLDER'] = 'embedding_cache/'
+app.config['EMBEDDING_CACHE_MAX_BYTES'] = 512 * 1024 * 1024  # Compacted to the newest half above this size
+app.config['EMBEDDING_BATCH_SIZE'] = 32
+app.config['EMBEDDING_MAX_WAIT'] = 0.02  # seconds
+app.config['EMBEDDING_WORKERS'] = 2
+app.config['VECTOR_INDEX_TYPE'] = 'flat'  # 'flat', 'ivf' or 'hnsw', see LaIA_index_benchmark.py
+app.config['VECTOR_INDEX_QUANTIZATION'] = None  # None, 'sq8' or 'pq'
+app.config['SHARED_VECTOR_INDEX_TYPE'] = 'hnsw'  # Index of the knowledge base shared by all sessions
+app.config['SHARED_VECTOR_INDEX_QUANTIZATION'] = None
+app.config['ANSWER_CACHE_SIMILARITY'] = 0.92  # Cosine similarity for two questions to share an answer
+app.config['ANSWER_CACHE_TTL'] = 6 * 3600  # seconds
+app.config['CHAT_WORKERS'] = 4  # Chat pipelines run at the same time
+app.config['CHAT_MAX_QUEUED'] = 32  # Waiting chat pipelines before /chat answers 429
+app.config['CHAT_MAX_JOBS_PER_SESSION'] = 1
+app.config['CHAT_MAX_QUEUED_PER_SESSION'] = 4  # Waiting chat pipelines of one session, so one client cannot fill the queue
+app.config['SESSION_IDLE_TTL'] = 24 * 3600  # seconds before an idle session and its uploaded documents are removed
+app.config['SESSION_SWEEP_INTERVAL'] = 600  # seconds between checks for idle sessions
+app.config['CRAWL_MAX_PAGES'] = 12  # Pages fetched for all the queries of a web search
+app.config['FETCH_MAX_PER_HOST'] = 4  # Requests in flight to the same website
+app.config['FETCH_MIN_INTERVAL'] = 0.1  # Seconds between requests to the same website
+app.config['FETCH_MAX_BODY_BYTES'] = 5 * 1024 * 1024  # Bigger pages are skipped
+app.config['FETCH_READ_LIMIT_BYTES'] = 1024 * 1024  # Pages are cut after this, the main content comes first
+app.config['URL_STATUS_TTL'] = 3600  # Seconds a page that answered 200 is considered valid without checking it again
+app.config['URL_STATUS_ERROR_TTL'] = 300  # Same for pages that failed
+app.config['CRAWLER_BACKEND'] = 'threads'  # 'threads' or 'asyncio' (LaIA_async_crawler.py)
+app.config['CRAWL_CONCURRENCY'] = 8  # Pages downloaded at the same time by each asyncio crawl
+app.config['CRAWL_DEADLINE'] = None  # Seconds after which an asyncio crawl returns the pages it has
+app.config['PAGE_CACHE_FOLDER'] = 'page_cache/'
+app.config['PAGE_CACHE_TTL'] = 6 * 3600  # seconds before a cached page is revalidated
+app.config['PAGE_CACHE_MAX_BYTES'] = 256 * 1024 * 1024
+app.config['SOURCE_SELECTION_CONCURRENCY'] = 4  # LLM requests in flight while selecting the sources of a search
+app.config['SOURCE_RANKER'] = 'embeddings'  # Pre-ranks the crawled pages before the LLM selection: 'embeddings', 'bm25' or None
+app.config['SOURCE_TOP_K'] = 10  # Best ranked pages of each query sent to the LLM
+app.config['SOURCE_MIN_SCORE'] = None  # Pages scoring less are dropped (cosine similarity with 'embeddings')
+app.config['SOURCE_ACCEPT_SCORE'] = None  # Pages scoring this or more are selected without the LLM
+app.config['LLM_BASE_URL'] = os.environ.get('LAIA_LLM_BASE_URL')  # Sends every LLM call to this endpoint, e.g. LaIA_mock_llm.py
+app.config['LLM_MAX_IN_FLIGHT'] = 16  # LLM requests running at once, all sessions and modules together
+app.config['LLM_TIMEOUT'] = 60  # Seconds allowed for each LLM request
+app.config['LLM_MAX_RETRIES'] = 3  # Retries of rate limited, 5xx and failed LLM requests
+app.config['LLM_CACHE_FOLDER'] = 'llm_cache/'
+app.config['LLM_CACHE_TTL'] = 24 * 3600  # seconds a cached completion is reused
+app.config['LLM_CACHE_MAX_BYTES'] = 64 * 1024 * 1024
+# Call sites whose completions only depend on their prompt: query rewriting, source selection and the video image category
+app.config['LLM_CACHED_CALLERS'] = ['process_prompt', 'select_best_sources', 'video']
+app.config['CRAWL_ARCHIVE_FOLDER'] = None  # e.g. 'data/crawls/' to keep a gzipped copy of every crawl for debugging
+app.config['HTML_EXTRACTOR'] = 'beautifulsoup'  # Reference; 'lxml' and 'selectolax' are faster, check their parity on page_cache/ with LaIA_extractor_benchmark.py before switching
 app.config['MAX_CONTENT_LENGTH'] = 32 * 1024 * 1024  # 32MB limit
 
 # Ensure upload directories exist
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['AUDIO_FOLDER'], exist_ok=True)
+os.makedirs(app.config['INDEX_FOLDER'], exist_ok=True)
 
 # Initialize components
-embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-mpnet-base-v2")
+EMBEDDING_MODEL = "sentence-transformers/all-mpnet-base-v2"
+embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+# Shared by every session: the same administration pages get embedded once for all users
+embedding_cache = EmbeddingCache(EMBEDDING_MODEL, directory=app.config['EMBEDDING_CACHE_FOLDER'], max_disk_bytes=app.config['EMBEDDING_CACHE_MAX_BYTES'])
+# Embeds the chunks of all sessions in micro-batches, off the request threads
+embedding_service = EmbeddingService(
+    embeddings,
+    max_batch_size=app.config['EMBEDDING_BATCH_SIZE'],
+    max_wait=app.config['EMBEDDING_MAX_WAIT'],
+    num_workers=app.config['EMBEDDING_WORKERS'],
+)
+if app.config['SOURCE_RANKER'] == 'embeddings':
+    source_ranker = EmbeddingRanker(embeddings, embedding_service=embedding_service, embedding_cache=embedding_cache)
+elif app.config['SOURCE_RANKER'] == 'bm25':
+    source_ranker = BM25Ranker()
+else:
+    source_ranker = None
+# Answers to near-identical questions ("com demano la beca", "beques universitat") are reused across sessions
+answer_cache = SemanticAnswerCache(
+    similarity_threshold=app.config['ANSWER_CACHE_SIMILARITY'],
+    ttl=app.config['ANSWER_CACHE_TTL'],
+)
 text_splitter = RecursiveCharacterTextSplitter(
     chunk_size=7000,
     chunk_overlap=200,
     length_function=len,
 )
 
+# Administration pages are fetched for many queries, keep them (and their parsed content) on disk
+page_cache = PageCache(
+    app.config['PAGE_CACHE_FOLDER'],
+    ttl=app.config['PAGE_CACHE_TTL'],
+    max_bytes=app.config['PAGE_CACHE_MAX_BYTES']
+)
+# Pooled HTTP client of the crawler and the source validation, with per-host limits
+fetcher = Fetcher(
+    max_per_host=app.config['FETCH_MAX_PER_HOST'],
+    min_interval=app.config['FETCH_MIN_INTERVAL'],
+    max_body_bytes=app.config['FETCH_MAX_BODY_BYTES'],
+    read_limit_bytes=app.config['FETCH_READ_LIMIT_BYTES'],
+    cache=page_cache,
+    statuses=UrlStatusCache(ok_ttl=app.config['URL_STATUS_TTL'], error_ttl=app.config['URL_STATUS_ERROR_TTL'])
+)
+# Pooled connections, concurrency limit, retries and per-caller accounting of every LLM call
+llm_gateway = LLMGateway(
+    api_key=os.environ["OPENAI_TOKEN"],
+    max_in_flight=app.config['LLM_MAX_IN_FLIGHT'],
+    timeout=app.config['LLM_TIMEOUT'],
+    max_retries=app.config['LLM_MAX_RETRIES'],
+    cache=LLMResponseCache(app.config['LLM_CACHE_FOLDER'], ttl=app.config['LLM_CACHE_TTL'], max_bytes=app.config['LLM_CACHE_MAX_BYTES']),
+    cached_callers=app.config['LLM_CACHED_CALLERS'],
+    override_base_url=app.config['LLM_BASE_URL']
+)
+answer_llm = llm_gateway.client_for('answer')
 agent = WebSearchAgent(
     base_url=os.environ["BASE_URL"],
     api_key=os.environ["OPENAI_TOKEN"], # HF_TOKEN
     max_depth=1,
-    max_links_per_page=1
+    max_links_per_page=1,
+    fetcher=fetcher,
+    crawler_backend=app.config['CRAWLER_BACKEND'],
+    crawl_concurrency=app.config['CRAWL_CONCURRENCY'],
+    crawl_deadline=app.config['CRAWL_DEADLINE'],
+    extractor=app.config['HTML_EXTRACTOR'],
+    archive=CrawlArchive(app.config['CRAWL_ARCHIVE_FOLDER']) if app.config['CRAWL_ARCHIVE_FOLDER'] else None,
+    gateway=llm_gateway
 )
 API_URL = os.environ["API_URL"]
 TTS_HEADERS = {
@@ -58,6 +178,7 @@ class ChatSession:
         self.messages = []
         self.document_manager = None
         self.image_text = None
+        self.last_active = time.time()
         
     def add_message(self, role, content, audio_file=None):
         message = {
@@ -72,11 +193,105 @@ class ChatSession:
 
 chat_sessions = {}
 
+def session_index_path(session_id):
+    # Session ids come from the client, only accept the uuids we hand out as directory names
+    try:
+        session_id = str(uuid.UUID(session_id))
+    except (ValueError, TypeError, AttributeError):
+        return None
+    return os.path.join(app.config['INDEX_FOLDER'], session_id)
+
+# Public web pages, shared by all sessions (and by other worker processes, through the same directory)
+shared_knowledge_base = DocumentManager(
+    embeddings, text_splitter, store=DocumentStore(os.path.join(app.config['INDEX_FOLDER'], 'shared')),
+    embedding_cache=embedding_cache, embedding_service=embedding_service, answer_cache=answer_cache,
+    index_config=IndexConfig(
+        index_type=app.config['SHARED_VECTOR_INDEX_TYPE'],
+        quantization=app.config['SHARED_VECTOR_INDEX_QUANTIZATION']
+    )
+)
+
+def create_document_manager(session_id):
+    """Per-session overlay for private uploads, searched together with the shared knowledge base"""
+    index_config = IndexConfig(
+        index_type=app.config['VECTOR_INDEX_TYPE'],
+        quantization=app.config['VECTOR_INDEX_QUANTIZATION']
+    )
+    directory = session_index_path(session_id)
+    # Most sessions never upload anything: their store is only created with the first document
+    store, store_factory = None, lambda: DocumentStore(directory)
+    if os.path.isdir(directory):
+        store, store_factory = DocumentStore(directory), None
+    return DocumentManager(
+        embeddings, text_splitter, store=store, store_factory=store_factory,
+        embedding_cache=embedding_cache, embedding_service=embedding_service, index_config=index_config,
+        shared=shared_knowledge_base, answer_cache=answer_cache
+    )
+
+def get_chat_session(session_id):
+    """Return the chat session, reopening its documents from disk if this worker restarted"""
+    if not session_id:
+        return None
+    if session_id not in chat_sessions:
+        # Also sessions handed out by another worker, which have no directory until their first upload
+        if session_index_path(session_id) is None:
+            return None
+        session = ChatSession()
+        session.document_manager = create_document_manager(session_id)
+        chat_sessions.setdefault(session_id, session)
+    session = chat_sessions[session_id]
+    touch_session(session_id, session)
+    return session
+
+def touch_session(session_id, session):
+    """Mark the session as active, on its directory too so that the other workers see it"""
+    now = time.time()
+    if now - session.last_active < 60:
+        return
+    session.last_active = now
+    try:
+        os.utime(session_index_path(session_id))
+    except OSError:
+        pass  # No uploads yet
+
+def session_last_active(directory):
+    """Last activity of a session on disk: a touch of its directory or a write to its store"""
+    with os.scandir(directory) as entries:
+        return max([os.path.getmtime(directory)] + [entry.stat().st_mtime for entry in entries])
+
+def sweep_idle_sessions():
+    """Remove the sessions, and their stores, idle for longer than SESSION_IDLE_TTL"""
+    deadline = time.time() - app.config['SESSION_IDLE_TTL']
+    for session_id, session in list(chat_sessions.items()):
+        if session.last_active < deadline:
+            chat_sessions.pop(session_id, None)
+    for entry in os.scandir(app.config['INDEX_FOLDER']):
+        # Only the uuid directories of sessions, never the shared knowledge base
+        if not entry.is_dir() or session_index_path(entry.name) is None or entry.name in chat_sessions:
+            continue
+        try:
+            if session_last_active(entry.path) < deadline:
+                shutil.rmtree(entry.path)
+                logger.info(f"Removed the documents of idle session {entry.name}")
+        except OSError as e:
+            logger.warning(f"Could not remove idle session {entry.name}: {str(e)}")
+
+def sweep_idle_sessions_forever():
+    while True:
+        time.sleep(app.config['SESSION_SWEEP_INTERVAL'])
+        try:
+            sweep_idle_sessions()
+        except Exception:
+            logger.exception("Sweeping idle sessions failed")
+
+threading.Thread(target=sweep_idle_sessions_forever, name='session-sweeper', daemon=True).start()
+
 def create_tts(text, filename):
     API_URL = os.environ["API_URL"]
     headers = {"Authorization": f"Bearer {os.environ['HF_TOKEN']}"}
     
-    response = requests.post(API_URL, headers=headers, json={"text": text, "voice": 20})
+    with stage('tts'):
+        response = requests.post(API_URL, headers=headers, json={"text": text, "voice": 20})
     print(response)
     
     if response.status_code == 200:
@@ -110,8 +325,9 @@ def detect_video_request(text):
 @app.route('/')
 def home():
     session_id = str(uuid.uuid4())
+    # Nothing is written to disk until the session uploads a document
     chat_sessions[session_id] = ChatSession()
-    chat_sessions[session_id].document_manager = DocumentManager(embeddings, text_splitter)
+    chat_sessions[session_id].document_manager = create_document_manager(session_id)
 
     return render_template('index.html', session_id=session_id)
 
@@ -123,7 +339,7 @@ def transcribe_audio():
     audio_file = request.files['audio']
     session_id = request.form.get('session_id')
     
-    if not session_id or session_id not in chat_sessions:
+    if get_chat_session(session_id) is None:
         return jsonify({'error': 'Invalid session'}), 400
     
     try:
@@ -149,6 +365,177 @@ def transcribe_audio():
         }), 500
 
 
+def search_web(job, session, message):
+    """Search the web for the message and add the best pages found to the shared knowledge base"""
+    job.update('searching', 10)
+    query = agent.process_prompt(message)
+    base_url = os.environ["BASE_URL"]
+    api_key = os.environ["OPENAI_TOKEN"] # HF_TOKEN
+    select_best_sources = SelectBestSources(base_url=base_url, api_key=api_key, max_source_chars_length=500, max_simultaneous_sources=5, remove_parent_urls=False, fetcher=fetcher, max_concurrent_requests=app.config['SOURCE_SELECTION_CONCURRENCY'],
+        ranker=source_ranker, top_k=app.config['SOURCE_TOP_K'], min_score=app.config['SOURCE_MIN_SCORE'], accept_score=app.config['SOURCE_ACCEPT_SCORE'], gateway=llm_gateway)
+    query = query.split("\n")
+    # The queries are searched in parallel, sources are selected from each one as soon as it finishes
+    for i, (q, output) in enumerate(agent.search_many(query[:3], max_pages=app.config['CRAWL_MAX_PAGES'])):
+        job.update('selecting_sources', 30 + 10 * i)
+        if output:
+            with stage('source_selection'):
+                select_best_sources.append_sources(output)
+
+    job.update('selecting_sources', 70)
+    with stage('source_selection'):
+        responses = select_best_sources.get_final_sources(message)
+    job.update('ingesting', 80)
+    for r in responses:
+        session.document_manager.add_shared_document(
+            title=f"Web Search: {r[0]}",
+            content=r[1],
+            doc_type='web',
+            source_url=r[0]
+        )
+
+def generate_video(job, session, session_id, message, processing_message):
+    ubi = app.config['VIDEO_FOLDER'] + "final_video_with_subtitles.mp4"
+    socketio.emit('video_generation_start', {
+    }, room=session_id)
+
+
+    
+    text = session.document_manager.get_context(query=message, llm_client=answer_llm)
+    print(text)
+    job.update('video_dialogue', 20)
+    socketio.emit('video_progress', {
+        'progress': 20,
+        'status': 'Generating dialogue...'
+    }, room=session_id)
+
+    print("aaa")
+    
+    dialog = LaIA_dialogue(text, gateway=llm_gateway)
+    text = dialog.create_dialogue()
+    
+    job.update('video_scenes', 40)
+    socketio.emit('video_progress', {
+        'progress': 40,
+        'status': 'Creating video scenes...'
+    }, room=session_id)
+
+    print(text)
+    
+    video = LaIA_video(text, final_video_ubi=ubi, gateway=llm_gateway)
+    
+    socketio.emit('video_progress', {
+        'progress': 80,
+        'status': 'Adding subtitles...'
+    }, room=session_id)
+    
+    # ... video processing ...
+    
+    socketio.emit('video_progress', {
+        'progress': 100,
+        'status': 'Finalizing video...'
+    }, room=session_id)
+    
+    socketio.emit('video_generation_complete', room=session_id)
+    
+    processing_message['content'] = "Aquí tens el teu video."
+    processing_message['citations'] = []
+    processing_message['audio_file'] = None
+    processing_message['video_file'] = ubi
+
+def answer_message(job, session, session_id, message, tts_enabled, stream, processing_message):
+    """Answer from the session's documents and the shared knowledge base, searching the web only when they miss"""
+    # Pages other worker processes added to the shared knowledge base (a stat() when there are none)
+    shared_knowledge_base.refresh()
+
+    if detect_video_request(message):
+        generate_video(job, session, session_id, message, processing_message)
+        return
+
+    on_token, on_citations, on_reset = stream_callbacks(session_id, processing_message['id']) if stream else (None, None, None)
+
+    def generate():
+        return session.document_manager.generate_response(
+            query=message,
+            llm_client=answer_llm,
+            include_citations=True,
+            on_token=on_token,
+            on_citations=on_citations,
+            on_reset=on_reset
+        )
+
+    # The session's uploads are searched together with the pages any session already found:
+    # a question answered before costs no web search (and no LLM call if the answer cache has it)
+    job.update('answering', 5)
+    output = generate()
+
+    if output['response'] == NO_CONTEXT_RESPONSE:
+        if stream:
+            # Drop the citations already streamed for the unusable documents
+            update_chat_async(session_id, session.messages)
+        search_web(job, session, message)
+        job.update('answering', 90)
+        output = generate()
+
+    response = output['response']
+    citations = output['citations']
+
+    if stream:
+        # Commit the text right away, the audio is attached once it is ready
+        processing_message['content'] = response
+        processing_message['citations'] = citations
+        update_chat_async(session_id, session.messages)
+
+    # Generate audio for response
+    audio_filename = None
+    if tts_enabled:
+        job.update('tts', 95)
+        audio_filename = f"{uuid.uuid4()}.wav"
+        audio_path = os.path.join(app.config['AUDIO_FOLDER'], audio_filename)
+        if not create_tts(response, audio_path):
+            audio_filename = None
+
+    processing_message['content'] = response
+    processing_message['citations'] = citations
+    processing_message['audio_file'] = audio_filename
+    processing_message['video_file'] = None
+
+def run_chat_job(job, session, session_id, message, tts_enabled, stream, processing_message):
+    """Job queue entry point: answers the message and pushes the final history to the session room"""
+    try:
+        # One sample per stage of this message in the stage timings of /stats
+        with request_timing():
+            answer_message(job, session, session_id, message, tts_enabled, stream, processing_message)
+    except JobCancelled:
+        processing_message['content'] = "Cerca cancel·lada."
+        raise
+    except Exception:
+        processing_message['content'] = "No s'ha pogut respondre la pregunta. Torna-ho a provar."
+        raise
+    finally:
+        processing_message.setdefault('citations', [])
+        update_chat_async(session_id, session.messages)
+
+def job_update(job):
+    socketio.emit('job_update', job.to_dict(), room=job.session_id, namespace='/chat')
+
+def chat_job_cancelled(job):
+    """A chat job cancelled while queued never runs run_chat_job: replace its placeholder here"""
+    session, session_id = job.args[0], job.args[1]
+    processing_message = job.args[-1]
+    processing_message['content'] = "Cerca cancel·lada."
+    processing_message.setdefault('citations', [])
+    update_chat_async(session_id, session.messages)
+
+# Long chat pipelines run here instead of in the request threads
+chat_jobs = JobQueue(
+    num_workers=app.config['CHAT_WORKERS'],
+    max_queued=app.config['CHAT_MAX_QUEUED'],
+    max_running_per_session=app.config['CHAT_MAX_JOBS_PER_SESSION'],
+    on_update=job_update,
+    on_cancel=chat_job_cancelled,
+    max_queued_per_session=app.config['CHAT_MAX_QUEUED_PER_SESSION']
+)
+
 @app.route('/chat', methods=['POST'])
 def chat():
     print(f"Incoming request data: {request.get_json()}")
@@ -157,161 +544,52 @@ def chat():
     message = data.get('message')
     message_type = data.get('message_type', 'text') 
     tts_enabled = data.get('tts_enabled', True)
+    stream = data.get('stream', False)
     
-    if not session_id or session_id not in chat_sessions:
+    session = get_chat_session(session_id)
+    if session is None:
         return jsonify({'error': 'Invalid session'}), 400
-        
-    session = chat_sessions[session_id]
-    
+
     # Add user message to history
     if message_type == 'text':
-        print(session)
-        session.add_message('user', message)
         print(message)
+        user_message = session.add_message('user', message)
 
         # Placeholder/Loading message
         processing_message = session.add_message('assistant', "Buscant...")
+        try:
+            job = chat_jobs.submit(session_id, run_chat_job, session, session_id, message, tts_enabled, stream, processing_message)
+        except QueueFull:
+            session.messages.remove(user_message)
+            session.messages.remove(processing_message)
+            response = jsonify({'error': 'Too many requests, try again later'})
+            response.headers['Retry-After'] = '10'
+            return response, 429
+
+        processing_message['job_id'] = job.id
         update_chat_async(session_id, session.messages) 
-
-
-        if detect_video_request(message):
-            ubi = app.config['VIDEO_FOLDER'] + "final_video_with_subtitles.mp4"
-            socketio.emit('video_generation_start', {
-            }, room=session_id)
-
-
-            
-            text = session.document_manager.get_context(query=message, llm_client=agent.client)
-            print(text)
-            socketio.emit('video_progress', {
-                'progress': 20,
-                'status': 'Generating dialogue...'
-            }, room=session_id)
-
-            print("aaa")
-            
-            dialog = LaIA_dialogue(text)
-            text = dialog.create_dialogue()
-            
-            socketio.emit('video_progress', {
-                'progress': 40,
-                'status': 'Creating video scenes...'
-            }, room=session_id)
-
-            print(text)
-            
-            video = LaIA_video(text, final_video_ubi=ubi)
-            
-            socketio.emit('video_progress', {
-                'progress': 80,
-                'status': 'Adding subtitles...'
-            }, room=session_id)
-            
-            # ... video processing ...
-            
-            socketio.emit('video_progress', {
-                'progress': 100,
-                'status': 'Finalizing video...'
-            }, room=session_id)
-            
-            socketio.emit('video_generation_complete', room=session_id)
-            
-            processing_message['content'] = "Aquí tens el teu video."
-            processing_message['citations'] = []
-            processing_message['audio_file'] = None
-            processing_message['video_file'] = ubi
-            return jsonify({'history': session.messages})
-
-    
-        # Generate response based on context
-        if len(session.document_manager.documents) != 0:
-            # RAG-based response for PDF context
-            print("ragresponse")
-            
-            output = session.document_manager.generate_response(
-                query=message,
-                llm_client=agent.client,
-                include_citations=True
-            )
-
-            response = output['response']
-            citations = output['citations']
-            print("response", response)
-
-            if response == 'No relevant context found to answer the question.':
-                
-                query = agent.process_prompt(message)
-                base_url = os.environ["BASE_URL"]
-                api_key = os.environ["OPENAI_TOKEN"] # HF_TOKEN
-                select_best_sources = SelectBestSources(base_url=base_url, api_key=api_key, max_source_chars_length=500, max_simultaneous_sources=5, remove_parent_urls=False)
-                query = query.split("\n")
-                for q in query[:3]:
-                # Get response
-                    output = agent.search_and_analyze(q)
-                    if output != False:
-                        select_best_sources.append_sources(output)
-                responses = select_best_sources.get_final_sources(message)
-                for r in responses:
-                    session.document_manager.add_document(
-                        title=f"Web Search: {r[0]}",
-                        content=r[1],
-                        doc_type='web',
-                        source_url=r[0]
-                    )
-                output = session.document_manager.generate_response(
-                    query=message,
-                    llm_client=agent.client,
-                    include_citations=True
-                )
-                response = output['response']
-                citations = output['citations']
-
-        else:
-            # Web search-based response
-
-            query = agent.process_prompt(message)
-            base_url = os.environ["BASE_URL"]
-            api_key = os.environ["OPENAI_TOKEN"] # HF_TOKEN
-            select_best_sources = SelectBestSources(base_url=base_url, api_key=api_key, max_source_chars_length=500, max_simultaneous_sources=5, remove_parent_urls=False)
-            query = query.split("\n")
-            for q in query[:3]:
-            # Get response
-                output = agent.search_and_analyze(q)
-                if output != False:
-                    select_best_sources.append_sources(output)
-            responses = select_best_sources.get_final_sources(message)
-            for r in responses:
-                session.document_manager.add_document(
-                    title=f"Web Search: {r[0]}",
-                    content=r[1],
-                    doc_type='web',
-                    source_url=r[0]
-                )
-            output = session.document_manager.generate_response(
-                query=message,
-                llm_client=agent.client,
-                include_citations=True
-            )
-            response = output['response']
-            citations = output['citations']
-    
-        # Generate audio for response
-        if tts_enabled:
-            audio_filename = f"{uuid.uuid4()}.wav"
-            audio_path = os.path.join(app.config['AUDIO_FOLDER'], audio_filename)
-            tts_success = create_tts(response, audio_path)
-        else:
-            tts_success = False
-
-        processing_message['content'] = response
-        processing_message['citations'] = citations
-        processing_message['audio_file'] = audio_filename if tts_success else None
-        processing_message['video_file'] = None
-        return jsonify({'history': session.messages})
+        return jsonify({'job_id': job.id, 'history': session.messages}), 202
     
     elif message_type == 'audio':
         pass
 
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = chat_jobs.get(job_id)
+    if job is None or job.session_id != request.args.get('session_id'):
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    data = request.get_json(silent=True)
+    session_id = data.get('session_id') if data else None
+    job = chat_jobs.get(job_id)
+    if job is None or job.session_id != session_id:
+        return jsonify({'error': 'Job not found'}), 404
+    success = chat_jobs.cancel(job_id)
+    return jsonify({'success': success, **job.to_dict()})
+
 @app.route('/upload', methods=['POST'])
 def upload():
     if 'file' not in request.files:
@@ -322,10 +600,9 @@ def upload():
     session_id = request.form.get('session_id')
 
     
-    if not session_id or session_id not in chat_sessions:
+    session = get_chat_session(session_id)
+    if session is None:
         return jsonify({'error': 'Invalid session'}), 400
-        
-    session = chat_sessions[session_id]
     
     if file and file.filename.endswith('.pdf'):
         filename = secure_filename(file.filename)
@@ -374,8 +651,8 @@ def upload():
 @app.route('/clear-context', methods=['POST'])
 def clear_context():
     session_id = request.form.get('session_id')
-    if session_id and session_id in chat_sessions:
-        session = chat_sessions[session_id]
+    session = get_chat_session(session_id)
+    if session is not None:
         session.vector_store = None  # Clear PDF context
         session.image_text = None   # Clear image text
         message = session.add_message('system', "Context cleared. Now using web search.")
@@ -387,6 +664,19 @@ def update_chat_async(session_id, messages):
         data = {'history': messages}
         socketio.emit('chat_update', data, room=session_id, namespace='/chat')
 
+def stream_callbacks(session_id, message_id):
+    """Callbacks for generate_response that stream the answer of a message to the session room"""
+    def on_token(token):
+        socketio.emit('chat_token', {'message_id': message_id, 'token': token}, room=session_id, namespace='/chat')
+
+    def on_citations(citations):
+        socketio.emit('chat_citations', {'message_id': message_id, 'citations': citations}, room=session_id, namespace='/chat')
+
+    def on_reset():
+        socketio.emit('chat_reset', {'message_id': message_id}, room=session_id, namespace='/chat')
+
+    return on_token, on_citations, on_reset
+
 
 @app.route('/audio/<filename>')
 def serve_audio(filename):
@@ -398,8 +688,8 @@ def serve_audio(filename):
 @app.route('/documents', methods=['POST'])
 def get_documents():
     session_id = request.json.get('session_id')  # Use request.json for JSON data
-    if session_id and session_id in chat_sessions:
-        session = chat_sessions[session_id]
+    session = get_chat_session(session_id)
+    if session is not None:
         return jsonify({'documents': session.document_manager.get_document_list()})
     return jsonify({'error': 'Invalid session ID'}), 400
 
@@ -411,10 +701,21 @@ def push_url():
     session_id = request.json.get('session_id')  # Use request.json for JSON data
     url = request.json.get('url')
     print("Here's the url", url)
-    if session_id and session_id in chat_sessions:
-        newweb = agent.simple_web(url)
-        session = chat_sessions[session_id]
-        document, chunk_count = session.document_manager.add_document(
+    session = get_chat_session(session_id)
+    if session is not None:
+        if not url:
+            return jsonify({'error': 'Missing url'}), 400
+        try:
+            newweb = agent.simple_web(url)
+        except UnsupportedContentType as e:
+            return jsonify({'error': f"Not a web page: {str(e)}"}), 415
+        except BodyTooLarge as e:
+            return jsonify({'error': f"Page too large: {str(e)}"}), 413
+        except requests.RequestException as e:
+            return jsonify({'error': f"Could not download the page: {str(e)}"}), 422
+        if not newweb:
+            return jsonify({'error': 'The page has no text'}), 422
+        document, chunk_count = session.document_manager.add_shared_document(
             title=f"Web Search: {url}",
             content=newweb,
             doc_type='web',
@@ -430,8 +731,8 @@ def push_url():
 def remove_document(doc_id):
     data = request.get_json()
     session_id = data.get('session_id') if data else None
-    if session_id and session_id in chat_sessions:
-        session = chat_sessions[session_id]
+    session = get_chat_session(session_id)
+    if session is not None:
         success = session.document_manager.remove_document(doc_id)
         return jsonify({
             'success': success,
@@ -440,6 +741,20 @@ def remove_document(doc_id):
     return jsonify({'error': 'Invalid session'}), 400
 
 
+@app.route('/stats', methods=['GET'])
+def cache_stats():
+    return jsonify({
+        'embedding_cache': embedding_cache.stats(),
+        'answer_cache': answer_cache.stats(),
+        'page_cache': page_cache.stats(),
+        'url_statuses': fetcher.statuses.stats(),
+        'jobs': chat_jobs.stats(),
+        'llm': llm_gateway.stats(),
+        'llm_cache': llm_gateway.cache.stats(),
+        'stages': timings.summary()
+    })
+
+
 from flask_socketio import SocketIO, join_room, leave_room
 
 socketio = SocketIO(app, async_mode='threading') # Important: use threading for async
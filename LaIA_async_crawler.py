@@ -0,0 +1,259 @@
+import asyncio
+import random
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+import aiohttp
+from requests.utils import get_encoding_from_headers
+from LaIA_fetcher import normalize_url, check_response_headers, BodyTooLarge, UnsupportedContentType, HTML_CONTENT_TYPES
+from LaIA_page_cache import PageCache, CachedPage, extracted_by
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Same retried statuses as the Fetcher's urllib3 Retry
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class AsyncCrawler:
+    """
+    asyncio crawl engine, an alternative to the recursive thread pools of WebSearchAgent._explore_url.
+
+    Pages are taken from a single frontier queue by a fixed number of workers, so the
+    number of requests in flight never exceeds concurrency however wide the crawl is.
+    The crawl stops at the deadline and returns the pages fetched until then.
+
+    Requests follow the same politeness and retry policy as Fetcher: host_delay spaces
+    the requests to each host (Fetcher.reserve_turn shares the threaded crawler's
+    min_interval), and connection errors and 429/5xx answers are retried with exponential
+    backoff. Page cache reads and writes run off the event loop.
+    """
+
+    def __init__(self,
+                 parse_page: Callable[[str, str], Tuple[str, List[str]]],
+                 claim_url: Callable[[str], bool],
+                 max_depth: int,
+                 max_links_per_page: int,
+                 extractor_name: Optional[str] = None,
+                 is_visited: Optional[Callable[[str], bool]] = None,
+                 page_cache: Optional[PageCache] = None,
+                 record_status: Optional[Callable[[str, int], None]] = None,
+                 concurrency: int = 8,
+                 max_per_host: int = 4,
+                 host_delay: Optional[Callable[[str], float]] = None,
+                 retries: int = 2,
+                 backoff_factor: float = 0.5,
+                 deadline: Optional[float] = None,
+                 timeout: float = 10,
+                 max_body_bytes: int = 5 * 1024 * 1024,
+                 read_limit_bytes: Optional[int] = None,
+                 allowed_content_types: Optional[Tuple[str, ...]] = HTML_CONTENT_TYPES,
+                 headers: Optional[Dict[str, str]] = None):
+        """
+        Args:
+            parse_page: (html, url) -> (main content, relevant links), run off the event loop
+            claim_url: Marks a URL as visited, False if it must be skipped
+            max_depth: Pages are explored at depths 0..max_depth-1
+            max_links_per_page: Links of each page added to the frontier
+            extractor_name: Name of the extractor behind parse_page, cached parsed content of other extractors is ignored
+            is_visited: Links it returns True for are not added to the frontier
+            page_cache: Cache of downloaded pages, used like Fetcher uses it
+            record_status: Called with the URL and status code of every page fetched
+            concurrency: Maximum pages downloaded at the same time
+            max_per_host: Maximum pages downloaded at the same time from one host
+            host_delay: Reserves a request slot of the URL's host, returns the seconds to wait for it
+            retries: Retries of a request failing with a connection error or a 429/5xx answer
+            backoff_factor: Retry n waits backoff_factor * 2^(n-1) seconds (or the server's Retry-After)
+            deadline: Seconds after which the crawl stops (no limit if None)
+            timeout: Seconds allowed for each page
+            max_body_bytes: Bigger pages are skipped
+            read_limit_bytes: Pages are cut after this many bytes (no cut if None), cut pages are not cached
+            allowed_content_types: Content-Type prefixes crawled, other pages are skipped (any if None)
+            headers: Headers sent with every request
+        """
+        self.parse_page = parse_page
+        self.claim_url = claim_url
+        self.is_visited = is_visited
+        self.page_cache = page_cache
+        self.record_status = record_status
+        self.max_depth = max_depth
+        self.max_links_per_page = max_links_per_page
+        self.extractor_name = extractor_name
+        self.concurrency = concurrency
+        self.max_per_host = max_per_host
+        self.host_delay = host_delay
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.deadline = deadline
+        self.timeout = timeout
+        self.max_body_bytes = max_body_bytes
+        self.read_limit_bytes = read_limit_bytes
+        self.allowed_content_types = allowed_content_types
+        self.headers = headers or {}
+
+    def crawl(self, urls: List[str]) -> List[Dict]:
+        """
+        Crawl from the seed URLs, blocking the calling thread.
+
+        Returns:
+            List[Dict]: One {'url', 'main_content', 'sub_content', 'depth'} tree per seed that
+                could be fetched, in seed order
+        """
+        return asyncio.run(self._crawl(urls))
+
+    def _retry_delay(self, attempt: int, response: Optional[aiohttp.ClientResponse] = None) -> float:
+        if response is not None:
+            try:
+                return min(float(response.headers.get('Retry-After')), 30.0)
+            except (TypeError, ValueError):
+                pass
+        return self.backoff_factor * 2 ** attempt * random.uniform(0.5, 1.0)
+
+    async def _fetch(self, session: aiohttp.ClientSession, url: str, headers: Optional[Dict[str, str]] = None) -> Optional[CachedPage]:
+        for attempt in range(self.retries + 1):
+            if self.host_delay is not None:
+                delay = self.host_delay(url)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            try:
+                async with session.get(url, headers=headers) as response:
+                    if response.status in RETRY_STATUSES and attempt < self.retries:
+                        delay = self._retry_delay(attempt, response)
+                    else:
+                        return await self._read(url, response)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if attempt == self.retries:
+                    raise
+                delay = self._retry_delay(attempt)
+                logger.warning(f"Request to {url} failed ({type(e).__name__}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    async def _read(self, url: str, response: aiohttp.ClientResponse) -> Optional[CachedPage]:
+        """Body of a response as a CachedPage, None if the page is skipped"""
+        if response.status == 200:
+            try:
+                check_response_headers(url, response.headers, self.allowed_content_types, self.max_body_bytes)
+            except (BodyTooLarge, UnsupportedContentType) as e:
+                logger.warning(f"Skipping {e}")
+                return None
+        body = bytearray()
+        truncated = False
+        async for chunk in response.content.iter_chunked(64 * 1024):
+            if self.read_limit_bytes is not None and len(body) + len(chunk) > self.read_limit_bytes:
+                body += chunk[:self.read_limit_bytes - len(body)]
+                truncated = True
+                break
+            body += chunk
+            if len(body) > self.max_body_bytes:
+                logger.warning(f"Skipping {url}: over {self.max_body_bytes} bytes")
+                return None
+        return CachedPage(
+            url=str(response.url),
+            status_code=response.status,
+            headers=dict(response.headers),
+            content=bytes(body),
+            # Same fallback as requests (ISO-8859-1 for text/* without a charset), so both backends decode alike
+            encoding=get_encoding_from_headers(response.headers),
+            fetched=time.time(),
+            truncated=truncated,
+        )
+
+    def _record_status(self, url: str, status_code: int) -> None:
+        if self.record_status is not None:
+            self.record_status(url, status_code)
+
+    async def _page_content(self, session: aiohttp.ClientSession, url: str) -> Optional[Tuple[str, List[str]]]:
+        """Main content and links of a page, from the page cache when possible"""
+        loop = asyncio.get_running_loop()
+        if self.page_cache is None:
+            page = await self._fetch(session, url)
+            if page is None:
+                return None
+            self._record_status(url, page.status_code)
+            return await loop.run_in_executor(None, self.parse_page, page.text, url)
+
+        # The page cache reads and writes files: run it off the event loop
+        key = normalize_url(url)
+        cached = await loop.run_in_executor(None, self.page_cache.get, key)
+        if cached is not None and self.page_cache.is_fresh(cached):
+            self.page_cache.record('hit')
+            page = cached
+        else:
+            page = await self._fetch(session, url, cached.conditional_headers() if cached is not None else None)
+            if page is None:
+                return None
+            if page.status_code == 304 and cached is not None:
+                self.page_cache.record('revalidated')
+                await loop.run_in_executor(None, self.page_cache.mark_revalidated, key, cached)
+                page = cached
+            else:
+                self.page_cache.record('miss')
+                if page.status_code == 200 and not page.truncated:
+                    await loop.run_in_executor(None, self.page_cache.put, key, page)
+        self._record_status(url, page.status_code)
+
+        extracted = extracted_by(page.extracted, self.extractor_name)
+        if extracted is not None:
+            return extracted['main_content'], extracted['links']
+        main_content, links = await loop.run_in_executor(None, self.parse_page, page.text, url)
+        if page.status_code == 200 and not page.truncated:
+            await loop.run_in_executor(None, self.page_cache.set_extracted, key, main_content, links, self.extractor_name)
+        return main_content, links
+
+    async def _crawl(self, urls: List[str]) -> List[Dict]:
+        # (url, depth, parent page node or None for seeds, position of the seed it comes from)
+        frontier: "asyncio.Queue[Tuple[str, int, Optional[Dict], int]]" = asyncio.Queue()
+        roots: Dict[int, Dict] = {}
+        for position, url in enumerate(urls):
+            frontier.put_nowait((url, 0, None, position))
+
+        async def explore(session: aiohttp.ClientSession, url: str, depth: int, parent: Optional[Dict], seed: int) -> None:
+            if depth >= self.max_depth or url.endswith(".pdf") or not self.claim_url(url):
+                return
+            try:
+                page = await self._page_content(session, url)
+                if page is None:
+                    return
+                main_content, links = page
+            except Exception as e:
+                logger.error(f"Error exploring URL {url}: {str(e)}")
+                return
+
+            node = {
+                'url': url,
+                'main_content': main_content,
+                'sub_content': [],
+                'depth': depth
+            }
+            if parent is None:
+                roots[seed] = node
+            else:
+                parent['sub_content'].append(node)
+            if self.is_visited is not None:
+                links = [link for link in links if not self.is_visited(link)]
+            if depth + 1 < self.max_depth:
+                for link in links[:self.max_links_per_page]:
+                    frontier.put_nowait((link, depth + 1, node, seed))
+
+        async def worker(session: aiohttp.ClientSession) -> None:
+            while True:
+                url, depth, parent, seed = await frontier.get()
+                try:
+                    await explore(session, url, depth, parent, seed)
+                finally:
+                    frontier.task_done()
+
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.max_per_host)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers=self.headers) as session:
+            workers = [asyncio.create_task(worker(session)) for _ in range(self.concurrency)]
+            start = time.monotonic()
+            try:
+                await asyncio.wait_for(frontier.join(), self.deadline)
+            except asyncio.TimeoutError:
+                logger.info(f"Crawl deadline reached after {time.monotonic() - start:.1f}s, {frontier.qsize()} pages left")
+            finally:
+                for task in workers:
+                    task.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+
+        return [roots[position] for position in sorted(roots)]
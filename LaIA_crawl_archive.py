@@ -0,0 +1,60 @@
+import os
+import gzip
+import time
+import uuid
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+import orjson
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class CrawlArchive:
+    """
+    Keeps a copy of every crawl result on disk, for debugging.
+
+    Results are written by a background thread, so the search never waits for the disk,
+    as compact gzip-compressed JSON. Every file gets a unique name: two searches for the
+    same query do not overwrite each other.
+    """
+
+    def __init__(self, directory: str, compress: bool = True):
+        """
+        Args:
+            directory: Directory of the archived crawls
+            compress: Write .json.gz files instead of .json
+        """
+        self.directory = directory
+        self.compress = compress
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='crawl-archive')
+        os.makedirs(directory, exist_ok=True)
+
+    def save(self, crawl: Dict) -> None:
+        """Archive a {'query', 'gathered_info'} crawl result in the background"""
+        self._executor.submit(self._write, crawl)
+
+    def _path(self, query: str) -> str:
+        name = re.sub(r'[\\/*?:"<>|\s]', '_', query)[:80]
+        extension = 'json.gz' if self.compress else 'json'
+        return os.path.join(self.directory, f"context_data_{name}_{int(time.time())}_{uuid.uuid4().hex[:8]}.{extension}")
+
+    def _write(self, crawl: Dict) -> None:
+        try:
+            data = orjson.dumps(crawl)
+            path = self._path(crawl.get('query', ''))
+            with (gzip.open(path, 'wb') if self.compress else open(path, 'wb')) as archive_file:
+                archive_file.write(data)
+        except Exception as e:
+            logger.warning(f"Could not archive the crawl of {crawl.get('query')}: {str(e)}")
+
+    def close(self) -> None:
+        """Wait for the pending writes"""
+        self._executor.shutdown(wait=True)
+
+
+def load_crawl(path: str) -> Dict:
+    """Crawl result of an archived file (.json or .json.gz)"""
+    with (gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')) as archive_file:
+        return orjson.loads(archive_file.read())
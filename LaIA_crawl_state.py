@@ -0,0 +1,73 @@
+import math
+import hashlib
+import threading
+from typing import Optional
+from LaIA_fetcher import normalize_url
+
+
+class BloomFilter:
+    """
+    Fixed-size set of strings with false positives but no false negatives.
+
+    Sized for capacity items at error_rate false positives; memory does not grow past
+    that, however many items are added.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        self.capacity = capacity
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self._bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.num_bits for i in range(self.num_hashes)]
+
+    def __contains__(self, item: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    def add(self, item: str) -> None:
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+
+class CrawlState:
+    """
+    Visited URLs and page budget of one search invocation, shared by all its crawl threads.
+
+    URLs are compared in normalized form (see normalize_url), so tracking parameters,
+    fragments or the case of the host do not make a page look new. With
+    bloom_capacity the visited URLs are kept in a bounded Bloom filter instead of a set.
+    """
+
+    def __init__(self, max_pages: Optional[int] = None, bloom_capacity: Optional[int] = None):
+        """
+        Args:
+            max_pages: Maximum number of pages fetched (unlimited if None)
+            bloom_capacity: Expected number of URLs for a Bloom filter (exact set if None)
+        """
+        self.max_pages = max_pages
+        self.fetched = 0
+        self._visited = BloomFilter(bloom_capacity) if bloom_capacity else set()
+        self._lock = threading.Lock()
+
+    def is_visited(self, url: str) -> bool:
+        key = normalize_url(url)
+        with self._lock:
+            return key in self._visited
+
+    def claim(self, url: str) -> bool:
+        """Mark a URL as visited, False if it already was or the page budget is spent"""
+        key = normalize_url(url)
+        with self._lock:
+            if key in self._visited:
+                return False
+            if self.max_pages is not None and self.fetched >= self.max_pages:
+                return False
+            self._visited.add(key)
+            self.fetched += 1
+            return True
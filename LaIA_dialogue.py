@@ -1,18 +1,18 @@
 #pip install openai
 from dotenv import load_dotenv
 import os
-from openai import OpenAI
+from LaIA_llm_gateway import LLMGateway
 
 
 class LaIA_dialogue:
-      def __init__(self, text='',messages=[], prompt=""):
+      def __init__(self, text='',messages=[], prompt="", gateway=None):
          assert text, "Text is required"
          load_dotenv(".env")
          self.messages = messages
          self.HF_TOKEN = os.environ["HF_TOKEN"]
          self.OPENAI_TOKEN = os.environ["OPENAI_TOKEN"]
          self.BASE_URL = os.environ["BASE_URL"]
-         self._client()
+         self._client(gateway)
 
          self.text = text
          if prompt:
@@ -38,11 +38,12 @@ LaIA: Resposta
 Ha de ser una interacció curta amb un objectiui de crear una conversa breu on el Cai només fa una pregunta inicial general i, com a màxim, una o dues intervencions breus de seguiment. La LaIA cobreix tota la informació rellevant en la seva resposta inicial, fent que el diàleg sembli complet i informatiu sense necessitat de més preguntes.
 """
 
-      def _client(self):
+      def _client(self, gateway=None):
          """
-         Create an OpenAI client
+         Create an OpenAI-compatible client through the shared LLM gateway (a new one if None)
          """
-         self.client = OpenAI(
+         self.client = (gateway or LLMGateway()).client_for(
+               'dialogue',
                #base_url=self.BASE_URL + "/v1/",
                #api_key=self.HF_TOKEN
                api_key=self.OPENAI_TOKEN
@@ -1,9 +1,28 @@
-from dataclasses import dataclass
-from typing import Optional, List, Dict, Union
+from dataclasses import dataclass, asdict
+from typing import Optional, List, Dict, Union, Callable
 from datetime import datetime
 import uuid
 import json
+import threading
+import numpy as np
+import faiss
 from langchain_community.vectorstores import FAISS
+from LaIA_document_store import DocumentStore
+from LaIA_embedding_cache import EmbeddingCache
+from LaIA_embedding_service import EmbeddingService
+from LaIA_vector_index import IndexConfig, build_index, supports_removal, rebuild_index
+from LaIA_answer_cache import SemanticAnswerCache
+from LaIA_timing import stage
+
+NO_CONTEXT_RESPONSE = 'No relevant context found to answer the question.'
+# Streamed answers are held back until this many characters, so a NOT_FOUND reply is never shown
+STREAM_HOLDBACK_CHARS = 32
+NOT_FOUND_MARKERS = ("NOT_FOUND", "no he trobat")
+
+
+def is_not_found(answer: str) -> bool:
+    return NOT_FOUND_MARKERS[0] in answer or NOT_FOUND_MARKERS[1] in answer.lower()
+
 
 @dataclass
 class Document:
@@ -17,11 +36,181 @@ class Document:
     source_url: Optional[str] = None
 
 class DocumentManager:
-    def __init__(self, embeddings, text_splitter):
+    def __init__(self,
+                 embeddings,
+                 text_splitter,
+                 store: Optional[DocumentStore] = None,
+                 embedding_cache: Optional[EmbeddingCache] = None,
+                 embedding_service: Optional[EmbeddingService] = None,
+                 index_config: Optional[IndexConfig] = None,
+                 shared: Optional['DocumentManager'] = None,
+                 answer_cache: Optional[SemanticAnswerCache] = None,
+                 store_factory: Optional[Callable[[], DocumentStore]] = None):
+        """
+        Args:
+            embeddings: Langchain embeddings (used for queries, and for chunks without embedding_service)
+            text_splitter: Splitter used to chunk documents
+            store: On-disk persistence, documents are only kept in memory if None
+            embedding_cache: Cache consulted before embedding chunks
+            embedding_service: Batched embedding workers
+            index_config: FAISS index type, flat by default
+            shared: Shared knowledge base this manager is an overlay of; its documents are
+                searched together with this manager's own ones
+            answer_cache: Cache of answers for similar queries, checked before calling the LLM
+            store_factory: Opens the on-disk store on the first write, for new sessions
+                without a store: sessions that never add anything leave nothing on disk
+        """
         self.documents: Dict[str, Document] = {}
+        # doc_id -> ids of its chunks in the vector store
+        self.chunk_ids: Dict[str, List[str]] = {}
+        # Removed documents whose vectors are still in an index that cannot delete them
+        self.removed_chunk_ids: Dict[str, List[str]] = {}
+        # source_url -> doc_id, to add each web page only once to a shared knowledge base
+        self.url_index: Dict[str, str] = {}
+        self._pending_urls: Dict[str, threading.Event] = {}
+        # Shared doc_id -> True if linked to this overlay (listed in the sidebar), False if hidden from it
+        self.shared_links: Dict[str, bool] = {}
         self.vector_store = None
         self.embeddings = embeddings
         self.text_splitter = text_splitter
+        self.store = store
+        self.store_factory = store_factory
+        self.embedding_cache = embedding_cache
+        self.embedding_service = embedding_service
+        self.index_config = index_config or IndexConfig()
+        self.shared = shared
+        self.answer_cache = answer_cache
+        # A shared knowledge base is used by every request thread at once
+        self._lock = threading.RLock()
+        if self.store is not None:
+            self._load_from_store()
+
+    def _load_from_store(self) -> None:
+        """Reopen a persisted session, reusing the stored embeddings instead of re-embedding"""
+        all_chunks, all_vectors, metadatas, ids = [], [], [], []
+        for document, chunk_ids, chunk_metadatas, vectors in self.store.load():
+            self._register_document(Document(**document), chunk_ids)
+            all_chunks += document['chunks']
+            all_vectors += list(vectors)
+            metadatas += chunk_metadatas
+            ids += chunk_ids
+        self._add_to_vector_store(all_chunks, all_vectors, metadatas, ids)
+        self.shared_links = self.store.load_links()
+
+    def refresh(self) -> None:
+        """Pick up the documents other processes added to (or removed from) the same store"""
+        if self.store is None:
+            return
+        with self._lock:
+            entries = self.store.read_new_entries()
+            if entries is None:
+                # Compacted by another process: start over from the rewritten store
+                previous = set(self.documents)
+                self.documents, self.chunk_ids, self.removed_chunk_ids, self.url_index = {}, {}, {}, {}
+                self.vector_store = None
+                self._load_from_store()
+                # Documents removed before the compaction are gone from the reloaded store
+                removed = previous - set(self.documents)
+                entries = []
+            else:
+                removed = set()
+            for entry in entries:
+                if entry['op'] == 'add' and entry['document']['id'] not in self.documents:
+                    self._register_document(Document(**entry['document']), entry['ids'])
+                    self._add_to_vector_store(entry['document']['chunks'], list(entry['vectors']), entry['metadatas'], entry['ids'])
+                elif entry['op'] == 'remove' and entry['doc_id'] in self.documents:
+                    self._unregister_document(entry['doc_id'])
+                    removed.add(entry['doc_id'])
+                elif entry['op'] == 'link':
+                    self.shared_links[entry['doc_id']] = entry['linked']
+
+        if self.answer_cache is not None:
+            for doc_id in removed:
+                self.answer_cache.invalidate_document(doc_id)
+
+    def _writable_store(self) -> Optional[DocumentStore]:
+        """The on-disk store, opened with store_factory on the first write. Called with self._lock held"""
+        if self.store is None and self.store_factory is not None:
+            self.store = self.store_factory()
+            # Another process of the same session may have created it first
+            self._load_from_store()
+        return self.store
+
+    def _register_document(self, document: Document, chunk_ids: List[str]) -> None:
+        self.documents[document.id] = document
+        self.chunk_ids[document.id] = chunk_ids
+        if document.source_url:
+            self.url_index[document.source_url] = document.id
+
+    def _unregister_document(self, doc_id: str) -> None:
+        document = self.documents.pop(doc_id)
+        if document.source_url and self.url_index.get(document.source_url) == doc_id:
+            del self.url_index[document.source_url]
+
+        # Only this document's chunks are touched, not the whole docstore
+        ids_to_delete = self.chunk_ids.pop(doc_id, [])
+
+        if ids_to_delete and supports_removal(self.vector_store.index):
+            self.vector_store.delete(ids_to_delete)
+        elif ids_to_delete:
+            # IVF / HNSW: hide the chunks from searches, rebuild once enough of the index is dead
+            self.removed_chunk_ids[doc_id] = ids_to_delete
+            removed_count = sum(len(chunk_ids) for chunk_ids in self.removed_chunk_ids.values())
+            if removed_count > 0.2 * self.vector_store.index.ntotal:
+                self._rebuild_index()
+
+    def _embed(self, texts: List[str]) -> List:
+        if self.embedding_service is not None:
+            # Batched together with the other sessions' chunks on the embedding workers
+            return self.embedding_service.submit(texts).result()
+        return self.embeddings.embed_documents(texts)
+
+    def _embed_chunks(self, chunks: List[str]) -> List:
+        """Embed chunks, only sending the ones missing from the embedding cache to the model"""
+        if self.embedding_cache is None:
+            return self._embed(chunks)
+
+        vectors = self.embedding_cache.get_many(chunks)
+        missing = list(dict.fromkeys(chunk for chunk, vector in zip(chunks, vectors) if vector is None))
+        if missing:
+            new_vectors = self._embed(missing)
+            self.embedding_cache.put_many(missing, new_vectors)
+            embedded = dict(zip(missing, new_vectors))
+            vectors = [embedded[chunk] if vector is None else vector for chunk, vector in zip(chunks, vectors)]
+        return vectors
+
+    def _add_to_vector_store(self, chunks: List[str], vectors, metadatas: List[Dict], ids: List[str]) -> None:
+        if not chunks:
+            return
+        text_embeddings = list(zip(chunks, vectors))
+        if self.vector_store is not None:
+            self.vector_store.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+        else:
+            self.vector_store = FAISS.from_embeddings(text_embeddings, self.embeddings, metadatas=metadatas, ids=ids)
+        self._maybe_migrate_index()
+
+    def _maybe_migrate_index(self) -> None:
+        """Move from langchain's flat index to the configured one once there are enough chunks to train it"""
+        index = self.vector_store.index
+        if (
+            not self.index_config.needs_migration or
+            not isinstance(index, faiss.IndexFlat) or
+            index.ntotal < self.index_config.migrate_threshold
+        ):
+            return
+        # Positions are kept, so index_to_docstore_id stays valid
+        self.vector_store.index = build_index(self.index_config, index.reconstruct_n(0, index.ntotal))
+
+    def _rebuild_index(self) -> None:
+        """Drop the vectors of removed documents from an index that does not support removal"""
+        removed = {chunk_id for chunk_ids in self.removed_chunk_ids.values() for chunk_id in chunk_ids}
+        mapping = self.vector_store.index_to_docstore_id
+        keep = [position for position in range(self.vector_store.index.ntotal) if mapping[position] not in removed]
+
+        self.vector_store.index = rebuild_index(self.vector_store.index, keep)
+        self.vector_store.index_to_docstore_id = {i: mapping[position] for i, position in enumerate(keep)}
+        self.vector_store.docstore.delete(list(removed))
+        self.removed_chunk_ids = {}
         
     def add_document(self, 
                     title: str, 
@@ -31,7 +220,8 @@ class DocumentManager:
                     source_url: Optional[str] = None) -> Document:
         """Add a new document to the manager and update vector store"""
         doc_id = str(uuid.uuid4())
-        chunks = self.text_splitter.split_text(content)
+        with stage('chunking'):
+            chunks = self.text_splitter.split_text(content)
         
         document = Document(
             id=doc_id,
@@ -44,64 +234,147 @@ class DocumentManager:
             source_url=source_url
         )
         
-        self.documents[doc_id] = document
-
         all_chunks = []
         metadatas = []
         ids = []
         for i, chunk in enumerate(document.chunks):
+            chunk_id = f"{document.id}_{i}"  # Assign unique IDs to chunks
             all_chunks.append(chunk)
             metadatas.append({
                 'doc_id': document.id,
                 'doc_title': document.title,
                 'doc_type': document.type,
                 'chunk_index': i,
+                'chunk_id': chunk_id,
                 'source_url': document.source_url
             })
-            ids.append(f"{document.id}_{i}")  # Assign unique IDs to chunks
+            ids.append(chunk_id)
 
-        if self.vector_store is not None:
-            self.vector_store.add_texts(all_chunks, metadatas=metadatas, ids=ids)
-        else:
-            self.vector_store = FAISS.from_texts(all_chunks, self.embeddings, metadatas=metadatas, ids=ids)
+        with stage('embedding'):
+            vectors = self._embed_chunks(all_chunks) if all_chunks else []
+        with self._lock:
+            # Persisted first: if it fails, the document is not left half-added in memory
+            if self._writable_store() is not None:
+                self.store.append_document(asdict(document), ids, metadatas, np.array(vectors, dtype=np.float32))
 
-        self.vector_store.save_local("faiss_index")
+            self._add_to_vector_store(all_chunks, vectors, metadatas, ids)
+            self._register_document(document, ids)
         return document, len(chunks)
 
-    
+    def add_document_once(self,
+                          title: str,
+                          content: str,
+                          doc_type: str,
+                          source_url: str,
+                          metadata: Dict = None) -> Document:
+        """Add a web page unless a document with the same source_url is already there"""
+        while True:
+            with self._lock:
+                if source_url in self.url_index:
+                    document = self.documents[self.url_index[source_url]]
+                    return document, len(self.chunk_ids[document.id])
+                pending = self._pending_urls.get(source_url)
+                if pending is None:
+                    pending = self._pending_urls[source_url] = threading.Event()
+                    break
+            # Another session is embedding the same page right now, use its document
+            pending.wait()
+
+        try:
+            return self.add_document(title=title, content=content, doc_type=doc_type, metadata=metadata, source_url=source_url)
+        finally:
+            with self._lock:
+                del self._pending_urls[source_url]
+            pending.set()
+
+    def add_shared_document(self,
+                            title: str,
+                            content: str,
+                            doc_type: str,
+                            source_url: str,
+                            metadata: Dict = None) -> Document:
+        """Add a public web page to the shared knowledge base (once for all sessions) and link it here"""
+        if self.shared is None:
+            return self.add_document(title=title, content=content, doc_type=doc_type, metadata=metadata, source_url=source_url)
+
+        document, chunk_count = self.shared.add_document_once(
+            title=title, content=content, doc_type=doc_type, source_url=source_url, metadata=metadata
+        )
+        self.link_shared_document(document.id)
+        return document, chunk_count
+
+    def link_shared_document(self, doc_id: str, linked: bool = True) -> None:
+        """List a shared document in this overlay (linked) or hide it from this overlay's searches"""
+        with self._lock:
+            self.shared_links[doc_id] = linked
+            if self._writable_store() is not None:
+                self.store.append_link(doc_id, linked)
 
-    
     def remove_document(self, doc_id: str) -> bool:
         """Remove a document and update vector store"""
-        if doc_id in self.documents:
-            # Remove document from documents
-            del self.documents[doc_id]
-
-            # Collect IDs of chunks to delete
-            ids_to_delete = [
-                vector_id for vector_id, doc in self.vector_store.docstore._dict.items()
-                if doc.metadata.get('doc_id') == doc_id
-            ]
+        with self._lock:
+            if doc_id in self.documents:
+                self._unregister_document(doc_id)
 
-            if ids_to_delete:
-                self.vector_store.delete(ids_to_delete)
+                if self.store is not None:
+                    self.store.append_removal(doc_id)
+            elif self.shared_links.get(doc_id):
+                # Shared documents stay for the other sessions, this one just stops using it.
+                # Its cached answers stay valid for them: lookups only reuse answers generated from the asker's own search results
+                self.link_shared_document(doc_id, linked=False)
+                return True
+            else:
+                return False
 
+        if self.answer_cache is not None:
+            self.answer_cache.invalidate_document(doc_id)
+        return True
+
+    def has_documents(self) -> bool:
+        """Whether searches can return anything, counting the shared knowledge base"""
+        if self.documents:
             return True
-        return False
+        return self.shared is not None and self.shared.has_documents()
+
+    def compact(self) -> None:
+        """Drop removed documents from the on-disk store"""
+        if self.store is not None:
+            self.store.compact()
 
    
     
-    def search(self, query: str, k: int = 3, relevance_threshold: float = 1.5, llm_client = None) -> List[Dict]:
+    def _search_by_vector(self, query_vector: List[float], k: int, hidden_doc_ids=()) -> List:
+        with self._lock:
+            if not self.vector_store:
+                return []
+            if self.removed_chunk_ids or hidden_doc_ids:
+                removed = self.removed_chunk_ids
+                return self.vector_store.similarity_search_with_score_by_vector(
+                    query_vector, k=k,
+                    filter=lambda metadata: metadata['doc_id'] not in removed and metadata['doc_id'] not in hidden_doc_ids
+                )
+            return self.vector_store.similarity_search_with_score_by_vector(query_vector, k=k)
+
+    def search(self, query: str, k: int = 3, relevance_threshold: float = 1.5, llm_client = None, query_vector: Optional[List[float]] = None) -> List[Dict]:
         """Search for relevant chunks across all documents"""
-        if not self.vector_store:
+        if not self.vector_store and (self.shared is None or not self.shared.has_documents()):
             return []
-        
-            
-        results = self.vector_store.similarity_search_with_score(query, k=k)
+
+        if query_vector is None:
+            with stage('query_embedding'):
+                query_vector = self.embeddings.embed_query(query)
+        with stage('faiss_search'):
+            results = self._search_by_vector(query_vector, k)
+            if self.shared is not None:
+                hidden = {doc_id for doc_id, linked in self.shared_links.items() if not linked}
+                # Same embedding model on both sides, so the L2 distances can be merged directly
+                results = sorted(results + self.shared._search_by_vector(query_vector, k, hidden), key=lambda result: result[1])[:k]
         
         formatted_results = [
             {
                 'content': doc.page_content,
+                'doc_id': doc.metadata['doc_id'],
+                'chunk_id': doc.metadata.get('chunk_id', f"{doc.metadata['doc_id']}_{doc.metadata['chunk_index']}"),
                 'doc_title': doc.metadata['doc_title'],
                 'doc_type': doc.metadata['doc_type'],
                 'source_url': doc.metadata.get('source_url'),
@@ -116,17 +389,46 @@ class DocumentManager:
     
     def get_document_list(self) -> List[Dict]:
         """Get a list of all documents for the sidebar"""
-        return [
+        documents = [
             {
                 'id': doc.id,
                 'title': doc.title,
                 'type': doc.type,
                 'timestamp': doc.timestamp,
-                'chunk_count': len(doc.chunks),
+                'chunk_count': len(self.chunk_ids.get(doc.id, [])),
                 'source_url': doc.source_url
             }
             for doc in self.documents.values()
         ]
+        if self.shared is not None:
+            documents += [
+                {
+                    'id': doc.id,
+                    'title': doc.title,
+                    'type': doc.type,
+                    'timestamp': doc.timestamp,
+                    'chunk_count': len(self.shared.chunk_ids.get(doc.id, [])),
+                    'source_url': doc.source_url,
+                    'shared': True
+                }
+                for doc in (self.shared.documents.get(doc_id) for doc_id, linked in list(self.shared_links.items()) if linked)
+                if doc is not None
+            ]
+        return documents
+
+    def get_document_stats(self, doc_id: str) -> Optional[Dict]:
+        """Get per-document statistics without looking at other documents' chunks"""
+        doc = self.documents.get(doc_id)
+        if doc is None:
+            return None
+        chunk_ids = self.chunk_ids.get(doc_id, [])
+        return {
+            'id': doc.id,
+            'chunk_count': len(chunk_ids),
+            'chunk_ids': list(chunk_ids),
+            'characters': len(doc.content),
+            'average_chunk_characters': sum(len(chunk) for chunk in doc.chunks) / len(doc.chunks) if doc.chunks else 0
+        }
     
     def get_context(self, 
                         query: str,
@@ -154,15 +456,49 @@ class DocumentManager:
                          query: str,
                          llm_client,
                          k: int = 3,
-                         include_citations: bool = True) -> Dict:
-        """Generate a response using RAG with citations"""
-        relevant_chunks = self.search(query, k=k, llm_client= llm_client)
+                         include_citations: bool = True,
+                         on_token: Optional[Callable[[str], None]] = None,
+                         on_citations: Optional[Callable[[List[Dict]], None]] = None,
+                         on_reset: Optional[Callable[[], None]] = None) -> Dict:
+        """
+        Generate a response using RAG with citations.
+
+        Args:
+            query: User question
+            llm_client: OpenAI-compatible client
+            k: Number of chunks given as context
+            include_citations: Kept for compatibility, citations are always returned
+            on_token: If set, the completion is streamed and every new piece of the answer is passed to it
+            on_citations: Called with the citations as soon as they are known, before the answer
+            on_reset: Called when a streamed answer turns out to be NOT_FOUND, so the client
+                discards the citations and the part of the answer it already received
+
+        Returns:
+            Dict: {'response', 'citations'}, with the full answer also when streaming
+        """
+        query_vector = None
+        if self.answer_cache is not None and self.has_documents():
+            # Embedded once for the search and the answer cache
+            with stage('query_embedding'):
+                query_vector = self.embeddings.embed_query(query)
+
+        relevant_chunks = self.search(query, k=k, llm_client= llm_client, query_vector=query_vector)
         
         if not relevant_chunks:
             return {
-                'response': 'No relevant context found to answer the question.',
+                'response': NO_CONTEXT_RESPONSE,
                 'citations': []
             }
+
+        if self.answer_cache is not None:
+            # Only reused if it was generated from the very chunks this session would use now
+            cached = self.answer_cache.lookup(query_vector, relevant_chunks)
+            if cached is not None:
+                if on_citations is not None:
+                    on_citations(cached['citations'])
+                if on_token is not None:
+                    on_token(cached['response'])
+                return cached
             
         # Prepare context with citations
         context = "\n\n".join([
@@ -176,34 +512,78 @@ class DocumentManager:
             {"role": "user", "content": f"Context:\n{context}\n\nQuestion: {query} If the context is unrelated, return NOT_FOUND."}
         ]
 
-        
-        
-        response = llm_client.chat.completions.create(
-            model="gpt-4o-mini", # Old was tgi
-            max_tokens=1000,
-            messages=messages,
-            temperature=0.3
-        )
-        
-        answer = response.choices[0].message.content
+        citations = [
+            {
+                'number': i + 1,
+                'doc_title': chunk['doc_title'],
+                'doc_type': chunk['doc_type'],
+                'source_url': chunk['source_url'],
+                'content': chunk['content'][:200] + '...'  # Preview
+            }
+            for i, chunk in enumerate(relevant_chunks)
+        ]
+        if on_citations is not None:
+            on_citations(citations)
+
+        with stage('answer_generation'):
+            if on_token is None:
+                response = llm_client.chat.completions.create(
+                    model="gpt-4o-mini", # Old was tgi
+                    max_tokens=1000,
+                    messages=messages,
+                    temperature=0.3
+                )
+                answer = response.choices[0].message.content
+            else:
+                answer = self._stream_completion(llm_client, messages, on_token)
 
-        if "NOT_FOUND" in answer or "no he trobat" in answer.lower():
-            print(response.choices[0].message.content)
+        if is_not_found(answer):
+            print(answer)
+            if on_token is not None and on_reset is not None:
+                on_reset()
             return {
-                'response': 'No relevant context found to answer the question.',
+                'response': NO_CONTEXT_RESPONSE,
                 'citations': []
             }
         
-        return {
-            'response': response.choices[0].message.content,
-            'citations': [
-                {
-                    'number': i + 1,
-                    'doc_title': chunk['doc_title'],
-                    'doc_type': chunk['doc_type'],
-                    'source_url': chunk['source_url'],
-                    'content': chunk['content'][:200] + '...'  # Preview
-                }
-                for i, chunk in enumerate(relevant_chunks)
-            ]
-        }
\ No newline at end of file
+        result = {
+            'response': answer,
+            'citations': citations
+        }
+        if self.answer_cache is not None:
+            self.answer_cache.store(query, query_vector, result, relevant_chunks)
+        return result
+
+    @staticmethod
+    def _stream_completion(llm_client, messages: List[Dict], on_token: Callable[[str], None]) -> str:
+        """Stream a completion to on_token and return the full answer"""
+        stream = llm_client.chat.completions.create(
+            model="gpt-4o-mini",
+            max_tokens=1000,
+            messages=messages,
+            temperature=0.3,
+            stream=True
+        )
+
+        answer = ""
+        emitted = 0
+        # Only the new text (plus a marker's length before it) is searched for a NOT_FOUND marker
+        overlap = max(len(marker) for marker in NOT_FOUND_MARKERS) - 1
+        checked = 0
+        for event in stream:
+            if not event.choices or not event.choices[0].delta.content:
+                continue
+            answer += event.choices[0].delta.content
+            if is_not_found(answer[max(0, checked - overlap):]):
+                # The caller falls back to web search (and resets what was streamed), the rest is not needed
+                stream.close()
+                return answer
+            checked = len(answer)
+            if len(answer) < STREAM_HOLDBACK_CHARS:
+                continue
+            on_token(answer[emitted:])
+            emitted = len(answer)
+
+        if emitted < len(answer):
+            on_token(answer[emitted:])
+        return answer
@@ -0,0 +1,326 @@
+import os
+import json
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import logging
+
+try:
+    import fcntl
+except ImportError:  # Windows: only threads of one process are synchronised
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+LOG_FILE = "documents.jsonl"
+LOCK_FILE = ".lock"
+
+
+class DocumentStore:
+    """
+    Append-only on-disk persistence for a single DocumentManager (one session, tenant or the shared knowledge base).
+
+    The directory holds two files:
+        documents.jsonl: log of 'add' / 'remove' / 'link' operations (documents, chunk ids and metadata)
+        vectors-<generation>.f32: raw float32 matrix with the embeddings of every added chunk
+
+    Adding a document appends one log line and its vector rows, so the cost of persisting
+    does not grow with the size of the index. Removed rows stay on disk until compaction
+    rewrites both files with the live documents only.
+
+    Writes take a file lock, so several processes can append to the same store, and
+    read_new_entries lets each of them pick up what the others appended.
+    """
+
+    def __init__(self, directory: str, compact_ratio: float = 0.5, min_compact_rows: int = 256):
+        """
+        Open (or create) a store.
+
+        Args:
+            directory: Directory for this store's files
+            compact_ratio: Fraction of dead vector rows that triggers an automatic compaction
+            min_compact_rows: Minimum number of dead rows before compacting automatically
+        """
+        self.directory = directory
+        self.compact_ratio = compact_ratio
+        self.min_compact_rows = min_compact_rows
+        self._lock = threading.Lock()
+        self._dim: Optional[int] = None
+        # Bookkeeping of the log up to _offset bytes of generation _generation
+        self._generation = 0
+        self._offset = 0
+        self._total_rows = 0
+        self._dead_rows = 0
+        # doc_id -> (first vector row, number of rows)
+        self._rows: Dict[str, Tuple[int, int]] = {}
+        # doc_id -> True if linked, False if hidden (see DocumentManager.link_shared_document)
+        self._links: Dict[str, bool] = {}
+        # Position of the last entry handed to the DocumentManager by load / read_new_entries
+        self._reader_generation: Optional[int] = None
+        self._reader_offset = 0
+        # (inode, size, mtime) of the log when the reader last read it, to skip reads when nothing changed
+        self._reader_stat: Optional[Tuple[int, int, int]] = None
+        os.makedirs(directory, exist_ok=True)
+
+        with self._locked():
+            if not os.path.exists(self._log_path):
+                self._write_header(self._log_path, self._generation)
+            self._catch_up()
+
+    @property
+    def _log_path(self) -> str:
+        return os.path.join(self.directory, LOG_FILE)
+
+    def _vectors_path(self, generation: int) -> str:
+        return os.path.join(self.directory, f"vectors-{generation}.f32")
+
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            with open(os.path.join(self.directory, LOCK_FILE), "a") as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _log_stat(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            stat = os.stat(self._log_path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    def _write_header(self, path: str, generation: int) -> None:
+        with open(path, "w", encoding="utf-8") as log:
+            log.write(json.dumps({"op": "header", "generation": generation}) + "\n")
+
+    def _read_log(self, generation: Optional[int], offset: int) -> Tuple[int, List[Dict], int, bool]:
+        """
+        Read the log entries written after offset.
+
+        Returns:
+            Tuple with the current generation, the entries, the offset after them and whether
+            the log was rewritten by a compaction (then every entry is returned, from the start)
+        """
+        with open(self._log_path, "rb") as log:
+            header = log.readline()
+            current_generation = json.loads(header)["generation"]
+            reset = current_generation != generation
+            log.seek(len(header) if reset or offset < len(header) else offset)
+
+            entries = []
+            end = log.tell()
+            for line in log:
+                if not line.endswith(b"\n"):
+                    # Being written by another process (or torn by a crash), read it next time
+                    break
+                end += len(line)
+                if not line.strip():
+                    continue
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    logger.warning(f"Skipping corrupt entry in {self._log_path}")
+            return current_generation, entries, end, reset
+
+    def _catch_up(self) -> None:
+        """Apply entries appended by other processes (or everything, after a compaction) to the bookkeeping"""
+        generation, entries, end, reset = self._read_log(self._generation if self._offset else None, self._offset)
+        if reset:
+            self._total_rows = 0
+            self._dead_rows = 0
+            self._rows = {}
+            self._links = {}
+        self._generation = generation
+        self._offset = end
+
+        for entry in entries:
+            op = entry["op"]
+            if op == "add":
+                doc_id = entry["document"]["id"]
+                self._rows[doc_id] = (entry["row"], len(entry["ids"]))
+                self._total_rows = max(self._total_rows, entry["row"] + len(entry["ids"]))
+                self._dim = entry["dim"] or self._dim
+            elif op == "remove" and entry["doc_id"] in self._rows:
+                self._dead_rows += self._rows.pop(entry["doc_id"])[1]
+            elif op == "link":
+                self._links[entry["doc_id"]] = entry["linked"]
+
+    def _append_entries(self, entries: List[Dict]) -> None:
+        reader_up_to_date = self._reader_generation == self._generation and self._reader_offset == self._offset
+        with open(self._log_path, "a", encoding="utf-8") as log:
+            # Under the file lock a line without its newline is the tear of a crash: drop it, or our entry would be glued to it
+            log.truncate(self._offset)
+            log.write("".join(json.dumps(entry) + "\n" for entry in entries))
+        # Our own entries are applied through the same path as everybody else's
+        self._catch_up()
+        if reader_up_to_date:
+            # The DocumentManager writing them already applied them, don't hand them back
+            self._reader_offset = self._offset
+
+    def append_document(self, document: Dict, ids: List[str], metadatas: List[Dict], vectors: np.ndarray) -> None:
+        """
+        Persist a newly added document and the embeddings of its chunks.
+
+        Args:
+            document: Document fields (as produced by dataclasses.asdict)
+            ids: Vector store ids of the chunks
+            metadatas: Vector store metadata of the chunks
+            vectors: float32 matrix with one row per chunk
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if len(ids):
+            vectors = vectors.reshape(len(ids), -1)
+        with self._locked():
+            self._catch_up()
+            dim = vectors.shape[1] if len(ids) else self._dim
+            if self._dim is not None and dim != self._dim:
+                raise ValueError(f"Embedding dimension {dim} does not match the store ({self._dim})")
+            self._dim = dim
+
+            row = self._total_rows
+            if len(ids):
+                with open(self._vectors_path(self._generation), "ab") as vector_file:
+                    # Rows go wherever the file ends: rows orphaned by a crash before their log line was written stay dead
+                    row_bytes = 4 * dim
+                    offset = vector_file.tell()
+                    if offset % row_bytes:
+                        offset -= offset % row_bytes
+                        vector_file.truncate(offset)
+                    row = offset // row_bytes
+                    vector_file.write(vectors.tobytes())
+
+            self._append_entries([{"op": "add", "document": document, "ids": ids, "metadatas": metadatas, "row": row, "dim": dim}])
+
+    def append_removal(self, doc_id: str) -> None:
+        """Persist the removal of a document, compacting if enough rows are dead"""
+        with self._locked():
+            self._catch_up()
+            if doc_id not in self._rows:
+                return
+            self._append_entries([{"op": "remove", "doc_id": doc_id}])
+
+            if self._dead_rows >= self.min_compact_rows and self._dead_rows >= self.compact_ratio * self._total_rows:
+                self._compact()
+
+    def append_link(self, doc_id: str, linked: bool) -> None:
+        """Persist that a document of another store was linked to (or hidden from) this one"""
+        with self._locked():
+            self._catch_up()
+            self._append_entries([{"op": "link", "doc_id": doc_id, "linked": linked}])
+
+    def load_links(self) -> Dict[str, bool]:
+        with self._locked():
+            self._catch_up()
+            return dict(self._links)
+
+    def load(self) -> List[Tuple[Dict, List[str], List[Dict], np.ndarray]]:
+        """
+        Read back every live document with its chunk embeddings.
+
+        Returns:
+            List of (document, ids, metadatas, vectors) tuples, in insertion order
+        """
+        with self._locked():
+            # Taken before reading: an append landing during the read changes it, and is read next time
+            log_stat = self._log_stat()
+            self._catch_up()
+            generation, log_entries, end, _ = self._read_log(None, 0)
+            entries = self._live_entries(log_entries)
+            self._reader_generation, self._reader_offset, self._reader_stat = generation, end, log_stat
+
+            matrix = self._read_vectors()
+            return [
+                (entry["document"], entry["ids"], entry["metadatas"], matrix[entry["row"]:entry["row"] + len(entry["ids"])])
+                for entry in entries.values()
+            ]
+
+    def read_new_entries(self) -> Optional[List[Dict]]:
+        """
+        Entries appended (by any process) since the last load or read_new_entries call.
+
+        Returns:
+            List of 'add', 'remove' and 'link' entries ('add' entries carry their 'vectors'),
+            or None if the store was compacted meanwhile and has to be loaded again
+        """
+        log_stat = self._log_stat()
+        if log_stat is not None and log_stat == self._reader_stat:
+            # Nothing appended nor compacted since the last read: no lock, no read (called before every chat answer)
+            return []
+        with self._locked():
+            self._catch_up()
+            generation, entries, end, reset = self._read_log(self._reader_generation, self._reader_offset)
+            if reset:
+                return None
+            self._reader_offset, self._reader_stat = end, log_stat
+
+            matrix = self._read_vectors() if any(entry["op"] == "add" for entry in entries) else None
+            for entry in entries:
+                if entry["op"] == "add":
+                    entry["vectors"] = matrix[entry["row"]:entry["row"] + len(entry["ids"])]
+            return entries
+
+    def _live_entries(self, log_entries: List[Dict]) -> Dict[str, Dict]:
+        entries: Dict[str, Dict] = {}
+        for entry in log_entries:
+            if entry["op"] == "add":
+                entries[entry["document"]["id"]] = entry
+            elif entry["op"] == "remove":
+                entries.pop(entry["doc_id"], None)
+        return entries
+
+    def _read_vectors(self) -> np.ndarray:
+        path = self._vectors_path(self._generation)
+        if self._dim is None or not os.path.exists(path) or os.path.getsize(path) == 0:
+            return np.empty((0, self._dim or 0), dtype=np.float32)
+        # Memory-map instead of reading, rows are only copied when FAISS ingests them
+        rows = os.path.getsize(path) // (4 * self._dim)
+        return np.memmap(path, dtype=np.float32, mode="r", shape=(rows, self._dim))
+
+    def compact(self) -> None:
+        """Rewrite the store keeping only live documents"""
+        with self._locked():
+            self._catch_up()
+            self._compact()
+
+    def _compact(self) -> None:
+        _, log_entries, _, _ = self._read_log(None, 0)
+        entries = self._live_entries(log_entries)
+        reader_up_to_date = self._reader_generation == self._generation and self._reader_offset == self._offset
+
+        matrix = self._read_vectors()
+        old_generation = self._generation
+        generation = old_generation + 1
+
+        # Write the new generation next to the old one and switch over by replacing the log,
+        # which is atomic: a crash leaves either the old or the new generation, never a mix
+        row = 0
+        tmp_log = self._log_path + ".tmp"
+        self._write_header(tmp_log, generation)
+        with open(self._vectors_path(generation), "wb") as vector_file, open(tmp_log, "a", encoding="utf-8") as log:
+            for entry in entries.values():
+                count = len(entry["ids"])
+                vector_file.write(np.ascontiguousarray(matrix[entry["row"]:entry["row"] + count]).tobytes())
+                log.write(json.dumps({**entry, "row": row}) + "\n")
+                row += count
+            for doc_id, linked in self._links.items():
+                log.write(json.dumps({"op": "link", "doc_id": doc_id, "linked": linked}) + "\n")
+        del matrix
+        os.replace(tmp_log, self._log_path)
+
+        old_vectors = self._vectors_path(old_generation)
+        if os.path.exists(old_vectors):
+            try:
+                os.remove(old_vectors)
+            except OSError as e:
+                logger.warning(f"Could not remove {old_vectors}: {str(e)}")
+
+        self._offset = 0
+        self._catch_up()
+        if reader_up_to_date:
+            # Our own DocumentManager already holds exactly the live documents, no need to reload it
+            self._reader_generation, self._reader_offset = self._generation, self._offset
@@ -0,0 +1,259 @@
+import os
+import json
+import hashlib
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict
+from typing import Dict, List, Optional
+import numpy as np
+import logging
+
+try:
+    import fcntl
+except ImportError:  # Windows: only threads of one process are synchronised
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+LOCK_FILE = ".lock"
+
+
+class EmbeddingCache:
+    """
+    Content-addressed cache of chunk embeddings, shared by every DocumentManager in the process.
+
+    Lookups go first to an in-memory LRU and then to an optional disk tier made of:
+        keys-<generation>.txt: one content hash per line, the line number is the row of its vector
+        vectors-<generation>.f32: memory-mapped float32 matrix with one embedding per row
+        meta.json: embedding dimension, model name and current generation
+
+    Appends take a file lock (like LaIA_document_store.py), so several processes can share
+    the directory and pick up each other's rows. Once the vectors take more than
+    max_disk_bytes, a compaction rewrites the disk tier as a new generation with the newest
+    half of the rows.
+    """
+
+    def __init__(self, model_name: str, directory: Optional[str] = None, max_memory_entries: int = 10000,
+                 max_disk_bytes: int = 512 * 1024 * 1024):
+        """
+        Args:
+            model_name: Name of the embedding model, part of every key so models never mix
+            directory: Directory for the disk tier (memory only if None)
+            max_memory_entries: Number of embeddings kept in the in-memory LRU
+            max_disk_bytes: Size of the vectors file above which the disk tier is compacted
+        """
+        self.model_name = model_name
+        self.directory = directory
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._dim: Optional[int] = None
+        self._matrix: Optional[np.ndarray] = None
+        # Disk tier of generation _generation, read up to _keys_offset bytes of its keys file
+        self._rows: Dict[str, int] = {}
+        self._generation = 0
+        self._disk_rows = 0
+        self._keys_offset = 0
+        self.hits = 0
+        self.misses = 0
+        self.compactions = 0
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            with self._lock, self._locked_files():
+                self._catch_up()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _keys_path(self, generation: int) -> str:
+        return self._path(f"keys-{generation}.txt")
+
+    def _vectors_path(self, generation: int) -> str:
+        return self._path(f"vectors-{generation}.f32")
+
+    @contextmanager
+    def _locked_files(self):
+        """File lock of the disk tier, taken while holding self._lock"""
+        with open(self._path(LOCK_FILE), "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _write_meta(self, generation: int) -> None:
+        tmp_path = self._path("meta.json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as meta_file:
+            json.dump({"model": self.model_name, "dim": self._dim, "generation": generation}, meta_file)
+        os.replace(tmp_path, self._path("meta.json"))
+
+    def _catch_up(self) -> None:
+        """Read the rows appended by other processes (or everything, after a compaction), under the file lock"""
+        if not os.path.exists(self._path("meta.json")):
+            return
+        with open(self._path("meta.json"), "r", encoding="utf-8") as meta_file:
+            meta = json.load(meta_file)
+        if meta["model"] != self.model_name:
+            logger.warning(
+                f"Embedding cache in {self.directory} belongs to {meta['model']}, not {self.model_name}: "
+                f"the disk tier is disabled and embeddings are only cached in memory. "
+                f"Use another EMBEDDING_CACHE_FOLDER to keep them on disk."
+            )
+            self.directory = None
+            self._rows.clear()
+            return
+        self._dim = meta["dim"]
+
+        generation = meta.get("generation", 0)
+        if generation != self._generation:
+            self._generation = generation
+            self._rows.clear()
+            self._disk_rows = 0
+            self._keys_offset = 0
+            self._matrix = None
+
+        keys_path, vectors_path = self._keys_path(generation), self._vectors_path(generation)
+        if not os.path.exists(keys_path) or not os.path.exists(vectors_path):
+            return
+        vector_rows = os.path.getsize(vectors_path) // (4 * self._dim)
+        with open(keys_path, "rb") as keys_file:
+            keys_file.seek(self._keys_offset)
+            for line in keys_file:
+                # Vectors are written before their key, so a key without a full vector row
+                # (or a key line without its newline) can only be the tear of a crash
+                if not line.endswith(b"\n") or self._disk_rows >= vector_rows:
+                    break
+                self._rows[line.decode("utf-8").strip()] = self._disk_rows
+                self._disk_rows += 1
+                self._keys_offset += len(line)
+
+    def key(self, text: str) -> str:
+        return hashlib.sha1(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def _disk_vector(self, key: str) -> Optional[np.ndarray]:
+        row = self._rows[key]
+        if self._matrix is None or row >= self._matrix.shape[0]:
+            # Rows appended since the file was mapped: catch up (the generation may have changed) and map it again
+            with self._locked_files():
+                self._catch_up()
+                if self.directory is None or key not in self._rows:
+                    return None
+                row = self._rows[key]
+                self._matrix = np.memmap(self._vectors_path(self._generation), dtype=np.float32, mode="r",
+                                         shape=(self._disk_rows, self._dim))
+        return np.array(self._matrix[row])
+
+    def _remember(self, key: str, vector: np.ndarray) -> None:
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def get_many(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """
+        Look up the embeddings of several texts.
+
+        Returns:
+            List with the cached embedding of each text, or None where it is not cached
+        """
+        results = []
+        with self._lock:
+            for text in texts:
+                key = self.key(text)
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                elif key in self._rows:
+                    vector = self._disk_vector(key)
+                    if vector is not None:
+                        self._remember(key, vector)
+
+                if vector is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+                results.append(vector)
+        return results
+
+    def put_many(self, texts: List[str], vectors) -> None:
+        """Store the embeddings of several texts"""
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(texts), -1)
+        with self._lock:
+            new_rows = {}
+            for text, vector in zip(texts, vectors):
+                key = self.key(text)
+                self._remember(key, vector)
+                if self.directory is not None and key not in self._rows:
+                    new_rows[key] = vector
+
+            if new_rows:
+                with self._locked_files():
+                    self._append_to_disk(new_rows)
+
+    def _append_to_disk(self, new_rows: Dict[str, np.ndarray]) -> None:
+        self._catch_up()
+        if self.directory is None:
+            return
+        keys = [key for key in new_rows if key not in self._rows]
+        if not keys:
+            return
+        vectors = np.stack([new_rows[key] for key in keys])
+        if self._dim is None:
+            self._dim = vectors.shape[1]
+            self._write_meta(self._generation)
+        elif vectors.shape[1] != self._dim:
+            raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match the cache ({self._dim})")
+
+        # Drop the torn tail of a crashed append before writing after the last complete row
+        with open(self._vectors_path(self._generation), "ab") as vector_file:
+            vector_file.truncate(self._disk_rows * 4 * self._dim)
+            vector_file.write(np.ascontiguousarray(vectors).tobytes())
+        with open(self._keys_path(self._generation), "ab") as keys_file:
+            keys_file.truncate(self._keys_offset)
+            keys_file.write("".join(f"{key}\n" for key in keys).encode("utf-8"))
+        self._catch_up()
+
+        if self._disk_rows * 4 * self._dim > self.max_disk_bytes:
+            self._compact()
+
+    def _compact(self) -> None:
+        """Rewrite the disk tier as a new generation holding the newest half of the rows"""
+        keep_rows = max(1, self.max_disk_bytes // (8 * self._dim))
+        newest = sorted(self._rows.items(), key=lambda item: item[1])[-keep_rows:]
+        matrix = np.memmap(self._vectors_path(self._generation), dtype=np.float32, mode="r",
+                           shape=(self._disk_rows, self._dim))
+        old_generation, generation = self._generation, self._generation + 1
+
+        # New files first, then meta.json is replaced, which is atomic: a crash leaves either generation, never a mix
+        with open(self._vectors_path(generation), "wb") as vector_file:
+            vector_file.write(np.ascontiguousarray(matrix[[row for _, row in newest]]).tobytes())
+        with open(self._keys_path(generation), "wb") as keys_file:
+            keys_file.write("".join(f"{key}\n" for key, _ in newest).encode("utf-8"))
+        del matrix
+        self._write_meta(generation)
+
+        for path in (self._vectors_path(old_generation), self._keys_path(old_generation)):
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.warning(f"Could not remove {path}: {str(e)}")
+        self.compactions += 1
+        logger.info(f"Compacted the embedding cache from {self._disk_rows} to {len(newest)} rows")
+        self._catch_up()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'memory_entries': len(self._memory),
+                'disk_entries': len(self._rows),
+                'disk_bytes': self._disk_rows * 4 * (self._dim or 0),
+                'compactions': self.compactions,
+            }
@@ -0,0 +1,149 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class _EmbeddingRequest:
+    def __init__(self, texts: List[str]):
+        self.texts = texts
+        self.future: Future = Future()
+        self.results: List = [None] * len(texts)
+        self.next_index = 0
+        self.remaining = len(texts)
+        self.lock = threading.Lock()
+
+
+class EmbeddingService:
+    """
+    Embeds texts for every session on a dedicated worker pool.
+
+    Requests from all threads are coalesced into micro-batches of up to max_batch_size
+    texts, waiting at most max_wait seconds for a batch to fill. Batches are filled
+    round-robin across pending requests, so a large PDF is spread over many batches
+    and cannot hold back the few chunks of a web page submitted after it.
+    """
+
+    def __init__(self, embeddings, max_batch_size: int = 32, max_wait: float = 0.02, num_workers: int = 2):
+        """
+        Args:
+            embeddings: Langchain embeddings object used to embed each batch
+            max_batch_size: Maximum number of texts per batch
+            max_wait: Maximum seconds to wait for a batch to fill before sending it
+            num_workers: Number of batches embedded at the same time
+        """
+        self.embeddings = embeddings
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._pending: "deque[_EmbeddingRequest]" = deque()
+        self._pending_texts = 0
+        self._condition = threading.Condition()
+        self._closed = False
+        # Only form a batch once a worker is free, so texts keep coalescing while all workers are busy
+        self._free_workers = threading.Semaphore(num_workers)
+        self._executor = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix="embedding")
+        self._dispatcher = threading.Thread(target=self._dispatch, name="embedding-dispatcher", daemon=True)
+        self._dispatcher.start()
+
+    def submit(self, texts: List[str]) -> Future:
+        """
+        Queue texts for embedding.
+
+        Returns:
+            Future resolving to the list of embeddings, in the same order as texts
+        """
+        request = _EmbeddingRequest(list(texts))
+        if not request.texts:
+            request.future.set_result([])
+            return request.future
+
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("EmbeddingService is closed")
+            self._pending.append(request)
+            self._pending_texts += len(request.texts)
+            self._condition.notify_all()
+        return request.future
+
+    def embed_documents(self, texts: List[str]) -> List:
+        """Blocking helper with the same signature as the langchain embeddings"""
+        return self.submit(texts).result()
+
+    def close(self) -> None:
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._dispatcher.join()
+        self._executor.shutdown(wait=True)
+
+    def _dispatch(self) -> None:
+        while True:
+            self._free_workers.acquire()
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if not self._pending:
+                    self._free_workers.release()
+                    return
+
+                deadline = time.monotonic() + self.max_wait
+                while self._pending_texts < self.max_batch_size and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+
+                batch = self._take_batch()
+
+            if batch:
+                self._executor.submit(self._run_batch, batch)
+            else:
+                self._free_workers.release()
+
+    def _take_batch(self) -> List:
+        """Take up to max_batch_size texts, round-robin across pending requests"""
+        batch = []
+        size = 0
+        while self._pending and size < self.max_batch_size:
+            share = max(1, (self.max_batch_size - size) // len(self._pending))
+            request = self._pending.popleft()
+            if request.future.done():
+                # An earlier batch of this request failed, don't embed the rest of it
+                self._pending_texts -= len(request.texts) - request.next_index
+                continue
+            start = request.next_index
+            end = min(len(request.texts), start + share, start + self.max_batch_size - size)
+            batch.append((request, start, request.texts[start:end]))
+            request.next_index = end
+            size += end - start
+            self._pending_texts -= end - start
+            if end < len(request.texts):
+                self._pending.append(request)
+        return batch
+
+    def _run_batch(self, batch: List) -> None:
+        try:
+            texts = [text for _, _, request_texts in batch for text in request_texts]
+            vectors = self.embeddings.embed_documents(texts)
+
+            offset = 0
+            for request, start, request_texts in batch:
+                with request.lock:
+                    request.results[start:start + len(request_texts)] = vectors[offset:offset + len(request_texts)]
+                    request.remaining -= len(request_texts)
+                    finished = request.remaining == 0 and not request.future.done()
+                offset += len(request_texts)
+                if finished:
+                    request.future.set_result(request.results)
+        except Exception as e:
+            logger.error(f"Error embedding batch: {str(e)}")
+            for request, _, _ in batch:
+                with request.lock:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+        finally:
+            self._free_workers.release()
@@ -0,0 +1,140 @@
+import argparse
+import glob
+import json
+import os
+import time
+from typing import Dict, List, Tuple
+from LaIA_html_extractor import EXTRACTORS, get_extractor
+
+REFERENCE = 'beautifulsoup'
+
+
+def load_corpus(directory: str, base_url: str) -> List[Tuple[str, str]]:
+    """
+    (url, html) of the saved pages of a directory.
+
+    The pages are the *.html files of the directory; their URLs are read from urls.json
+    (file name -> URL) when present, otherwise they are resolved against base_url.
+    """
+    urls = {}
+    if os.path.exists(os.path.join(directory, 'urls.json')):
+        with open(os.path.join(directory, 'urls.json'), 'r', encoding='utf-8') as urls_file:
+            urls = json.load(urls_file)
+
+    pages = []
+    for path in sorted(glob.glob(os.path.join(directory, '*.html')) + glob.glob(os.path.join(directory, '*.htm'))):
+        name = os.path.basename(path)
+        with open(path, 'r', encoding='utf-8', errors='replace') as html_file:
+            pages.append((urls.get(name, base_url + name), html_file.read()))
+    return pages
+
+
+def load_page_cache(directory: str) -> List[Tuple[str, str]]:
+    """(url, html) of the pages stored in a PageCache directory"""
+    pages = []
+    for meta_path in sorted(glob.glob(os.path.join(directory, '*.json'))):
+        body_path = meta_path[:-len('.json')] + '.body'
+        if not os.path.exists(body_path):
+            continue
+        with open(meta_path, 'r', encoding='utf-8') as meta_file:
+            meta = json.load(meta_file)
+        with open(body_path, 'rb') as body_file:
+            pages.append((meta['url'], body_file.read().decode(meta.get('encoding') or 'utf-8', errors='replace')))
+    return pages
+
+
+def save_corpus(pages: List[Tuple[str, str]], directory: str) -> None:
+    """Write pages as a corpus directory readable by load_corpus"""
+    os.makedirs(directory, exist_ok=True)
+    urls = {}
+    for i, (url, html) in enumerate(pages):
+        name = f"page_{i:05d}.html"
+        urls[name] = url
+        with open(os.path.join(directory, name), 'w', encoding='utf-8') as html_file:
+            html_file.write(html)
+    with open(os.path.join(directory, 'urls.json'), 'w', encoding='utf-8') as urls_file:
+        json.dump(urls, urls_file, indent=4)
+
+
+def benchmark(pages: List[Tuple[str, str]], extractors: List[str], repeat: int = 3) -> List[Dict]:
+    """
+    Measure the speed of every extractor and compare its output with BeautifulSoup's.
+
+    Args:
+        pages: (url, html) pairs
+        extractors: Names of the extractors to compare
+        repeat: Passes over the corpus, the fastest one is reported
+
+    Returns:
+        List[Dict]: One result per extractor
+    """
+    reference = get_extractor(REFERENCE)
+    expected = [reference.extract(html, url) for url, html in pages]
+    corpus_mb = sum(len(html.encode('utf-8')) for _, html in pages) / 2 ** 20
+
+    results = []
+    for name in extractors:
+        extractor = get_extractor(name)
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            outputs = [extractor.extract(html, url) for url, html in pages]
+            best = min(best, time.perf_counter() - start)
+
+        content_mismatches = [url for (url, _), output, reference_output in zip(pages, outputs, expected) if output[0] != reference_output[0]]
+        link_mismatches = [url for (url, _), output, reference_output in zip(pages, outputs, expected) if output[1] != reference_output[1]]
+        results.append({
+            'extractor': name,
+            'pages_per_second': len(pages) / best if best else 0.0,
+            'mb_per_second': corpus_mb / best if best else 0.0,
+            'content_parity': 1 - len(content_mismatches) / len(pages),
+            'link_parity': 1 - len(link_mismatches) / len(pages),
+            'content_mismatches': content_mismatches,
+            'link_mismatches': link_mismatches,
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Speed and output parity of the HTML extractors against BeautifulSoup")
+    parser.add_argument("--corpus", help="Directory of saved pages (*.html, with an optional urls.json)")
+    parser.add_argument("--page-cache", help="PageCache directory to take the pages from instead (e.g. page_cache/)")
+    parser.add_argument("--save-corpus", help="Also write the pages as a corpus directory, to benchmark the same pages later")
+    parser.add_argument("--base-url", default="https://web.gencat.cat/", help="URL of the corpus pages without an entry in urls.json")
+    parser.add_argument("--extractors", nargs="+", default=list(EXTRACTORS), choices=list(EXTRACTORS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--show-mismatches", type=int, default=5, help="URLs of differing pages shown per extractor")
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    if args.page_cache:
+        pages = load_page_cache(args.page_cache)
+    elif args.corpus:
+        pages = load_corpus(args.corpus, args.base_url)
+    else:
+        parser.error("--corpus or --page-cache is needed")
+    if not pages:
+        parser.error("No pages found")
+    if args.save_corpus:
+        save_corpus(pages, args.save_corpus)
+
+    results = benchmark(pages, args.extractors, repeat=args.repeat)
+
+    print(f"{len(pages)} pages")
+    print(f"{'extractor':<16}{'pages/s':>10}{'MB/s':>8}{'content':>10}{'links':>8}")
+    for r in results:
+        print(f"{r['extractor']:<16}{r['pages_per_second']:>10.1f}{r['mb_per_second']:>8.2f}{r['content_parity']:>10.1%}{r['link_parity']:>8.1%}")
+    for r in results:
+        mismatches = sorted(set(r['content_mismatches'] + r['link_mismatches']))
+        if mismatches and args.show_mismatches:
+            print(f"\n{r['extractor']} differs on:")
+            for url in mismatches[:args.show_mismatches]:
+                print(f"  {url}")
+
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump(results, json_file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,370 @@
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlparse, urlunparse, parse_qsl, urlencode
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from LaIA_page_cache import PageCache, CachedPage
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HEADERS = {'User-Agent': 'Mozilla/5.0'}
+
+
+# Query parameters that only track the visitor, they never change the page
+TRACKING_PARAMS = {'gclid', 'fbclid', 'msclkid', 'yclid', 'mc_cid', 'mc_eid', '_ga', '_gl'}
+
+
+def normalize_url(url: str) -> str:
+    """
+    Canonical form of a URL, used to recognise the same page behind different links.
+
+    Lower-case scheme and host, no default port, no fragment and no tracking parameters
+    (utm_*, gclid, ...). An empty path becomes '/', other paths are kept as they are:
+    /a/ and /a can be different pages.
+    """
+    parsed = urlparse(url.strip())
+    scheme = parsed.scheme.lower()
+    host = (parsed.hostname or '').lower()
+    if parsed.port and (scheme, parsed.port) not in (('http', 80), ('https', 443)):
+        host = f"{host}:{parsed.port}"
+    path = parsed.path or '/'
+
+    query = parsed.query
+    params = parse_qsl(query, keep_blank_values=True)
+    kept = [(name, value) for name, value in params if not (name.lower().startswith('utm_') or name.lower() in TRACKING_PARAMS)]
+    if len(kept) != len(params):
+        query = urlencode(kept)
+    return urlunparse((scheme, host, path, parsed.params, query, ''))
+
+
+# Content types worth downloading: pages the extractors can read
+HTML_CONTENT_TYPES = ('text/html', 'application/xhtml+xml', 'text/plain')
+
+
+class BodyTooLarge(requests.RequestException):
+    """Raised when a response body is bigger than the fetcher's max_body_bytes"""
+
+
+class UnsupportedContentType(requests.RequestException):
+    """Raised when a response is not one of the fetcher's allowed_content_types"""
+
+
+def check_response_headers(url: str, headers, allowed_content_types, max_body_bytes: int) -> None:
+    """
+    Reject a response from its headers, before its body is downloaded.
+
+    Raises:
+        UnsupportedContentType: If the Content-Type is not allowed (a missing one is)
+        BodyTooLarge: If the declared Content-Length is over max_body_bytes
+    """
+    content_type = (headers.get('Content-Type') or '').split(';')[0].strip().lower()
+    if allowed_content_types and content_type and not content_type.startswith(tuple(allowed_content_types)):
+        raise UnsupportedContentType(f"{url} is {content_type}")
+    declared = headers.get('Content-Length')
+    if declared and declared.isdigit() and int(declared) > max_body_bytes:
+        raise BodyTooLarge(f"{url} is {declared} bytes")
+
+
+@dataclass
+class FetchResult:
+    url: str  # Final URL, after redirects
+    status_code: int
+    headers: Dict[str, str] = field(default_factory=dict)
+    content: bytes = b''
+    encoding: Optional[str] = None
+    from_cache: bool = False
+    truncated: bool = False  # Only the first read_limit_bytes of the body were read
+    extracted: Optional[Dict] = None  # {'main_content', 'links', 'extractor'} stored by a previous crawl of the page
+
+    @property
+    def text(self) -> str:
+        return self.content.decode(self.encoding or 'utf-8', errors='replace')
+
+
+class _HostLimiter:
+    def __init__(self, max_concurrent: int, min_interval: float):
+        self.semaphore = threading.Semaphore(max_concurrent)
+        self.min_interval = min_interval
+        self.lock = threading.Lock()
+        self.next_start = 0.0
+
+    def reserve(self) -> float:
+        """Take the next start time of the host, returns the seconds to wait for it"""
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_start)
+            self.next_start = start + self.min_interval
+        return start - now
+
+    def wait_turn(self) -> None:
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class UrlStatusCache:
+    """
+    Recent status codes by normalized URL, shared by everything using the same fetcher.
+
+    Pages answering 200 are remembered for ok_ttl seconds, failures (other statuses and
+    connection errors, stored as None) for the shorter error_ttl.
+    """
+
+    def __init__(self, ok_ttl: float = 3600, error_ttl: float = 300, max_entries: int = 10000):
+        self.ok_ttl = ok_ttl
+        self.error_ttl = error_ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # url -> (status code or None, expiry time), least recently recorded first
+        self._entries: "OrderedDict[str, Tuple[Optional[int], float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, url: str, status_code: Optional[int]) -> None:
+        ttl = self.ok_ttl if status_code == 200 else self.error_ttl
+        key = normalize_url(url)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (status_code, time.monotonic() + ttl)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def lookup(self, url: str) -> Tuple[bool, Optional[int]]:
+        """(found, status code) of a URL, the status being None for a connection error"""
+        key = normalize_url(url)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < time.monotonic():
+                self.misses += 1
+                return False, None
+            self.hits += 1
+            return True, entry[0]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries)}
+
+
+class Fetcher:
+    """
+    HTTP client shared by the crawler, the /url route and the source validation.
+
+    One pooled requests.Session keeps connections to the same hosts alive between pages,
+    idempotent requests are retried with exponential backoff on connection errors and
+    429/5xx answers, and every host gets at most max_per_host requests in flight, started
+    at least min_interval seconds apart.
+
+    Bodies are streamed: responses of an unexpected Content-Type or too long a
+    Content-Length are dropped before reading them, and reading stops after
+    read_limit_bytes, enough for the text of any page. Cut bodies are marked truncated
+    and never cached (nor their extracted content), since they are not the whole page.
+    Without a read limit, bodies streamed past max_body_bytes raise BodyTooLarge.
+
+    With a PageCache, pages are served from disk while fresh and revalidated with
+    conditional requests once stale. The status of every page downloaded or checked is
+    kept in a UrlStatusCache, so head() does not ask again for pages just crawled.
+    """
+
+    def __init__(self,
+                 timeout: float = 10,
+                 retries: int = 2,
+                 backoff_factor: float = 0.5,
+                 max_per_host: int = 4,
+                 min_interval: float = 0.1,
+                 max_body_bytes: int = 5 * 1024 * 1024,
+                 read_limit_bytes: Optional[int] = None,
+                 allowed_content_types: Optional[Tuple[str, ...]] = HTML_CONTENT_TYPES,
+                 pool_maxsize: int = 20,
+                 cache: Optional[PageCache] = None,
+                 statuses: Optional[UrlStatusCache] = None):
+        """
+        Args:
+            timeout: Seconds to connect and between bytes of the response
+            retries: Retries of a failed request
+            backoff_factor: Retry n waits backoff_factor * 2^(n-1) seconds
+            max_per_host: Maximum requests in flight to the same host
+            min_interval: Minimum seconds between the start of two requests to the same host
+            max_body_bytes: Bigger responses raise BodyTooLarge
+            read_limit_bytes: Bodies are cut after this many bytes instead (no cut if None), at most max_body_bytes
+            allowed_content_types: Content-Type prefixes accepted, others raise UnsupportedContentType
+                (any type if None)
+            pool_maxsize: Connections kept alive per host
+            cache: Cache of downloaded pages (no caching if None)
+            statuses: Recent status codes by URL (a new UrlStatusCache if None)
+        """
+        assert read_limit_bytes is None or read_limit_bytes <= max_body_bytes, "read_limit_bytes must not exceed max_body_bytes"
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.max_per_host = max_per_host
+        self.min_interval = min_interval
+        self.max_body_bytes = max_body_bytes
+        self.read_limit_bytes = read_limit_bytes
+        self.allowed_content_types = allowed_content_types
+        self.cache = cache
+        self.statuses = statuses or UrlStatusCache()
+        self._hosts: Dict[str, _HostLimiter] = {}
+        self._hosts_lock = threading.Lock()
+
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(['GET', 'HEAD']),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_maxsize, pool_maxsize=pool_maxsize, max_retries=retry)
+        self.session = requests.Session()
+        self.session.headers.update(DEFAULT_HEADERS)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def _limiter(self, url: str) -> _HostLimiter:
+        host = urlparse(url).netloc.lower()
+        with self._hosts_lock:
+            if host not in self._hosts:
+                self._hosts[host] = _HostLimiter(self.max_per_host, self.min_interval)
+            return self._hosts[host]
+
+    def reserve_turn(self, url: str) -> float:
+        """
+        Reserve the next request slot of the url's host without sleeping, for clients that
+        do not go through this fetcher's session (AsyncCrawler), so min_interval holds across both.
+
+        Returns:
+            float: Seconds to wait before sending the request
+        """
+        return self._limiter(url).reserve()
+
+    @contextmanager
+    def _host_slot(self, url: str):
+        limiter = self._limiter(url)
+        with limiter.semaphore:
+            limiter.wait_turn()
+            yield
+
+    def get(self, url: str, headers: Optional[Dict[str, str]] = None) -> FetchResult:
+        """
+        Download a page, or take it from the cache.
+
+        Raises:
+            requests.RequestException: On connection errors, after the retries
+            BodyTooLarge: If the body is bigger than max_body_bytes
+            UnsupportedContentType: If the page is not of an allowed content type
+        """
+        result = self._get(url, headers)
+        self.statuses.record(url, result.status_code)
+        return result
+
+    def _get(self, url: str, headers: Optional[Dict[str, str]] = None) -> FetchResult:
+        if self.cache is None:
+            return self._download(url, headers)
+
+        key = normalize_url(url)
+        cached = self.cache.get(key)
+        if cached is not None and self.cache.is_fresh(cached):
+            self.cache.record('hit')
+            return self._cached_result(cached)
+
+        request_headers = dict(headers or {})
+        if cached is not None:
+            request_headers.update(cached.conditional_headers())
+
+        result = self._download(url, request_headers)
+        if result.status_code == 304 and cached is not None:
+            self.cache.record('revalidated')
+            self.cache.mark_revalidated(key, cached)
+            return self._cached_result(cached)
+
+        self.cache.record('miss')
+        if result.status_code == 200 and not result.truncated:
+            self.cache.put(key, CachedPage(
+                url=result.url,
+                status_code=result.status_code,
+                headers=result.headers,
+                content=result.content,
+                encoding=result.encoding,
+                fetched=time.time(),
+            ))
+        return result
+
+    def store_extracted(self, url: str, main_content: str, links, extractor: str) -> None:
+        """Keep the content and links parsed from a page by an extractor, returned as FetchResult.extracted by later gets"""
+        if self.cache is not None:
+            self.cache.set_extracted(normalize_url(url), main_content, links, extractor)
+
+    @staticmethod
+    def _cached_result(page: CachedPage) -> FetchResult:
+        return FetchResult(
+            url=page.url,
+            status_code=page.status_code,
+            headers=page.headers,
+            content=page.content,
+            encoding=page.encoding,
+            from_cache=True,
+            extracted=page.extracted,
+        )
+
+    def _download(self, url: str, headers: Optional[Dict[str, str]] = None) -> FetchResult:
+        with self._host_slot(url):
+            with self.session.get(url, headers=headers, timeout=self.timeout, stream=True) as response:
+                if response.status_code == 200:
+                    check_response_headers(url, response.headers, self.allowed_content_types, self.max_body_bytes)
+
+                chunks = []
+                size = 0
+                truncated = False
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    if self.read_limit_bytes is not None and size + len(chunk) > self.read_limit_bytes:
+                        chunks.append(chunk[:self.read_limit_bytes - size])
+                        truncated = True
+                        break
+                    size += len(chunk)
+                    if size > self.max_body_bytes:
+                        raise BodyTooLarge(f"{url} is over {self.max_body_bytes} bytes")
+                    chunks.append(chunk)
+
+                return FetchResult(
+                    url=response.url,
+                    status_code=response.status_code,
+                    headers=dict(response.headers),
+                    content=b''.join(chunks),
+                    encoding=response.encoding,
+                    truncated=truncated,
+                )
+
+    def head(self, url: str) -> Optional[int]:
+        """
+        Status code of a HEAD request, following redirects.
+
+        Pages crawled or checked recently are answered from the status cache, or from the
+        page cache while fresh. Failures are cached too: a URL that could not be reached
+        returns None until the status cache forgets it.
+        """
+        found, status_code = self.statuses.lookup(url)
+        if found:
+            return status_code
+        if self.cache is not None:
+            cached = self.cache.get(normalize_url(url))
+            if cached is not None and self.cache.is_fresh(cached):
+                self.statuses.record(url, cached.status_code)
+                return cached.status_code
+        try:
+            with self._host_slot(url):
+                response = self.session.head(url, allow_redirects=True, timeout=self.timeout)
+                response.close()
+        except requests.RequestException:
+            self.statuses.record(url, None)
+            raise
+        self.statuses.record(url, response.status_code)
+        return response.status_code
+
+    def close(self) -> None:
+        self.session.close()
@@ -0,0 +1,201 @@
+import re
+from typing import Dict, List, Tuple, Type
+from urllib.parse import urljoin, urlparse
+from bs4 import BeautifulSoup
+
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
+
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+
+# Elements removed before extracting anything ('hidden-xs' is matched as a tag name, as it always was)
+REMOVED_TAGS = ['script', 'hidden-xs', 'style', 'nav', 'footer', 'header']
+# Containers holding the main content of gencat.cat pages
+CONTENT_TAGS = ['article', 'div']
+CONTENT_CLASSES = ['content', 'main', 'tramit-steps', 'container', 'article', 'blocs']
+
+_BODY_TAG = re.compile(r'<body[\s>/]', re.IGNORECASE)
+_TEMPLATE_TAGS = re.compile(r'^<template[^>]*>|</template>$', re.IGNORECASE)
+
+
+def is_relevant_link(url: str, base_domain: str) -> bool:
+    """Whether a resolved link is worth exploring from a page of base_domain"""
+    parsed_url = urlparse(url)
+    return (
+        parsed_url.netloc == base_domain and  # Same domain
+        parsed_url.scheme in ('http', 'https') and  # Valid scheme
+        '#' not in url and  # Not an anchor
+        'javascript:' not in url and  # Not JavaScript
+        ".pdf" not in url and
+        not url.endswith(".pdf")
+    )
+
+
+def _join_stripped(strings) -> str:
+    """Text as BeautifulSoup's get_text(strip=True) builds it"""
+    return ''.join(text.strip() for text in strings if text.strip())
+
+
+def _has_content_class(class_attribute) -> bool:
+    return class_attribute is not None and any(name in CONTENT_CLASSES for name in class_attribute.split())
+
+
+class HtmlExtractor:
+    """Extracts the main content and the relevant links of a page"""
+
+    name = None
+
+    def extract(self, html: str, base_url: str) -> Tuple[str, List[str]]:
+        """
+        Args:
+            html: Page source
+            base_url: URL of the page, to resolve relative links
+
+        Returns:
+            Tuple[str, List[str]]: Main content, and the links worth exploring in document order
+        """
+        raise NotImplementedError
+
+
+class BeautifulSoupExtractor(HtmlExtractor):
+    """Reference extractor, pure Python html.parser"""
+
+    name = 'beautifulsoup'
+
+    def extract(self, html: str, base_url: str) -> Tuple[str, List[str]]:
+        soup = BeautifulSoup(html, 'html.parser')
+        # Links are taken after the navigation elements are removed
+        main_content = self._extract_main_content(soup)
+        return main_content, self._extract_relevant_links(soup, base_url)
+
+    def _extract_main_content(self, soup: BeautifulSoup) -> str:
+        # Remove script and style elements
+        for script in soup(REMOVED_TAGS):
+            script.decompose()
+
+        # Extract text from common content containers
+        content_containers = soup.find_all(CONTENT_TAGS, class_=CONTENT_CLASSES)
+
+        if content_containers:
+            return ' '.join(container.get_text(strip=True) for container in content_containers)
+
+        # Fallback to body content if no specific containers found
+        return soup.body.get_text(strip=True) if soup.body else ''
+
+    def _extract_relevant_links(self, soup: BeautifulSoup, base_url: str) -> List[str]:
+        base_domain = urlparse(base_url).netloc
+        links = []
+        for link in soup.find_all('a', href=True):
+            url = urljoin(base_url, link['href'])
+            if is_relevant_link(url, base_domain):
+                links.append(url)
+        return links
+
+
+class LxmlExtractor(HtmlExtractor):
+    """libxml2 parser, several times faster than html.parser"""
+
+    name = 'lxml'
+
+    def __init__(self):
+        if lxml is None:
+            raise ImportError("The lxml extractor needs lxml: pip install lxml")
+        self._parser = lxml.html.HTMLParser(encoding='utf-8')
+
+    def _text(self, element) -> str:
+        # itertext skips comments but keeps their tails, like get_text does
+        return _join_stripped(element.itertext())
+
+    def extract(self, html: str, base_url: str) -> Tuple[str, List[str]]:
+        if not html.strip():
+            return '', []
+        root = lxml.html.document_fromstring(html.encode('utf-8', errors='replace'), parser=self._parser)
+
+        # Emptied rather than dropped: drop_tree glues the element's tail to the text before it,
+        # while get_text reads it as a separate string ('beca <script/> cal' -> 'becacal')
+        for element in list(root.iter(*REMOVED_TAGS)):
+            element.clear(keep_tail=True)
+
+        base_domain = urlparse(base_url).netloc
+        links = []
+        for link in root.iter('a'):
+            href = link.get('href')
+            if href is not None:
+                url = urljoin(base_url, href)
+                if is_relevant_link(url, base_domain):
+                    links.append(url)
+
+        # get_text leaves out the content of <template> elements, their links are still taken above
+        for element in list(root.iter('template')):
+            element.clear(keep_tail=True)
+
+        content_containers = [element for element in root.iter(*CONTENT_TAGS) if _has_content_class(element.get('class'))]
+        if content_containers:
+            main_content = ' '.join(self._text(container) for container in content_containers)
+        else:
+            # libxml2 always adds a body, html.parser only has one if the page does
+            body = root.find('body')
+            main_content = self._text(body) if body is not None and _BODY_TAG.search(html) else ''
+        return main_content, links
+
+
+class SelectolaxExtractor(HtmlExtractor):
+    """lexbor HTML5 parser through selectolax, the fastest option"""
+
+    name = 'selectolax'
+
+    def __init__(self):
+        if LexborHTMLParser is None:
+            raise ImportError("The selectolax extractor needs selectolax: pip install selectolax")
+
+    @staticmethod
+    def _text(node) -> str:
+        return _join_stripped(child.text_content for child in node.traverse(include_text=True) if child.tag == '-text')
+
+    def extract(self, html: str, base_url: str) -> Tuple[str, List[str]]:
+        tree = LexborHTMLParser(html)
+        for node in tree.css(', '.join(REMOVED_TAGS)):
+            node.decompose()
+
+        content_containers = [node for node in tree.css(', '.join(CONTENT_TAGS)) if _has_content_class(node.attributes.get('class'))]
+        if content_containers:
+            main_content = ' '.join(self._text(container) for container in content_containers)
+        else:
+            main_content = self._text(tree.body) if tree.body is not None and _BODY_TAG.search(html) else ''
+
+        base_domain = urlparse(base_url).netloc
+        links = []
+        for href in self._hrefs(tree.root):
+            url = urljoin(base_url, href)
+            if is_relevant_link(url, base_domain):
+                links.append(url)
+        return main_content, links
+
+    @classmethod
+    def _hrefs(cls, root):
+        """hrefs of the links under root in document order, including the ones in <template> content like html.parser"""
+        for node in root.css('a[href], template'):
+            if node.tag == 'template':
+                # lexbor keeps template content out of the tree, parse it on its own
+                content = LexborHTMLParser(_TEMPLATE_TAGS.sub('', node.html))
+                for removed in content.css(', '.join(REMOVED_TAGS)):
+                    removed.decompose()
+                yield from cls._hrefs(content.root)
+            else:
+                yield node.attributes.get('href')
+
+
+EXTRACTORS: Dict[str, Type[HtmlExtractor]] = {
+    extractor.name: extractor for extractor in (BeautifulSoupExtractor, LxmlExtractor, SelectolaxExtractor)
+}
+
+
+def get_extractor(name: str) -> HtmlExtractor:
+    """Extractor by name: 'beautifulsoup', 'lxml' or 'selectolax'"""
+    assert name in EXTRACTORS, f"Invalid extractor {name}"
+    return EXTRACTORS[name]()
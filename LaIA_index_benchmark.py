@@ -0,0 +1,107 @@
+import argparse
+import json
+import time
+from typing import Dict, List
+import numpy as np
+from LaIA_vector_index import IndexConfig, build_index, index_size_bytes
+from LaIA_document_store import DocumentStore
+
+# Fixed set of configurations compared against the exact flat index
+BENCHMARK_CONFIGS = [
+    IndexConfig('flat'),
+    IndexConfig('flat', 'sq8'),
+    IndexConfig('flat', 'pq'),
+    IndexConfig('ivf'),
+    IndexConfig('ivf', 'sq8'),
+    IndexConfig('ivf', 'pq'),
+    IndexConfig('hnsw'),
+    IndexConfig('hnsw', 'sq8'),
+]
+
+
+def synthetic_vectors(n: int, dim: int, seed: int = 0) -> np.ndarray:
+    """Clustered unit vectors, closer to sentence embeddings than uniform noise"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(1, n // 100), dim))
+    vectors = centers[rng.integers(0, len(centers), n)] + 0.3 * rng.normal(size=(n, dim))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors.astype(np.float32)
+
+
+def stored_vectors(directory: str) -> np.ndarray:
+    """Chunk embeddings of a persisted DocumentManager session"""
+    entries = DocumentStore(directory).load()
+    return np.concatenate([np.asarray(vectors) for _, _, _, vectors in entries if len(vectors)]).astype(np.float32)
+
+
+def benchmark(vectors: np.ndarray, queries: np.ndarray, k: int = 10, configs: List[IndexConfig] = BENCHMARK_CONFIGS) -> List[Dict]:
+    """
+    Measure recall@k and query latency of every configuration.
+
+    Args:
+        vectors: Indexed vectors
+        queries: Query vectors, searched one at a time like DocumentManager.search does
+        k: Number of neighbours
+        configs: Index configurations to compare
+
+    Returns:
+        List[Dict]: One result per configuration
+    """
+    exact = build_index(IndexConfig('flat'), vectors)
+    _, ground_truth = exact.search(queries, k)
+
+    results = []
+    for config in configs:
+        start = time.perf_counter()
+        index = build_index(config, vectors)
+        build_seconds = time.perf_counter() - start
+
+        latencies = []
+        hits = 0
+        for query, truth in zip(queries, ground_truth):
+            start = time.perf_counter()
+            _, found = index.search(query[None, :], k)
+            latencies.append(time.perf_counter() - start)
+            hits += len(set(found[0]) & set(truth))
+
+        latencies_ms = np.array(latencies) * 1000
+        results.append({
+            'index': config.factory_string(vectors.shape[1], len(vectors)),
+            'recall_at_k': hits / (k * len(queries)),
+            'latency_ms_p50': float(np.percentile(latencies_ms, 50)),
+            'latency_ms_p95': float(np.percentile(latencies_ms, 95)),
+            'build_seconds': build_seconds,
+            'size_mb': index_size_bytes(index) / 2 ** 20,
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall vs latency of the FAISS index types DocumentManager supports")
+    parser.add_argument("--store", help="DocumentStore directory to take vectors from (synthetic vectors if not set)")
+    parser.add_argument("--vectors", type=int, default=50000, help="Number of synthetic vectors")
+    parser.add_argument("--dim", type=int, default=768, help="Dimension of synthetic vectors (768 for mpnet)")
+    parser.add_argument("--queries", type=int, default=200, help="Number of queries, held out from the indexed vectors")
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    vectors = stored_vectors(args.store) if args.store else synthetic_vectors(args.vectors + args.queries, args.dim)
+    # The query set is fixed: the last vectors (perturbed) for a given store or seed
+    queries = vectors[-args.queries:] + 0.05 * np.random.default_rng(1).normal(size=(args.queries, vectors.shape[1])).astype(np.float32)
+    vectors = vectors[:-args.queries]
+
+    results = benchmark(vectors, queries, k=args.k)
+
+    print(f"{len(vectors)} vectors, dim {vectors.shape[1]}, {len(queries)} queries, k={args.k}")
+    print(f"{'index':<20}{'recall':>8}{'p50 ms':>10}{'p95 ms':>10}{'build s':>10}{'size MB':>10}")
+    for r in results:
+        print(f"{r['index']:<20}{r['recall_at_k']:>8.3f}{r['latency_ms_p50']:>10.3f}{r['latency_ms_p95']:>10.3f}{r['build_seconds']:>10.2f}{r['size_mb']:>10.1f}")
+
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump(results, json_file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
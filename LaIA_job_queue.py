@@ -0,0 +1,269 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Callable, Dict, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    """Raised by JobQueue.submit when no more jobs can be accepted"""
+
+
+class JobCancelled(Exception):
+    """Raised inside a job by Job.check_cancelled once the job has been cancelled"""
+
+
+class Job:
+    """A unit of work of a session, run on a JobQueue worker"""
+
+    def __init__(self, session_id: str, function: Callable, args: tuple, kwargs: dict):
+        self.id = str(uuid.uuid4())
+        self.session_id = session_id
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.status = 'queued'  # 'queued', 'running', 'done', 'failed' or 'cancelled'
+        self.stage: Optional[str] = None
+        self.progress = 0
+        self.result = None
+        self.error: Optional[str] = None
+        self.created = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self._cancel_event = threading.Event()
+        self._queue: Optional['JobQueue'] = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def check_cancelled(self) -> None:
+        """Stop the job here if it was cancelled, to be called between the stages of the work"""
+        if self._cancel_event.is_set():
+            raise JobCancelled(self.id)
+
+    def update(self, stage: str, progress: Optional[int] = None) -> None:
+        """Report the current stage (and a 0-100 progress) of a running job"""
+        self.check_cancelled()
+        self.stage = stage
+        if progress is not None:
+            self.progress = progress
+        if self._queue is not None:
+            self._queue._notify(self)
+
+    def to_dict(self) -> Dict:
+        return {
+            'job_id': self.id,
+            'session_id': self.session_id,
+            'status': self.status,
+            'stage': self.stage,
+            'progress': self.progress,
+            'error': self.error,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+        }
+
+
+class JobQueue:
+    """
+    Bounded pool of worker threads running the long jobs of every session.
+
+    At most max_queued jobs wait for a worker, and at most max_queued_per_session of them
+    belong to the same session: submit raises QueueFull past either limit, so a single
+    session cannot fill the queue. A session never has more than max_running_per_session
+    jobs running; its other jobs stay queued while the workers serve other sessions.
+    """
+
+    def __init__(self,
+                 num_workers: int = 4,
+                 max_queued: int = 32,
+                 max_running_per_session: int = 1,
+                 on_update: Optional[Callable[[Job], None]] = None,
+                 keep_finished: int = 1000,
+                 on_cancel: Optional[Callable[[Job], None]] = None,
+                 max_queued_per_session: Optional[int] = None):
+        """
+        Args:
+            num_workers: Number of jobs run at the same time
+            max_queued: Maximum number of jobs waiting for a worker
+            max_running_per_session: Maximum number of jobs of one session run at the same time
+            on_update: Called with the job every time its status or stage changes
+            keep_finished: Number of finished jobs kept for status queries
+            on_cancel: Called with a queued job cancelled before it ran (its function never
+                runs, so this is the place to clean up what was set up for it)
+            max_queued_per_session: Maximum number of jobs of one session waiting for a worker
+                (only max_queued applies if None)
+        """
+        self.max_queued = max_queued
+        self.max_queued_per_session = max_queued_per_session
+        self.max_running_per_session = max_running_per_session
+        self.on_update = on_update
+        self.on_cancel = on_cancel
+        self.keep_finished = keep_finished
+        self._condition = threading.Condition()
+        self._queued: "deque[Job]" = deque()
+        self._running: Dict[str, int] = {}
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._closed = False
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.rejected = 0
+        self._workers = [
+            threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+            for i in range(num_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, session_id: str, function: Callable, *args, **kwargs) -> Job:
+        """
+        Queue function(job, *args, **kwargs) to run on a worker.
+
+        Raises:
+            QueueFull: If max_queued jobs, or max_queued_per_session jobs of the session, are already waiting
+        """
+        job = Job(session_id, function, args, kwargs)
+        job._queue = self
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("JobQueue is closed")
+            if len(self._queued) >= self.max_queued:
+                self.rejected += 1
+                raise QueueFull(f"{len(self._queued)} jobs already queued")
+            if self.max_queued_per_session is not None:
+                session_queued = sum(1 for other in self._queued if other.session_id == session_id)
+                if session_queued >= self.max_queued_per_session:
+                    self.rejected += 1
+                    raise QueueFull(f"{session_queued} jobs of session {session_id} already queued")
+            self._queued.append(job)
+            self._jobs[job.id] = job
+            self._condition.notify_all()
+        self._notify(job)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._condition:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        Cancel a job. A queued job never runs, a running job stops at its next check_cancelled.
+
+        Returns:
+            bool: False if the job does not exist or already finished
+        """
+        with self._condition:
+            job = self._jobs.get(job_id)
+            if job is None or job.status not in ('queued', 'running'):
+                return False
+            job._cancel_event.set()
+            # Decided under the lock: a worker may pick the job up (or finish it) right after
+            was_queued = job.status == 'queued'
+            if was_queued:
+                self._queued.remove(job)
+                self._finish(job, 'cancelled')
+        if was_queued:
+            self._cancelled_before_running(job)
+        return True
+
+    def stats(self) -> Dict:
+        with self._condition:
+            return {
+                'queued': len(self._queued),
+                'running': sum(self._running.values()),
+                'completed': self.completed,
+                'failed': self.failed,
+                'cancelled': self.cancelled,
+                'rejected': self.rejected,
+            }
+
+    def close(self) -> None:
+        """Stop the workers once the running jobs finish, queued jobs are cancelled"""
+        with self._condition:
+            self._closed = True
+            cancelled = list(self._queued)
+            for job in cancelled:
+                job._cancel_event.set()
+                self._finish(job, 'cancelled')
+            self._queued.clear()
+            self._condition.notify_all()
+        for job in cancelled:
+            self._cancelled_before_running(job)
+        for worker in self._workers:
+            worker.join()
+
+    def _notify(self, job: Job) -> None:
+        if self.on_update is None:
+            return
+        try:
+            self.on_update(job)
+        except Exception as e:
+            logger.error(f"Error reporting job {job.id}: {str(e)}")
+
+    def _cancelled_before_running(self, job: Job) -> None:
+        if self.on_cancel is not None:
+            try:
+                self.on_cancel(job)
+            except Exception as e:
+                logger.error(f"Error cleaning up cancelled job {job.id}: {str(e)}")
+        self._notify(job)
+
+    def _next_job(self) -> Optional[Job]:
+        """First queued job whose session has a free slot"""
+        for job in self._queued:
+            if self._running.get(job.session_id, 0) < self.max_running_per_session:
+                self._queued.remove(job)
+                return job
+        return None
+
+    def _finish(self, job: Job, status: str) -> None:
+        job.status = status
+        job.finished = time.time()
+        if status == 'done':
+            self.completed += 1
+        elif status == 'failed':
+            self.failed += 1
+        else:
+            self.cancelled += 1
+
+        finished = [job_id for job_id, other in self._jobs.items() if other.finished is not None]
+        for job_id in finished[:max(0, len(finished) - self.keep_finished)]:
+            del self._jobs[job_id]
+
+    def _work(self) -> None:
+        while True:
+            with self._condition:
+                job = self._next_job()
+                while job is None:
+                    if self._closed:
+                        return
+                    self._condition.wait()
+                    job = self._next_job()
+                job.status = 'running'
+                job.started = time.time()
+                self._running[job.session_id] = self._running.get(job.session_id, 0) + 1
+            self._notify(job)
+
+            try:
+                job.result = job.function(job, *job.args, **job.kwargs)
+                status = 'done'
+            except JobCancelled:
+                status = 'cancelled'
+            except Exception as e:
+                logger.exception(f"Job {job.id} failed")
+                job.error = str(e)
+                status = 'failed'
+
+            with self._condition:
+                self._running[job.session_id] -= 1
+                if not self._running[job.session_id]:
+                    del self._running[job.session_id]
+                self._finish(job, status)
+                # A job of this session may have been waiting for the slot
+                self._condition.notify_all()
+            self._notify(job)
@@ -0,0 +1,116 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Arguments that change how a completion is delivered, not what it says
+NON_KEY_ARGUMENTS = ('stream', 'timeout', 'extra_headers')
+
+
+class LLMResponseCache:
+    """
+    On-disk memoization of chat completions, for prompts that are pure functions of their input.
+
+    Completions are keyed by caller, endpoint, model, messages and sampling parameters, and stored
+    as <key>.json. Entries older than ttl are ignored, and the least recently used ones are
+    removed once the directory holds more than max_bytes.
+    """
+
+    def __init__(self, directory: str, ttl: float = 24 * 3600, max_bytes: int = 64 * 1024 * 1024):
+        """
+        Args:
+            directory: Directory of the cache files
+            ttl: Seconds a completion is reused
+            max_bytes: Size of the directory above which old completions are evicted
+        """
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # key -> size in bytes, least recently used first
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+        os.makedirs(directory, exist_ok=True)
+        entries = []
+        for name in os.listdir(directory):
+            if name.endswith('.json'):
+                path = os.path.join(directory, name)
+                entries.append((os.path.getmtime(path), name[:-len('.json')], os.path.getsize(path)))
+        for _, key, size in sorted(entries):
+            self._entries[key] = size
+            self._bytes += size
+
+    @staticmethod
+    def key(caller: str, base_url: Optional[str], arguments: Dict) -> str:
+        """Hash of the caller, the endpoint and the create() arguments that determine the completion"""
+        keyed = {name: value for name, value in arguments.items() if name not in NON_KEY_ARGUMENTS}
+        # Scoped per caller: a call site never gets a completion cached for another one's prompt handling
+        payload = json.dumps([caller, base_url, keyed], sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key: str) -> Optional[str]:
+        """Cached completion (as JSON) of a key, None if missing or expired"""
+        try:
+            with open(self._path(key), 'r', encoding='utf-8') as entry_file:
+                entry = json.load(entry_file)
+        except (OSError, ValueError):
+            entry = None
+
+        with self._lock:
+            if entry is None or time.time() - entry['created'] > self.ttl:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if key in self._entries:
+                self._entries.move_to_end(key)
+        return entry['response']
+
+    def put(self, key: str, response_json: str) -> None:
+        data = json.dumps({'created': time.time(), 'response': response_json}, ensure_ascii=False).encode('utf-8')
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as tmp_file:
+                tmp_file.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not cache an LLM response: {str(e)}")
+            return
+
+        with self._lock:
+            self._bytes -= self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                old_key, size = self._entries.popitem(last=False)
+                self._bytes -= size
+                self.evicted += 1
+                try:
+                    os.remove(self._path(old_key))
+                except OSError:
+                    pass
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evicted': self.evicted,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+            }
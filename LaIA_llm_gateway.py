@@ -0,0 +1,258 @@
+import os
+import random
+import threading
+import time
+from typing import Dict, Iterable, Optional, Tuple
+import httpx
+import openai
+from openai import OpenAI
+from openai.types.chat import ChatCompletion
+from LaIA_llm_cache import LLMResponseCache
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Errors worth another try: rate limits, 5xx answers, timeouts and connection errors
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.InternalServerError, openai.APIConnectionError)
+
+
+class _CallerStats:
+    def __init__(self):
+        self.calls = 0
+        self.failures = 0
+        self.retries = 0
+        self.cache_hits = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def to_dict(self) -> Dict:
+        return {
+            'calls': self.calls,
+            'failures': self.failures,
+            'retries': self.retries,
+            'cache_hits': self.cache_hits,
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'avg_latency': self.latency_total / self.calls if self.calls else 0.0,
+            'max_latency': self.latency_max,
+        }
+
+
+class _Stream:
+    """Streamed completion holding its gateway slot until it is exhausted or closed"""
+
+    def __init__(self, gateway: 'LLMGateway', caller: str, stream, start: float):
+        self._gateway = gateway
+        self._caller = caller
+        self._stream = stream
+        self._start = start
+        self._done = False
+
+    def __iter__(self):
+        try:
+            for chunk in self._stream:
+                yield chunk
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        if self._done:
+            return
+        self._done = True
+        try:
+            self._stream.close()
+        finally:
+            self._gateway._finish(self._caller, self._start)
+
+
+class _Completions:
+    def __init__(self, gateway: 'LLMGateway', caller: str, endpoint: Tuple[Optional[str], Optional[str]]):
+        self._gateway = gateway
+        self._caller = caller
+        self._endpoint = endpoint
+
+    def create(self, **kwargs):
+        return self._gateway.create(self._caller, self._endpoint, **kwargs)
+
+
+class _Chat:
+    def __init__(self, completions: _Completions):
+        self.completions = completions
+
+
+class LLMClient:
+    """OpenAI-like client of one caller: client.chat.completions.create(...) goes through the gateway"""
+
+    def __init__(self, gateway: 'LLMGateway', caller: str, endpoint: Tuple[Optional[str], Optional[str]]):
+        self.caller = caller
+        self.chat = _Chat(_Completions(gateway, caller, endpoint))
+
+
+class LLMGateway:
+    """
+    Process-wide access to the LLM endpoints, shared by every module calling them.
+
+    Each endpoint (base URL, API key) gets one OpenAI client over a pooled httpx client,
+    at most max_in_flight requests run at once across all endpoints, and rate limits,
+    5xx answers and connection errors are retried with jittered exponential backoff
+    (or the server's Retry-After). Calls, tokens and latency are accounted per caller.
+
+    With override_base_url (or the LAIA_LLM_BASE_URL environment variable) every caller
+    is sent to that endpoint instead of its own, e.g. LaIA_mock_llm.py for load tests.
+
+    The completions of the callers in cached_callers, whose prompts are pure functions of
+    their input, are memoized in an LLMResponseCache.
+    """
+
+    def __init__(self,
+                 base_url: Optional[str] = None,
+                 api_key: Optional[str] = None,
+                 max_in_flight: int = 16,
+                 timeout: float = 60,
+                 max_retries: int = 3,
+                 backoff_factor: float = 0.5,
+                 pool_size: int = 20,
+                 cache: Optional[LLMResponseCache] = None,
+                 cached_callers: Iterable[str] = (),
+                 override_base_url: Optional[str] = None):
+        """
+        Args:
+            base_url: Default endpoint (OpenAI's if None)
+            api_key: Default API key (OPENAI_API_KEY if None)
+            max_in_flight: Maximum requests in flight, all callers together
+            timeout: Seconds allowed for each request, unless the call passes its own timeout
+            max_retries: Retries of a failed request
+            backoff_factor: Retry n waits backoff_factor * 2^n seconds plus jitter
+            pool_size: Connections kept alive per endpoint
+            cache: Cache of completions (no caching if None)
+            cached_callers: Callers whose non-streamed completions are cached
+            override_base_url: Endpoint used by every caller (LAIA_LLM_BASE_URL if None, no override if unset)
+        """
+        self.override_base_url = override_base_url or os.environ.get('LAIA_LLM_BASE_URL') or None
+        self.default_endpoint = (base_url, api_key)
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.pool_size = pool_size
+        self.cache = cache
+        self.cached_callers = set(cached_callers)
+        self._in_flight = threading.BoundedSemaphore(max_in_flight)
+        self._clients: Dict[Tuple[Optional[str], Optional[str]], OpenAI] = {}
+        self._stats: Dict[str, _CallerStats] = {}
+        self._lock = threading.Lock()
+
+    def client_for(self, caller: str, base_url: Optional[str] = None, api_key: Optional[str] = None) -> LLMClient:
+        """
+        Client used by one caller.
+
+        Args:
+            caller: Name under which the calls are accounted ('web_search', 'answer', ...)
+            base_url: Endpoint of this caller (the gateway's if None)
+            api_key: API key of this caller (the gateway's if None)
+        """
+        endpoint = (self.override_base_url or base_url or self.default_endpoint[0], api_key or self.default_endpoint[1])
+        return LLMClient(self, caller, endpoint)
+
+    def _client(self, endpoint: Tuple[Optional[str], Optional[str]]) -> OpenAI:
+        with self._lock:
+            if endpoint not in self._clients:
+                base_url, api_key = endpoint
+                self._clients[endpoint] = OpenAI(
+                    base_url=base_url,
+                    api_key=api_key,
+                    max_retries=0,  # Retried by the gateway
+                    timeout=self.timeout,
+                    http_client=httpx.Client(limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size)),
+                )
+            return self._clients[endpoint]
+
+    def _caller_stats(self, caller: str) -> _CallerStats:
+        if caller not in self._stats:
+            self._stats[caller] = _CallerStats()
+        return self._stats[caller]
+
+    def _retry_delay(self, error: Exception, attempt: int) -> float:
+        response = getattr(error, 'response', None)
+        if response is not None:
+            try:
+                return min(float(response.headers.get('retry-after')), 30.0)
+            except (TypeError, ValueError):
+                pass
+        return self.backoff_factor * 2 ** attempt + random.uniform(0, self.backoff_factor)
+
+    def create(self, caller: str, endpoint: Tuple[Optional[str], Optional[str]], **kwargs):
+        """
+        Chat completion through the gateway, with the arguments of chat.completions.create.
+
+        Streamed completions (stream=True) keep their slot until they are read or closed.
+
+        Raises:
+            openai.OpenAIError: Once the retries are exhausted, or on errors not worth retrying
+        """
+        cache_key = None
+        if self.cache is not None and caller in self.cached_callers and not kwargs.get('stream'):
+            cache_key = LLMResponseCache.key(caller, endpoint[0], kwargs)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                with self._lock:
+                    self._caller_stats(caller).cache_hits += 1
+                return ChatCompletion.model_validate_json(cached)
+
+        client = self._client(endpoint)
+        for attempt in range(self.max_retries + 1):
+            self._in_flight.acquire()
+            start = time.monotonic()
+            try:
+                response = client.chat.completions.create(**kwargs)
+            except RETRYABLE_ERRORS as e:
+                self._in_flight.release()
+                if attempt == self.max_retries:
+                    self._fail(caller)
+                    raise
+                delay = self._retry_delay(e, attempt)
+                with self._lock:
+                    self._caller_stats(caller).retries += 1
+                logger.warning(f"LLM request of {caller} failed ({type(e).__name__}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+            except Exception:
+                self._in_flight.release()
+                self._fail(caller)
+                raise
+
+            if kwargs.get('stream'):
+                return _Stream(self, caller, response, start)
+            self._finish(caller, start, getattr(response, 'usage', None))
+            if cache_key is not None:
+                self.cache.put(cache_key, response.model_dump_json())
+            return response
+
+    def _fail(self, caller: str) -> None:
+        with self._lock:
+            stats = self._caller_stats(caller)
+            stats.calls += 1
+            stats.failures += 1
+
+    def _finish(self, caller: str, start: float, usage=None) -> None:
+        self._in_flight.release()
+        latency = time.monotonic() - start
+        with self._lock:
+            stats = self._caller_stats(caller)
+            stats.calls += 1
+            stats.latency_total += latency
+            stats.latency_max = max(stats.latency_max, latency)
+            if usage is not None:
+                stats.prompt_tokens += getattr(usage, 'prompt_tokens', 0) or 0
+                stats.completion_tokens += getattr(usage, 'completion_tokens', 0) or 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {caller: stats.to_dict() for caller, stats in self._stats.items()}
+
+    def close(self) -> None:
+        with self._lock:
+            for client in self._clients.values():
+                client.close()
+            self._clients.clear()
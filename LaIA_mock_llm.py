@@ -0,0 +1,259 @@
+import io
+import re
+import json
+import math
+import time
+import uuid
+import wave
+import random
+import argparse
+import threading
+from typing import Dict, List, Optional
+from flask import Flask, request, jsonify, Response
+import logging
+
+logger = logging.getLogger(__name__)
+
+_URL = re.compile(r"https?://[^\s,)}\]]+")
+_WORD = re.compile(r'\w{4,}', re.UNICODE)
+
+
+class LatencyModel:
+    """Time to first token and token rate of the simulated model"""
+
+    def __init__(self, distribution: str = 'lognormal', mean: float = 0.5, std: float = 0.2,
+                 tokens_per_second: float = 50.0, seed: Optional[int] = None):
+        """
+        Args:
+            distribution: 'fixed', 'normal' or 'lognormal' time to first token
+            mean: Mean seconds to the first token
+            std: Standard deviation of the seconds to the first token
+            tokens_per_second: Generation speed after the first token (no delay if 0)
+            seed: Seed of the latency samples, for repeatable runs
+        """
+        assert distribution in ('fixed', 'normal', 'lognormal'), f"Invalid distribution {distribution}"
+        self.distribution = distribution
+        self.mean = mean
+        self.std = std
+        self.tokens_per_second = tokens_per_second
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def first_token(self) -> float:
+        with self._lock:
+            if self.distribution == 'fixed' or self.mean <= 0:
+                return max(0.0, self.mean)
+            if self.distribution == 'normal':
+                return max(0.0, self._random.gauss(self.mean, self.std))
+            sigma = math.sqrt(math.log(1 + (self.std / self.mean) ** 2))
+            return self._random.lognormvariate(math.log(self.mean) - sigma ** 2 / 2, sigma)
+
+    def per_token(self) -> float:
+        return 1 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+
+
+def _text(message: Dict) -> str:
+    content = message.get('content') or ''
+    if isinstance(content, list):
+        return ' '.join(part.get('text', '') for part in content if isinstance(part, dict))
+    return content
+
+
+class ScriptedResponder:
+    """
+    Replies in the format each LaIA prompt expects: search queries, selected URLs,
+    video category, dialogue and cited RAG answers.
+
+    Extra rules ({'match': regex, 'response': text}) are tried first, in order, against
+    the whole conversation.
+    """
+
+    def __init__(self, rules: Optional[List[Dict]] = None):
+        self.rules = [(re.compile(rule['match'], re.DOTALL | re.IGNORECASE), rule['response']) for rule in rules or []]
+
+    def reply(self, messages: List[Dict]) -> str:
+        conversation = '\n'.join(_text(message) for message in messages)
+        for pattern, response in self.rules:
+            if pattern.search(conversation):
+                return response
+
+        if 'Return 3 different queries' in conversation:
+            return self._search_queries(conversation)
+        if 'Sources and gathered information' in conversation:
+            return self._selected_sources(conversation)
+        if 'Categories:' in conversation:
+            return self._category(conversation)
+        if 'Cai' in conversation and 'LaIA' in conversation and 'diàleg' in conversation:
+            return self._dialogue(messages)
+        if 'Context:' in conversation and 'Question:' in conversation:
+            return self._rag_answer(conversation)
+        return "D'acord."
+
+    @staticmethod
+    def _search_queries(conversation: str) -> str:
+        question = conversation.split('The question is:', 1)[-1].split('.', 1)[0]
+        words = _WORD.findall(question.lower())[:4] or ['tràmits']
+        topic = ' '.join(words)
+        return f"{topic}\n{topic} requisits\n{topic} gencat"
+
+    @staticmethod
+    def _selected_sources(conversation: str) -> str:
+        sources = re.findall(r"Source: (\S+)", conversation)
+        return '\n'.join(sources[:3])
+
+    @staticmethod
+    def _category(conversation: str) -> str:
+        categories = conversation.split('Categories:', 1)[1].split('You must only select', 1)[0]
+        lines = [line.strip() for line in categories.splitlines() if line.strip()]
+        return lines[0] if lines else 'general'
+
+    @staticmethod
+    def _dialogue(messages: List[Dict]) -> str:
+        topic = _text(messages[-1])[:200].replace('\n', ' ')
+        return (
+            f"Cai: Em pots explicar com funciona això?\n"
+            f"LaIA: És clar! {topic} Primer has de revisar els requisits, després preparar la documentació i finalment presentar la sol·licitud dins del termini.\n"
+            f"Cai: Moltes gràcies!\n"
+            f"LaIA: De res, espero que t'hagi estat útil."
+        )
+
+    @staticmethod
+    def _rag_answer(conversation: str) -> str:
+        context, question = conversation.split('Question:', 1)
+        context = context.split('Context:', 1)[1]
+        question_words = set(_WORD.findall(question.lower())) - {'context', 'unrelated', 'return', 'found'}
+        if not question_words & set(_WORD.findall(context.lower())):
+            return 'NOT_FOUND'
+        first_source = context.strip().split('\n\n', 1)[0]
+        sentence = re.sub(r'^\[\d+\]\s*', '', first_source).split('. ')[0][:300]
+        return f"Segons la informació disponible, {sentence} [1]."
+
+
+def _count_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def _silent_wav(seconds: float, rate: int = 16000) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(rate)
+        wav_file.writeframes(b'\x00\x00' * int(seconds * rate))
+    return buffer.getvalue()
+
+
+def create_app(latency: LatencyModel, responder: ScriptedResponder, tts_latency: float = 0.2,
+               tts_seconds_per_char: float = 0.06) -> Flask:
+    """
+    Flask app serving an OpenAI-compatible /v1/chat/completions and a TTS stand-in.
+
+    Args:
+        latency: Simulated model speed
+        responder: Reply of each request
+        tts_latency: Seconds taken by each TTS request
+        tts_seconds_per_char: Duration of the generated (silent) audio per character of text
+    """
+    app = Flask(__name__)
+    counters = {'completions': 0, 'streams': 0, 'tts': 0}
+    counters_lock = threading.Lock()
+
+    def count(name: str) -> None:
+        with counters_lock:
+            counters[name] += 1
+
+    @app.route('/v1/chat/completions', methods=['POST'])
+    @app.route('/chat/completions', methods=['POST'])
+    def chat_completions():
+        body = request.get_json(force=True)
+        messages = body.get('messages', [])
+        model = body.get('model', 'mock')
+        answer = responder.reply(messages)
+        if body.get('max_tokens'):
+            answer = answer[:body['max_tokens'] * 4]
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        prompt_tokens = sum(_count_tokens(_text(message)) for message in messages)
+        pieces = re.findall(r'\S*\s*', answer)[:-1] or ['']
+
+        if body.get('stream'):
+            count('streams')
+
+            def events():
+                time.sleep(latency.first_token())
+                for piece in pieces:
+                    chunk = {
+                        'id': completion_id, 'object': 'chat.completion.chunk', 'created': created, 'model': model,
+                        'choices': [{'index': 0, 'delta': {'role': 'assistant', 'content': piece}, 'finish_reason': None}],
+                    }
+                    yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                    time.sleep(latency.per_token())
+                final = {
+                    'id': completion_id, 'object': 'chat.completion.chunk', 'created': created, 'model': model,
+                    'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}],
+                }
+                yield f"data: {json.dumps(final)}\n\n"
+                yield "data: [DONE]\n\n"
+
+            return Response(events(), mimetype='text/event-stream')
+
+        count('completions')
+        time.sleep(latency.first_token() + latency.per_token() * len(pieces))
+        return jsonify({
+            'id': completion_id,
+            'object': 'chat.completion',
+            'created': created,
+            'model': model,
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': answer}, 'finish_reason': 'stop'}],
+            'usage': {
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': len(pieces),
+                'total_tokens': prompt_tokens + len(pieces),
+            },
+        })
+
+    @app.route('/tts', methods=['POST'])
+    def tts():
+        # Same request as the Aina TTS endpoints (API_URL, MATCHA_URL): {"text", "voice", ...}
+        count('tts')
+        text = (request.get_json(force=True) or {}).get('text', '')
+        time.sleep(tts_latency)
+        return Response(_silent_wav(max(0.2, len(text) * tts_seconds_per_char)), mimetype='audio/wav')
+
+    @app.route('/stats', methods=['GET'])
+    def stats():
+        with counters_lock:
+            return jsonify(dict(counters))
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible LLM and TTS stand-in for load tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", choices=['fixed', 'normal', 'lognormal'], default='lognormal', help="Distribution of the time to first token")
+    parser.add_argument("--latency-mean", type=float, default=0.5, help="Mean seconds to the first token")
+    parser.add_argument("--latency-std", type=float, default=0.2)
+    parser.add_argument("--tokens-per-second", type=float, default=50.0, help="0 to answer at once")
+    parser.add_argument("--tts-latency", type=float, default=0.2)
+    parser.add_argument("--script", help="JSON list of {'match': regex, 'response': text} rules tried before the built-in replies")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    rules = None
+    if args.script:
+        with open(args.script, 'r', encoding='utf-8') as script_file:
+            rules = json.load(script_file)
+
+    app = create_app(
+        LatencyModel(args.latency, args.latency_mean, args.latency_std, args.tokens_per_second, seed=args.seed),
+        ScriptedResponder(rules),
+        tts_latency=args.tts_latency,
+    )
+    print(f"LLM: LAIA_LLM_BASE_URL=http://{args.host}:{args.port}/v1   TTS: API_URL=MATCHA_URL=http://{args.host}:{args.port}/tts")
+    app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
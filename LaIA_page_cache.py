@@ -0,0 +1,222 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CachedPage:
+    url: str
+    status_code: int
+    headers: Dict[str, str] = field(default_factory=dict)  # Only the validators and the content type
+    content: bytes = b''
+    encoding: Optional[str] = None
+    fetched: float = 0.0
+    extracted: Optional[Dict] = None  # {'main_content', 'links', 'extractor'} once a crawler parsed the page
+    truncated: bool = False  # Cut at the fetcher's read limit: never stored, it is not the whole page
+
+    @property
+    def text(self) -> str:
+        return self.content.decode(self.encoding or 'utf-8', errors='replace')
+
+    def conditional_headers(self) -> Dict[str, str]:
+        """Request headers asking the server to answer 304 if the page did not change"""
+        headers = {}
+        if 'ETag' in self.headers:
+            headers['If-None-Match'] = self.headers['ETag']
+        if 'Last-Modified' in self.headers:
+            headers['If-Modified-Since'] = self.headers['Last-Modified']
+        return headers
+
+
+def extracted_by(extracted: Optional[Dict], extractor: str) -> Optional[Dict]:
+    """Stored parsed content of a page if it was produced by this extractor, None otherwise"""
+    if extracted is None or extracted.get('extractor') != extractor:
+        return None
+    return extracted
+
+
+class PageCache:
+    """
+    On-disk cache of downloaded pages, keyed by normalized URL and shared by every fetcher using the directory.
+
+    Each page is stored as <key>.json (status, validators, extracted content) and <key>.body.
+    Pages younger than ttl are served without a request, older ones are revalidated with
+    a conditional GET (If-None-Match / If-Modified-Since). The least recently used pages are
+    removed once the directory holds more than max_bytes.
+    """
+
+    VALIDATOR_HEADERS = ('ETag', 'Last-Modified', 'Content-Type')
+
+    def __init__(self, directory: str, ttl: float = 6 * 3600, max_bytes: int = 256 * 1024 * 1024):
+        """
+        Args:
+            directory: Directory of the cache files
+            ttl: Seconds a page is used without revalidating it
+            max_bytes: Size of the directory above which old pages are evicted
+        """
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # Serialises the writes of the cache files, so that updates of a page's metadata are not lost
+        self._write_lock = threading.Lock()
+        # key -> size in bytes, least recently used first
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.evicted = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    def _path(self, key: str, extension: str) -> str:
+        return os.path.join(self.directory, f"{key}.{extension}")
+
+    def _load_index(self) -> None:
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                key = name[:-len('.json')]
+                size = self._size_on_disk(key)
+                if size is not None:
+                    entries.append((os.path.getmtime(self._path(key, 'json')), key, size))
+        for _, key, size in sorted(entries):
+            self._entries[key] = size
+            self._bytes += size
+
+    def _size_on_disk(self, key: str) -> Optional[int]:
+        try:
+            return os.path.getsize(self._path(key, 'json')) + os.path.getsize(self._path(key, 'body'))
+        except OSError:
+            return None
+
+    @staticmethod
+    def key(url: str) -> str:
+        return hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+    def is_fresh(self, page: CachedPage) -> bool:
+        return time.time() - page.fetched < self.ttl
+
+    def get(self, url: str) -> Optional[CachedPage]:
+        """Cached page of a normalized URL, fresh or not"""
+        key = self.key(url)
+        try:
+            with open(self._path(key, 'json'), 'r', encoding='utf-8') as meta_file:
+                meta = json.load(meta_file)
+            with open(self._path(key, 'body'), 'rb') as body_file:
+                content = body_file.read()
+        except (OSError, ValueError):
+            return None
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            else:
+                # Written by another process
+                size = self._size_on_disk(key) or 0
+                self._entries[key] = size
+                self._bytes += size
+        return CachedPage(content=content, **meta)
+
+    def put(self, url: str, page: CachedPage, write_body: bool = True) -> None:
+        if page.truncated:
+            return
+        key = self.key(url)
+        received = {name.lower(): value for name, value in page.headers.items()}
+        meta = {
+            'url': page.url,
+            'status_code': page.status_code,
+            'headers': {name: received[name.lower()] for name in self.VALIDATOR_HEADERS if name.lower() in received},
+            'encoding': page.encoding,
+            'fetched': page.fetched,
+            'extracted': page.extracted,
+        }
+        with self._write_lock:
+            # Body first: a metadata file always has its body
+            if write_body:
+                self._write(self._path(key, 'body'), page.content)
+            self._write(self._path(key, 'json'), json.dumps(meta, ensure_ascii=False).encode('utf-8'))
+        self._account(key)
+
+    def _update_meta(self, url: str, **fields) -> None:
+        """Change fields of a cached page's metadata, read and rewritten under the write lock"""
+        key = self.key(url)
+        with self._write_lock:
+            try:
+                with open(self._path(key, 'json'), 'r', encoding='utf-8') as meta_file:
+                    meta = json.load(meta_file)
+            except (OSError, ValueError):
+                return  # Evicted meanwhile
+            meta.update(fields)
+            self._write(self._path(key, 'json'), json.dumps(meta, ensure_ascii=False).encode('utf-8'))
+        self._account(key)
+
+    def _account(self, key: str) -> None:
+        with self._lock:
+            self._bytes -= self._entries.pop(key, 0)
+            self._entries[key] = self._size_on_disk(key) or 0
+            self._bytes += self._entries[key]
+            self._evict()
+
+    def _write(self, path: str, data: bytes) -> None:
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as tmp_file:
+            tmp_file.write(data)
+        os.replace(tmp_path, path)
+
+    def _evict(self) -> None:
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            key, size = self._entries.popitem(last=False)
+            self._bytes -= size
+            self.evicted += 1
+            for extension in ('json', 'body'):
+                try:
+                    os.remove(self._path(key, extension))
+                except OSError:
+                    pass
+
+    def mark_revalidated(self, url: str, page: CachedPage) -> None:
+        """The server answered 304 Not Modified: the page is fresh for another ttl"""
+        page.fetched = time.time()
+        self._update_meta(url, fetched=page.fetched)
+
+    def set_extracted(self, url: str, main_content: str, links, extractor: str) -> None:
+        """
+        Store the parsed content of a cached page, so later crawls skip the HTML parsing.
+
+        It is tagged with the extractor's name: crawls using another extractor parse the page again.
+        """
+        self._update_meta(url, extracted={'main_content': main_content, 'links': list(links), 'extractor': extractor})
+
+    def record(self, outcome: str) -> None:
+        """Count a lookup: 'hit', 'revalidated' or 'miss'"""
+        with self._lock:
+            if outcome == 'hit':
+                self.hits += 1
+            elif outcome == 'revalidated':
+                self.revalidated += 1
+            else:
+                self.misses += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.revalidated + self.misses
+            return {
+                'hits': self.hits,
+                'revalidated': self.revalidated,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.revalidated) / lookups if lookups else 0.0,
+                'evicted': self.evicted,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+            }
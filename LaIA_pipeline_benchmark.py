@@ -0,0 +1,276 @@
+import os
+import re
+import sys
+import json
+import time
+import tempfile
+import argparse
+import threading
+import subprocess
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+import requests
+from requests.adapters import BaseAdapter
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Questions a citizen asks LaIA about the Catalan administration
+QUESTIONS = [
+    "Com puc demanar una beca per estudiar a la universitat?",
+    "Quins documents necessito per renovar el DNI?",
+    "Com puc obtenir la llicència de caça a Catalunya?",
+    "Quins ajuts hi ha per llogar un pis si soc jove?",
+    "Com em puc inscriure a les oposicions de mestre?",
+    "Què he de fer per empadronar-me en un municipi nou?",
+    "Com sol·licito la targeta sanitària individual?",
+    "Quins requisits hi ha per demanar el bo social elèctric?",
+    "Com puc convalidar un títol estranger a Catalunya?",
+    "On puc demanar cita prèvia per a l'ITV?",
+]
+
+# Stages of a /chat request, in pipeline order
+STAGES = ['prompt_rewrite', 'search', 'crawl', 'source_selection', 'chunking', 'embedding',
+          'query_embedding', 'faiss_search', 'answer_generation', 'tts']
+
+
+class SearchFixtures:
+    """
+    Search engine results recorded to fixtures/search.json, so replays crawl the same pages.
+
+    In record mode the real search is called and its results are saved; in replay mode
+    queries are answered from the file, and queries that were never recorded return nothing.
+    """
+
+    def __init__(self, path: str, search, record: bool):
+        self.path = path
+        self.search = search
+        self.record = record
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.results: Dict[str, List[str]] = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as search_file:
+                self.results = json.load(search_file)
+
+    def __call__(self, query: str, num_results: int = 10, **kwargs) -> List[str]:
+        key = f"{query}|{num_results}"
+        if self.record:
+            urls = list(self.search(query, num_results=num_results, **kwargs))
+            with self._lock:
+                self.results[key] = urls
+            return urls
+        with self._lock:
+            if key not in self.results:
+                self.misses += 1
+            return list(self.results.get(key, []))
+
+    def save(self) -> None:
+        with self._lock:
+            with open(self.path, 'w', encoding='utf-8') as search_file:
+                json.dump(self.results, search_file, indent=4, ensure_ascii=False)
+
+
+class FixtureMiss(requests.ConnectionError):
+    """A replayed run asked the network for a page the fixtures do not have"""
+
+
+class OfflinePages:
+    """
+    Network of a replay: every request reaching it is a page missing from the fixtures.
+
+    It is mounted on the fetcher's session and replaces the asyncio crawler's downloads,
+    so a replay never measures the live web. Misses fail like connection errors and make
+    the run invalid.
+    """
+
+    def __init__(self):
+        self.misses: List[str] = []
+        self._lock = threading.Lock()
+
+    def miss(self, url: str):
+        with self._lock:
+            self.misses.append(url)
+        raise FixtureMiss(f"{url} is not in the fixtures")
+
+    def install(self, fetcher) -> None:
+        import LaIA_async_crawler
+
+        adapter = _OfflineAdapter(self)
+        fetcher.session.mount('http://', adapter)
+        fetcher.session.mount('https://', adapter)
+
+        async def fetch(crawler, session, url, headers=None):
+            self.miss(url)
+        LaIA_async_crawler.AsyncCrawler._fetch = fetch
+
+
+class _OfflineAdapter(BaseAdapter):
+    def __init__(self, pages: OfflinePages):
+        super().__init__()
+        self.pages = pages
+
+    def send(self, request, **kwargs):
+        self.pages.miss(request.url)
+
+    def close(self) -> None:
+        pass
+
+
+def start_mock_llm(args) -> str:
+    """Run LaIA_mock_llm.py in a background thread, returns its base URL"""
+    from werkzeug.serving import make_server
+    from LaIA_mock_llm import create_app, LatencyModel, ScriptedResponder
+
+    mock = create_app(
+        LatencyModel(args.llm_latency, args.llm_latency_mean, args.llm_latency_std, args.llm_tokens_per_second, seed=args.seed),
+        ScriptedResponder(),
+        tts_latency=args.tts_latency,
+    )
+    server = make_server('127.0.0.1', 0, mock, threaded=True)
+    threading.Thread(target=server.serve_forever, name='mock-llm', daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def ask(client, question: str, tts: bool, timeout: float) -> Dict:
+    """Send a question from a new session and wait for its job, returns its status and latency"""
+    home = client.get('/')
+    session_id = re.search(r'const sessionId = "([^"]+)"', home.get_data(as_text=True)).group(1)
+
+    start = time.perf_counter()
+    while True:
+        response = client.post('/chat', json={'session_id': session_id, 'message': question, 'tts_enabled': tts, 'stream': False})
+        if response.status_code != 429:
+            break
+        time.sleep(0.5)  # Job queue full
+    if response.status_code != 202:
+        return {'question': question, 'status': f"http_{response.status_code}", 'latency': time.perf_counter() - start}
+
+    job_id = response.get_json()['job_id']
+    while time.perf_counter() - start < timeout:
+        job = client.get(f'/jobs/{job_id}', query_string={'session_id': session_id}).get_json()
+        if job['status'] in ('done', 'failed', 'cancelled'):
+            return {'question': question, 'status': job['status'], 'latency': time.perf_counter() - start}
+        time.sleep(0.05)
+    return {'question': question, 'status': 'timeout', 'latency': time.perf_counter() - start}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end latency of the /chat pipeline, per stage")
+    parser.add_argument("--questions", help="Text file with one question per line (built-in Catalan questions if not set)")
+    parser.add_argument("--fixtures", default=os.path.join(REPO_DIR, "benchmark_fixtures"), help="Recorded search results and pages")
+    parser.add_argument("--record", action="store_true", help="Search and crawl the real web, saving the results as fixtures")
+    parser.add_argument("--llm-url", help="Base URL of an already running LLM/TTS stand-in (one is started if not set)")
+    parser.add_argument("--llm-latency", choices=['fixed', 'normal', 'lognormal'], default='lognormal')
+    parser.add_argument("--llm-latency-mean", type=float, default=0.5)
+    parser.add_argument("--llm-latency-std", type=float, default=0.2)
+    parser.add_argument("--llm-tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--tts", action="store_true", help="Also generate the audio of every answer")
+    parser.add_argument("--tts-latency", type=float, default=0.2)
+    parser.add_argument("--concurrency", type=int, default=1, help="Questions in flight at the same time")
+    parser.add_argument("--repeat", type=int, default=1, help="Passes over the questions, later ones find warm caches")
+    parser.add_argument("--timeout", type=float, default=300, help="Seconds allowed for each question")
+    parser.add_argument("--workdir", help="Directory of the app's indexes and caches (a new temporary one if not set)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    questions = QUESTIONS
+    if args.questions:
+        with open(args.questions, 'r', encoding='utf-8') as questions_file:
+            questions = [line.strip() for line in questions_file if line.strip()]
+    fixtures = os.path.abspath(args.fixtures)
+    json_path = os.path.abspath(args.json) if args.json else None
+    os.makedirs(os.path.join(fixtures, 'pages'), exist_ok=True)
+
+    llm_url = (args.llm_url or start_mock_llm(args)).rstrip('/')
+    os.environ['LAIA_LLM_BASE_URL'] = f"{llm_url}/v1"
+    os.environ['API_URL'] = os.environ['MATCHA_URL'] = f"{llm_url}/tts"
+    for name in ('BASE_URL', 'OPENAI_TOKEN', 'HF_TOKEN'):
+        os.environ.setdefault(name, 'benchmark')
+
+    # Fresh indexes and caches: the app keeps them in relative folders
+    workdir = args.workdir or tempfile.mkdtemp(prefix='laia_benchmark_')
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+
+    import LaIA_app
+    import LaIA_web_search
+    from LaIA_page_cache import PageCache
+    from LaIA_timing import timings, latency_summary
+
+    # Pages come from the fixtures; when recording, missing ones are downloaded and kept,
+    # when replaying, they are never downloaded
+    pages = PageCache(os.path.join(fixtures, 'pages'), ttl=float('inf'), max_bytes=2 ** 40)
+    LaIA_app.fetcher.cache = LaIA_app.page_cache = pages
+    offline = OfflinePages()
+    if not args.record:
+        offline.install(LaIA_app.fetcher)
+    search_fixtures = SearchFixtures(os.path.join(fixtures, 'search.json'), LaIA_web_search.search, args.record)
+    LaIA_web_search.search = search_fixtures
+
+    client = LaIA_app.app.test_client()
+    runs = [question for _ in range(args.repeat) for question in questions]
+    timings.reset()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(lambda question: ask(client, question, args.tts, args.timeout), runs))
+    wall_time = time.perf_counter() - start
+
+    if args.record:
+        search_fixtures.save()
+
+    stages = timings.summary()
+    fixture_misses = {'search': search_fixtures.misses, 'pages': len(offline.misses)}
+    report = {
+        'timestamp': datetime.now().isoformat(),
+        'commit': git_commit(),
+        'config': {
+            'questions': len(questions),
+            'repeat': args.repeat,
+            'concurrency': args.concurrency,
+            'record': args.record,
+            'tts': args.tts,
+            'llm_url': llm_url if args.llm_url else 'LaIA_mock_llm.py',
+            'llm_latency': [args.llm_latency, args.llm_latency_mean, args.llm_latency_std, args.llm_tokens_per_second],
+        },
+        # A replay that missed fixtures ran on incomplete data, its numbers are not comparable
+        'valid': args.record or not any(fixture_misses.values()),
+        'requests': len(results),
+        'failed': sum(1 for result in results if result['status'] != 'done'),
+        'throughput': len(results) / wall_time if wall_time else 0.0,
+        'end_to_end': latency_summary(result['latency'] for result in results if result['status'] == 'done'),
+        'stages': {name: stages.get(name, {'count': 0}) for name in STAGES},
+        'fixture_misses': fixture_misses,
+        'missing_pages': sorted(set(offline.misses)),
+        'stats': LaIA_app.app.test_client().get('/stats').get_json(),
+        'results': results,
+    }
+
+    print(f"{report['requests']} requests, {report['failed']} failed, {report['throughput']:.2f} req/s")
+    print(f"{'stage':<20}{'count':>7}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for name, summary in [('end_to_end', report['end_to_end'])] + list(report['stages'].items()):
+        if summary['count']:
+            print(f"{name:<20}{summary['count']:>7}{summary['p50']:>9.3f}{summary['p95']:>9.3f}{summary['p99']:>9.3f}")
+        else:
+            print(f"{name:<20}{0:>7}")
+    if not report['valid']:
+        print(f"INVALID RUN, not in the fixtures: {report['fixture_misses']} (run with --record first)")
+
+    if json_path:
+        with open(json_path, 'w', encoding='utf-8') as json_file:
+            json.dump(report, json_file, indent=4, ensure_ascii=False)
+    if not report['valid']:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
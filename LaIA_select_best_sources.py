@@ -1,63 +1,103 @@
 import json
-from openai import OpenAI
+from concurrent.futures import ThreadPoolExecutor
 import logging
 import requests
 import re
+from typing import Dict, Optional, Union
+from LaIA_fetcher import Fetcher
+from LaIA_llm_gateway import LLMGateway
+from LaIA_source_ranker import SourceRanker
 
 # Set up logging
 logger = logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class SelectBestSources:
-	def __init__(self, base_url: str, api_key: str, max_source_chars_length: int = 500, max_simultaneous_sources: int = 5, remove_parent_urls: bool = False) -> None:
-		self.client = OpenAI(
+	def __init__(self, base_url: str, api_key: str, max_source_chars_length: int = 500, max_simultaneous_sources: int = 5, remove_parent_urls: bool = False, fetcher: Optional[Fetcher] = None, max_concurrent_requests: int = 4, max_concurrent_validations: int = 8,
+				 ranker: Optional[SourceRanker] = None, top_k: Optional[int] = None, min_score: Optional[float] = None, accept_score: Optional[float] = None, gateway: Optional[LLMGateway] = None) -> None:
+		# Requests are retried and limited by the shared gateway
+		self.client = (gateway or LLMGateway()).client_for(
+			'select_best_sources',
 			#base_url=base_url + "/v1/",
 			api_key=api_key
 		)
+		# Shared with the crawler, so validating a URL reuses its connection to the host
+		self.fetcher = fetcher or Fetcher()
 		self.max_source_chars_length = max_source_chars_length
 		self.max_simultaneous_sources = max_simultaneous_sources
 		self.remove_parent_urls = remove_parent_urls
+		# The batches of append_sources are selected in parallel, with at most this many LLM requests in flight
+		self.max_concurrent_requests = max_concurrent_requests
+		self.max_concurrent_validations = max_concurrent_validations
+		# Pre-ranking: only the top_k sources scoring at least min_score are sent to the LLM,
+		# and the ones scoring accept_score or more are selected without asking it (scores on the ranker's scale)
+		self.ranker = ranker
+		self.top_k = top_k
+		self.min_score = min_score
+		self.accept_score = accept_score
 		self.gathered_info = None
 		self.query = None
-		self.selected_sources = set()
+		self.selected_sources: Dict[str, str] = {} # url -> content
+		self.accepted_sources = set() # URLs selected by the ranker's accept_score, without the LLM
 
-	def __set_gathered_info(self, gathered_info_json_path: str) -> None:
-		json_content = json.load(open(gathered_info_json_path, 'r'))
-		self.gathered_info = json_content["gathered_info"]
-		self.query = json_content["query"]
+	def __set_gathered_info(self, gathered_info: Union[Dict, str]) -> None:
+		if isinstance(gathered_info, str):
+			# Path of a saved crawl
+			with open(gathered_info, 'r') as json_file:
+				gathered_info = json.load(json_file)
+		self.gathered_info = gathered_info["gathered_info"]
+		self.query = gathered_info["query"]
 
 	def __valid_url(self, url: str) -> bool:
 		# Check if the URL is valid
 		try:
-			r = requests.head(url, allow_redirects=True)
-			if r.status_code == 200:
+			if self.fetcher.head(url) == 200:
 				return True
 		except requests.RequestException as e:
 			logger.warning(f"Failed to reach {url}: {str(e)}")
 
 		return False
+
+	def __valid_urls(self, urls: list[str]) -> list[str]:
+		# Crawled pages are answered by the fetcher's status cache, the others are checked in parallel
+		if not urls:
+			return []
+		with ThreadPoolExecutor(max_workers=min(self.max_concurrent_validations, len(urls))) as executor:
+			valid = list(executor.map(self.__valid_url, urls))
+		return [url for url, is_valid in zip(urls, valid) if is_valid]
 	
 	def __get_sources_list_from_gathered_info(self) -> list[tuple]:
-		def aux(source: dict):
-			if source["sub_content"]:
-				current = [(source["url"], source["main_content"])]
-				subs = [aux(sub_source) for sub_source in source["sub_content"]]
-
-				for sub in subs:
-					current += sub
-
-				return current
+		# (url, content) of every page of the crawl trees, depth first, each URL once
+		sources = {}
+		stack = list(reversed(self.gathered_info))
+		while stack:
+			source = stack.pop()
+			sources.setdefault(source["url"], source["main_content"])
+			stack.extend(reversed(source["sub_content"]))
+
+		return list(sources.items())
 			
-			else:
-				return [(source["url"], source["main_content"])]
-		
-		results = []
-		for source in self.gathered_info:
-			results += aux(source)
-
-		return results
-			
-	def __select_best_sources(self, sources: list[tuple]) -> set[tuple]:
+	def __pre_rank_sources(self, sources: list[tuple]) -> tuple[list[tuple], list[tuple]]:
+		# Returns (sources left for the LLM, sources accepted without it), best first
+		try:
+			scores = self.ranker.score(self.query, [source[1] for source in sources])
+		except Exception as e:
+			logger.error(f"Error ranking sources, all are sent to the LLM: {str(e)}")
+			return sources, []
+
+		# Stable sort: equal scores keep the crawl order
+		ranked = sorted(zip(sources, scores), key=lambda x: -x[1])
+		if self.min_score is not None:
+			ranked = [(source, score) for source, score in ranked if score >= self.min_score]
+		if self.top_k is not None:
+			ranked = ranked[:self.top_k]
+
+		if self.accept_score is None:
+			return [source for source, _ in ranked], []
+		accepted = [source for source, score in ranked if score >= self.accept_score]
+		return [source for source, score in ranked if score < self.accept_score], accepted
+
+	def __select_best_sources(self, sources: list[tuple]) -> Dict[str, str]:
 		assert self.gathered_info is not None, "Gathered information is not set. Please set it using the set_gathered_info method."
 
 		context = f"Query: {self.query}\n\nSources and gathered information:\n"
@@ -86,61 +126,81 @@ class SelectBestSources:
 
 			selected_urls = [re.sub(r"[,)}\]]+$", "", url) for url in selected_urls]
 			
-			all_urls = [s[0] for s in sources]
-			all_contents = [s[1] for s in sources]
+			contents = {}
+			for url, content in sources:
+				contents.setdefault(url, content)
 			
-			valid_urls = []
-			for url in selected_urls:
-				if url in all_urls and self.__valid_url(url):
-					valid_urls.append(url)
+			valid_urls = self.__valid_urls(list(dict.fromkeys(url for url in selected_urls if url in contents)))
 
-			valid_urls_and_contents = set([(url, all_contents[all_urls.index(url)]) for url in valid_urls])
+			valid_urls_and_contents = {url: contents[url] for url in valid_urls}
 
 			if self.remove_parent_urls:
-				valid_urls_and_contents = self.__remove_parent_urls_from_set(valid_urls_and_contents)
+				valid_urls_and_contents = self.__remove_parent_urls(valid_urls_and_contents)
 
 			return valid_urls_and_contents
 			
 		except Exception as e:
 			logger.error(f"Error in synthesis: {str(e)}")
-			return []
+			return {}
 		
-	def __remove_parent_urls_from_set(self, urls_and_contents: set[tuple]) -> set[tuple]:
+	def __remove_parent_urls(self, urls_and_contents: Dict[str, str]) -> Dict[str, str]:
+		# Drops every URL that another URL starts with. In sorted order, the URLs starting with
+		# a URL come right after it, so comparing each URL with the next one is enough
 		if not urls_and_contents:
 			return urls_and_contents
 
-		sorted_urls = list(sorted(urls_and_contents, key=lambda x: len(x[0]), reverse=False))
+		sorted_urls = sorted(urls_and_contents)
+		parent_urls = {url for url, next_url in zip(sorted_urls, sorted_urls[1:]) if next_url.startswith(url)}
 
-		removed_indices = []
-		for i, (url, _) in enumerate(sorted_urls):
-			for (parent_url, _) in sorted_urls[i + 1:]:
-				if parent_url.startswith(url):
-					removed_indices.append(i)
-
-		return set([sorted_urls[i] for i in range(len(sorted_urls)) if i not in removed_indices])
+		return {url: content for url, content in urls_and_contents.items() if url not in parent_urls}
 		
 	def get_current_sources(self) -> list[tuple]:
-		return list(self.selected_sources)
+		return list(self.selected_sources.items())
 	
 	def reset_current_sources(self) -> None:
-		self.selected_sources = set()
+		self.selected_sources = {}
+		self.accepted_sources = set()
 	
-	def append_sources(self, gathered_info_json_path: str) -> None:
-		self.__set_gathered_info(gathered_info_json_path)
-
-		sources_list = self.__get_sources_list_from_gathered_info()
-
-		for sources_sublist in [sources_list[i:i + self.max_simultaneous_sources] for i in range(0, len(sources_list), self.max_simultaneous_sources)]:
-			best_sources = self.__select_best_sources(sources=sources_sublist)
+	def append_sources(self, gathered_info: Union[Dict, str]) -> None:
+		"""
+		Select the best sources of a crawl and add them to the current sources.
 
-			self.selected_sources.update(best_sources)
+		Args:
+			gathered_info: {'query', 'gathered_info'} returned by WebSearchAgent.search_and_analyze,
+				or the path of a JSON file with the same structure
+		"""
+		self.__set_gathered_info(gathered_info)
 
-			if self.remove_parent_urls:
-				self.selected_sources = self.__remove_parent_urls_from_set(self.selected_sources)
+		sources_list = self.__get_sources_list_from_gathered_info()
+		if self.ranker is not None:
+			sources_list, accepted = self.__pre_rank_sources(sources_list)
+			valid_urls = set(self.__valid_urls([source[0] for source in accepted]))
+			for url, content in accepted:
+				if url in valid_urls:
+					self.accepted_sources.add(url)
+					self.selected_sources.setdefault(url, content)
+
+		batches = [sources_list[i:i + self.max_simultaneous_sources] for i in range(0, len(sources_list), self.max_simultaneous_sources)]
+		batches_best_sources = []
+		if batches:
+			# One LLM request per batch, all in flight at once; map keeps the batch order, so the merge is the same as one by one
+			with ThreadPoolExecutor(max_workers=min(self.max_concurrent_requests, len(batches))) as executor:
+				batches_best_sources = list(executor.map(lambda batch: self.__select_best_sources(sources=batch), batches))
+
+		for best_sources in batches_best_sources:
+			for url, content in best_sources.items():
+				self.selected_sources.setdefault(url, content)
+
+		# Pruning once gives the same result as after every batch: the longest URL of a chain always stays
+		if self.remove_parent_urls:
+			self.selected_sources = self.__remove_parent_urls(self.selected_sources)
 
 	def get_final_sources(self, original_query: str) -> list[tuple]:
 		self.query = original_query
-		return list(self.__select_best_sources(sources=list(self.selected_sources)))
+		if self.selected_sources and self.selected_sources.keys() <= self.accepted_sources:
+			# Every source was decisive for the ranker, no need to ask the LLM again
+			return list(self.selected_sources.items())
+		return list(self.__select_best_sources(sources=list(self.selected_sources.items())).items())
 	
 
 # Example usage
@@ -159,7 +219,7 @@ def main():
 
 	gathered_info_json_path = "./data/context_data_COM PUC FER-ME PROFE.json"
 
-	select_best_sources.append_sources(gathered_info_json_path=gathered_info_json_path)
+	select_best_sources.append_sources(gathered_info_json_path)
 
 	for source in select_best_sources.get_current_sources():
 		print(f"{source[0]}")
@@ -0,0 +1,108 @@
+import math
+import re
+from collections import Counter
+from typing import List, Optional
+import numpy as np
+from LaIA_embedding_cache import EmbeddingCache
+
+# Characters of each source scored, the beginning of a page says what it is about
+RANKED_CHARS = 2000
+
+_TOKEN = re.compile(r'\w+', re.UNICODE)
+
+
+class SourceRanker:
+    """Scores candidate sources against a query, higher is more relevant"""
+
+    name = None
+
+    def score(self, query: str, texts: List[str]) -> List[float]:
+        """
+        Args:
+            query: Search query
+            texts: Content of each source
+
+        Returns:
+            List[float]: One score per text
+        """
+        raise NotImplementedError
+
+
+class EmbeddingRanker(SourceRanker):
+    """
+    Cosine similarity between the query and each source, with the RAG embedding model.
+
+    Sources are embedded through the EmbeddingService and EmbeddingCache when given, so a
+    page ranked again by a later search is not embedded twice.
+    """
+
+    name = 'embeddings'
+
+    def __init__(self, embeddings, embedding_service=None, embedding_cache: Optional[EmbeddingCache] = None):
+        """
+        Args:
+            embeddings: Langchain embeddings object
+            embedding_service: Batches the sources with the other embedding requests (direct calls if None)
+            embedding_cache: Cache of already embedded texts (no caching if None)
+        """
+        self.embeddings = embeddings
+        self.embedding_service = embedding_service
+        self.embedding_cache = embedding_cache
+
+    def _embed(self, texts: List[str]) -> List:
+        if self.embedding_service is not None:
+            return self.embedding_service.submit(texts).result()
+        return self.embeddings.embed_documents(texts)
+
+    def _embed_sources(self, texts: List[str]) -> List:
+        if self.embedding_cache is None:
+            return self._embed(texts)
+        vectors = self.embedding_cache.get_many(texts)
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        if missing:
+            new_vectors = self._embed(missing)
+            self.embedding_cache.put_many(missing, new_vectors)
+            embedded = dict(zip(missing, new_vectors))
+            vectors = [embedded[text] if vector is None else vector for text, vector in zip(texts, vectors)]
+        return vectors
+
+    def score(self, query: str, texts: List[str]) -> List[float]:
+        if not texts:
+            return []
+        query_vector = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+        vectors = np.asarray(self._embed_sources([text[:RANKED_CHARS] for text in texts]), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1) * np.linalg.norm(query_vector)
+        return (vectors @ query_vector / np.maximum(norms, 1e-12)).tolist()
+
+
+class BM25Ranker(SourceRanker):
+    """Okapi BM25 over the candidate sources, for when no embedding model is loaded"""
+
+    name = 'bm25'
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+
+    @staticmethod
+    def tokenize(text: str) -> List[str]:
+        return _TOKEN.findall(text.lower())
+
+    def score(self, query: str, texts: List[str]) -> List[float]:
+        if not texts:
+            return []
+        documents = [Counter(self.tokenize(text[:RANKED_CHARS])) for text in texts]
+        lengths = [sum(document.values()) for document in documents]
+        average_length = sum(lengths) / len(lengths) or 1.0
+
+        scores = [0.0] * len(documents)
+        for term in set(self.tokenize(query)):
+            containing = sum(1 for document in documents if term in document)
+            if not containing:
+                continue
+            idf = math.log(1 + (len(documents) - containing + 0.5) / (containing + 0.5))
+            for i, (document, length) in enumerate(zip(documents, lengths)):
+                frequency = document.get(term, 0)
+                if frequency:
+                    scores[i] += idf * frequency * (self.k1 + 1) / (frequency + self.k1 * (1 - self.b + self.b * length / average_length))
+        return scores
@@ -0,0 +1,143 @@
+import time
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+
+
+def latency_summary(samples: Iterable[float]) -> Dict:
+    """Count, mean and p50/p95/p99/max of durations in seconds"""
+    values = np.asarray(list(samples), dtype=np.float64)
+    if not len(values):
+        return {'count': 0}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        'count': int(len(values)),
+        'mean': float(values.mean()),
+        'p50': float(p50),
+        'p95': float(p95),
+        'p99': float(p99),
+        'max': float(values.max()),
+    }
+
+
+def _wall_time(intervals: List[Tuple[float, float]]) -> float:
+    """Length of the union of (start, end) intervals: parallel calls of a stage overlap"""
+    total = 0.0
+    current_start, current_end = None, None
+    for start, end in sorted(intervals):
+        if current_end is None or start > current_end:
+            if current_end is not None:
+                total += current_end - current_start
+            current_start, current_end = start, end
+        else:
+            current_end = max(current_end, end)
+    if current_end is not None:
+        total += current_end - current_start
+    return total
+
+
+class _RequestStages:
+    """Intervals of every stage run for one request, from all the threads working on it"""
+
+    def __init__(self):
+        self.intervals: Dict[str, List[Tuple[float, float]]] = {}
+        self.lock = threading.Lock()
+
+    def add(self, name: str, start: float, end: float) -> None:
+        with self.lock:
+            self.intervals.setdefault(name, []).append((start, end))
+
+
+_current_request: "contextvars.ContextVar[Optional[_RequestStages]]" = contextvars.ContextVar('laia_request_stages', default=None)
+
+
+class StageTimings:
+    """
+    Durations of the stages of the chat pipeline, one sample per request and stage.
+
+    Inside request() every stage block of the request adds to its stage, and the request
+    records one sample per stage it went through: the wall time of the stage, so the 3
+    queries searched in parallel count once, as the time the request spent searching.
+    Stage blocks run outside a request are recorded as samples of their own.
+
+    The last max_samples durations of each stage are kept. Reported in /stats and by
+    LaIA_pipeline_benchmark.py.
+    """
+
+    def __init__(self, max_samples: int = 10000):
+        self.max_samples = max_samples
+        self._samples: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+    def record(self, name: str, seconds: float) -> None:
+        with self._lock:
+            if name not in self._samples:
+                self._samples[name] = deque(maxlen=self.max_samples)
+            self._samples[name].append(seconds)
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time the enclosed block as part of a stage, also when it raises"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            request = _current_request.get()
+            if request is None:
+                self.record(name, end - start)
+            else:
+                request.add(name, start, end)
+
+    @contextmanager
+    def request(self):
+        """Group the stages run by the enclosed block (and the threads it starts with in_request) as one request"""
+        request = _RequestStages()
+        token = _current_request.set(request)
+        try:
+            yield
+        finally:
+            _current_request.reset(token)
+            with request.lock:
+                intervals = dict(request.intervals)
+            for name, stage_intervals in intervals.items():
+                self.record(name, _wall_time(stage_intervals))
+
+    def summary(self) -> Dict[str, Dict]:
+        with self._lock:
+            samples = {name: list(values) for name, values in self._samples.items()}
+        return {name: latency_summary(values) for name, values in sorted(samples.items())}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._samples.clear()
+
+
+# Shared by all the modules of the process
+timings = StageTimings()
+
+
+def stage(name: str):
+    """Time a block as part of a pipeline stage: with stage('crawl'): ..."""
+    return timings.stage(name)
+
+
+def request_timing():
+    """Time the stages of a block as one request: with request_timing(): answer_message(...)"""
+    return timings.request()
+
+
+def in_request(function: Callable) -> Callable:
+    """function bound to the current request, for running it in another thread (executor.submit(in_request(f), ...))"""
+    request = _current_request.get()
+
+    def run(*args, **kwargs):
+        token = _current_request.set(request)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _current_request.reset(token)
+    return run
@@ -0,0 +1,116 @@
+from dataclasses import dataclass
+from typing import List, Optional
+import math
+import numpy as np
+import faiss
+
+INDEX_TYPES = ('flat', 'ivf', 'hnsw')
+QUANTIZATIONS = (None, 'sq8', 'pq')
+
+
+@dataclass
+class IndexConfig:
+    """
+    FAISS index used by a DocumentManager.
+
+    Every store starts on the exact flat index langchain creates. Other index types need
+    training data, so the store is migrated to them once it holds migrate_threshold chunks.
+    """
+    index_type: str = 'flat'  # 'flat', 'ivf' or 'hnsw'
+    quantization: Optional[str] = None  # None, 'sq8' (int8 scalar) or 'pq' (product quantization)
+    migrate_threshold: int = 10000
+    nlist: Optional[int] = None  # IVF lists, 4 * sqrt(chunks) if not set
+    nprobe: int = 16
+    hnsw_m: int = 32
+    ef_search: int = 64
+    pq_m: int = 16  # PQ sub-quantizers, lowered to a divisor of the embedding size if needed
+
+    def __post_init__(self):
+        assert self.index_type in INDEX_TYPES, f"Invalid index type {self.index_type}"
+        assert self.quantization in QUANTIZATIONS, f"Invalid quantization {self.quantization}"
+
+    @property
+    def needs_migration(self) -> bool:
+        return self.index_type != 'flat' or self.quantization is not None
+
+    def factory_string(self, dim: int, n: int) -> str:
+        """FAISS index_factory description for dim-dimensional vectors and about n of them"""
+        pq_m = max(m for m in range(1, self.pq_m + 1) if dim % m == 0)
+        # k-means needs at least 2^bits training points per sub-quantizer
+        pq_bits = min(8, max(1, int(math.log2(max(n, 2)))))
+        codes = {None: 'Flat', 'sq8': 'SQ8', 'pq': f'PQ{pq_m}x{pq_bits}'}[self.quantization]
+
+        if self.index_type == 'ivf':
+            nlist = self.nlist or max(1, int(4 * math.sqrt(n)))
+            return f"IVF{nlist},{codes}"
+        if self.index_type == 'hnsw':
+            return f"HNSW{self.hnsw_m}" if self.quantization is None else f"HNSW{self.hnsw_m}_{codes}"
+        return codes
+
+
+def set_search_params(index: faiss.Index, config: IndexConfig) -> None:
+    """Apply the query-time knobs (nprobe, efSearch) of the config to an index"""
+    parameters = faiss.ParameterSpace()
+    if config.index_type == 'ivf':
+        parameters.set_index_parameter(index, 'nprobe', config.nprobe)
+    elif config.index_type == 'hnsw':
+        parameters.set_index_parameter(index, 'efSearch', config.ef_search)
+
+
+def build_index(config: IndexConfig, vectors: np.ndarray) -> faiss.Index:
+    """
+    Create, train and fill an index.
+
+    Args:
+        config: Index configuration
+        vectors: float32 matrix with one vector per row, in docstore position order
+
+    Returns:
+        faiss.Index: Index holding the vectors at positions 0..n-1
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    n, dim = vectors.shape
+    index = faiss.index_factory(dim, config.factory_string(dim, n), faiss.METRIC_L2)
+    if not index.is_trained:
+        index.train(vectors)
+    if config.index_type == 'ivf':
+        # Keeps vectors reconstructible, needed to rebuild the index after removals
+        faiss.extract_index_ivf(index).make_direct_map()
+    set_search_params(index, config)
+    index.add(vectors)
+    return index
+
+
+def supports_removal(index: faiss.Index) -> bool:
+    """
+    Whether langchain's FAISS.delete works on the index.
+
+    langchain assumes positions shift down after a removal, which only holds for the
+    flat-codes indexes (Flat, SQ, PQ). IVF keeps the removed ids and HNSW cannot remove.
+    """
+    return isinstance(index, faiss.IndexFlatCodes)
+
+
+def reconstruct_all(index: faiss.Index) -> np.ndarray:
+    """Vectors stored in an index, decoded (approximately, for quantized indexes)"""
+    if index.ntotal == 0:
+        return np.empty((0, index.d), dtype=np.float32)
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def rebuild_index(index: faiss.Index, keep_positions: List[int]) -> faiss.Index:
+    """
+    Copy of a trained index holding only the vectors at keep_positions, renumbered from 0.
+
+    The trained quantizers are reused, so quantized vectors are re-encoded to the same codes
+    rather than drifting with every rebuild.
+    """
+    vectors = reconstruct_all(index)[keep_positions]
+    new_index = faiss.clone_index(index)
+    new_index.reset()
+    new_index.add(np.ascontiguousarray(vectors, dtype=np.float32))
+    return new_index
+
+
+def index_size_bytes(index: faiss.Index) -> int:
+    return faiss.serialize_index(index).nbytes
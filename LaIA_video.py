@@ -9,12 +9,12 @@ from pydub import AudioSegment
 from moviepy.editor import ImageClip, AudioFileClip, TextClip, CompositeVideoClip, concatenate_videoclips
 from textwrap import wrap
 from moviepy.video.fx.all import fadein, fadeout
-from openai import OpenAI
+from LaIA_llm_gateway import LLMGateway
 import random
 
 
 class LaIA_video:
-    def __init__(self, dialogue_text='', dialect='central', voices = {'man':'grau', 'woman':'elia'}, final_video_ubi = "final_video_with_subtitles.mp4"):
+    def __init__(self, dialogue_text='', dialect='central', voices = {'man':'grau', 'woman':'elia'}, final_video_ubi = "final_video_with_subtitles.mp4", gateway=None):
         assert dialogue_text, "Text is required"
         assert dialect in ["central", "nord-occidental", "balear", "valencia"], "Invalid dialect"
 
@@ -29,7 +29,7 @@ class LaIA_video:
         self.API_URL = os.environ["API_URL"]
         self.MATCHA_URL = os.environ["MATCHA_URL"]
         self.HF_TOKEN = os.environ["HF_TOKEN"]
-        self._client()
+        self._client(gateway)
 
         # Headers for API requests
         self.headers = {
@@ -42,11 +42,12 @@ class LaIA_video:
         # Create video
         self.create_video()
 
-    def _client(self):
+    def _client(self, gateway=None):
         """
-        Create an OpenAI client
+        Create an OpenAI-compatible client through the shared LLM gateway (a new one if None)
         """
-        self.client = OpenAI(
+        self.client = (gateway or LLMGateway()).client_for(
+            'video',
             base_url=f"{self.BASE_URL}/v1/",
             api_key=self.HF_TOKEN
         )
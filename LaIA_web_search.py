@@ -1,23 +1,29 @@
 import os
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Union
 from dotenv import load_dotenv
-from openai import OpenAI
-import requests
-from bs4 import BeautifulSoup
-from urllib.parse import urljoin, urlparse
 import time
 from googlesearch import search
 import concurrent.futures
 import logging
-import json
-import re
+import requests
 from LaIA_select_best_sources import SelectBestSources
+from LaIA_fetcher import Fetcher, FetchResult, BodyTooLarge, UnsupportedContentType, DEFAULT_HEADERS
+from LaIA_async_crawler import AsyncCrawler
+from LaIA_crawl_state import CrawlState
+from LaIA_html_extractor import get_extractor
+from LaIA_page_cache import extracted_by
+from LaIA_crawl_archive import CrawlArchive
+from LaIA_llm_gateway import LLMGateway
+from LaIA_timing import stage, in_request
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class WebSearchAgent:
-    def __init__(self, base_url: str, api_key: str, max_depth: int = 3, max_links_per_page: int = 5):
+    def __init__(self, base_url: str, api_key: str, max_depth: int = 3, max_links_per_page: int = 5, fetcher: Optional[Fetcher] = None,
+                 crawler_backend: str = 'threads', crawl_concurrency: int = 8, crawl_deadline: Optional[float] = None,
+                 crawl_bloom_capacity: Optional[int] = None, extractor: str = 'beautifulsoup',
+                 archive: Optional[CrawlArchive] = None, gateway: Optional[LLMGateway] = None):
         """
         Initialize the web search agent with configuration parameters.
         
@@ -26,98 +32,198 @@ class WebSearchAgent:
             api_key: API key for authentication
             max_depth: Maximum depth for recursive link exploration
             max_links_per_page: Maximum number of links to explore per page
+            fetcher: HTTP client used to download pages (a new one if None)
+            crawler_backend: 'threads' (recursive thread pools) or 'asyncio' (AsyncCrawler)
+            crawl_concurrency: Maximum pages downloaded at the same time by each asyncio crawl
+            crawl_deadline: Seconds after which an asyncio crawl returns what it has (no limit if None)
+            crawl_bloom_capacity: Track the visited URLs of each search in a Bloom filter of this capacity
+                instead of a set, for very large crawls
+            extractor: HTML parser used on the pages: 'beautifulsoup', 'lxml' or 'selectolax'
+                (see LaIA_extractor_benchmark.py)
+            archive: Keeps a copy of every crawl on disk, for debugging (none if None)
+            gateway: Shared LLM gateway (a new one if None)
         """
-        self.client = OpenAI(
+        assert crawler_backend in ('threads', 'asyncio'), f"Invalid crawler backend {crawler_backend}"
+        gateway = gateway or LLMGateway()
+        self.client = gateway.client_for(
+            'web_search',
             #base_url=base_url + "/v1/",
             api_key=api_key
         )
+        # Own caller name, so the query rewriting can be cached on its own
+        self.prompt_client = gateway.client_for('process_prompt', api_key=api_key)
+        self.fetcher = fetcher or Fetcher()
+        self.crawler_backend = crawler_backend
+        self.crawl_concurrency = crawl_concurrency
+        self.crawl_deadline = crawl_deadline
         self.max_depth = max_depth
         self.max_links_per_page = max_links_per_page
-        self.visited_urls = set()
+        self.crawl_bloom_capacity = crawl_bloom_capacity
+        self.extractor = get_extractor(extractor)
+        self.archive = archive
         
-    def search_and_analyze(self, query: str) -> str:
+    def search_and_analyze(self, query: str, state: Optional[CrawlState] = None) -> Union[Dict, bool]:
         """
         Main method to handle the search and analysis process.
         
         Args:
             query: User's search query
+            state: Visited URLs and page budget, shared with the other searches of the same
+                invocation (a new one if None)
             
         Returns:
-            str: Synthesized response based on gathered information
+            Union[Dict, bool]: {'query', 'gathered_info'} crawl result, ready for
+                SelectBestSources.append_sources, or False if nothing could be found
         """
+        if state is None:
+            state = CrawlState(bloom_capacity=self.crawl_bloom_capacity)
         try:
             # Initial Google search
             # print("Searching " + query + " ...")
-            search_results = list(search(query , num_results=2)) # +  " site:gencat.cat/ca"
+            with stage('search'):
+                search_results = list(search(query , num_results=2)) # +  " site:gencat.cat/ca"
             
             if not search_results:
                 print("No search results found for the query in Gencat, searching in the whole web.")
-                search_results = list(search(query, num_results=2))
+                with stage('search'):
+                    search_results = list(search(query, num_results=2))
                 if not search_results:
                     return False
             
             # Collect information from multiple sources
-            gathered_info = []
-            for url in search_results:
-                info = self._explore_url(url, depth=0)
-                if info:
-                    gathered_info.append(info)
+            with stage('crawl'):
+                if self.crawler_backend == 'asyncio':
+                    gathered_info = self._crawler(state).crawl(search_results)
+                else:
+                    gathered_info = []
+                    for url in search_results:
+                        info = self._explore_url(url, depth=0, state=state)
+                        if info:
+                            gathered_info.append(info)
             
             # Synthesize final response using LLM
             return self._synthesize_information(query, gathered_info)
             
         except Exception as e:
             logger.error(f"Error in search_and_analyze: {str(e)}")
-            return f"An error occurred while processing your query: {str(e)}"
+            return False
+
+    def search_many(self, queries: List[str], max_pages: Optional[int] = None):
+        """
+        Run search_and_analyze for several queries at the same time.
+
+        The crawls share one CrawlState, so a page found by two queries is fetched once,
+        and a budget of max_pages fetched pages in total.
+
+        Args:
+            queries: Search queries
+            max_pages: Maximum number of pages fetched for all the queries (unlimited if None)
+
+        Yields:
+            tuple: (query, search_and_analyze output), as soon as each query finishes
+        """
+        state = CrawlState(max_pages, bloom_capacity=self.crawl_bloom_capacity)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(queries))) as executor:
+            future_to_query = {
+                executor.submit(in_request(self.search_and_analyze), query, state): query
+                for query in queries
+            }
+            for future in concurrent.futures.as_completed(future_to_query):
+                yield future_to_query[future], future.result()
         
-    def simple_web(self, url: str):
+    def simple_web(self, url: str) -> str:
+        """
+        Main content of a single page, for the pages users add by URL.
+
+        Raises:
+            UnsupportedContentType: If the page is not HTML
+            BodyTooLarge: If the page is bigger than the fetcher allows
+            requests.RequestException: If the page could not be downloaded or did not answer 200
+        """
         try:
-            response = requests.get(url, timeout=10, headers={'User-Agent': 'Mozilla/5.0'})
-            soup = BeautifulSoup(response.text, 'html.parser')
-            
-            # Extract main content
-            main_content = self._extract_main_content(soup)
-            print(main_content)
+            response = self.fetcher.get(url)
+            if response.status_code != 200:
+                raise requests.HTTPError(f"{url} answered {response.status_code}")
+            main_content, _ = self._page_content(url, response)
+        except (UnsupportedContentType, BodyTooLarge) as e:
+            logger.warning(f"Skipping {url}: {str(e)}")
+            raise
+        except requests.RequestException as e:
+            logger.warning(f"Could not download {url}: {str(e)}")
+            raise
+        return main_content
 
-            
-            return main_content
-        except:
-            print("error")
+    def _crawler(self, state: CrawlState) -> AsyncCrawler:
+        return AsyncCrawler(
+            parse_page=self._parse_page,
+            extractor_name=self.extractor.name,
+            claim_url=state.claim,
+            is_visited=state.is_visited,
+            page_cache=self.fetcher.cache,
+            record_status=self.fetcher.statuses.record,
+            max_depth=self.max_depth,
+            max_links_per_page=self.max_links_per_page,
+            concurrency=self.crawl_concurrency,
+            max_per_host=self.fetcher.max_per_host,
+            host_delay=self.fetcher.reserve_turn,
+            retries=self.fetcher.retries,
+            backoff_factor=self.fetcher.backoff_factor,
+            deadline=self.crawl_deadline,
+            timeout=self.fetcher.timeout,
+            max_body_bytes=self.fetcher.max_body_bytes,
+            read_limit_bytes=self.fetcher.read_limit_bytes,
+            allowed_content_types=self.fetcher.allowed_content_types,
+            headers=DEFAULT_HEADERS
+        )
+
+    def _parse_page(self, html: str, url: str):
+        """Main content and relevant links of a page"""
+        return self.extractor.extract(html, url)
 
-    def _explore_url(self, url: str, depth: int) -> Optional[Dict]:
+    def _page_content(self, url: str, response: Optional[FetchResult] = None):
+        """Main content and relevant links of a page, parsed only if the page cache does not have them"""
+        if response is None:
+            response = self.fetcher.get(url)
+        extracted = extracted_by(response.extracted, self.extractor.name)
+        if extracted is not None:
+            return extracted['main_content'], extracted['links']
+        main_content, links = self._parse_page(response.text, url)
+        if not response.truncated:
+            self.fetcher.store_extracted(url, main_content, links, self.extractor.name)
+        return main_content, links
+
+    def _explore_url(self, url: str, depth: int, state: CrawlState) -> Optional[Dict]:
         """
         Recursively explore a URL and its linked content.
         
         Args:
             url: URL to explore
             depth: Current exploration depth
+            state: Visited URLs and page budget of the search
             
         Returns:
             Optional[Dict]: Dictionary containing extracted information and metadata
         """
         print("Searching " + str(url) + "...")
-        if depth >= self.max_depth or url in self.visited_urls or url.endswith(".pdf"):
+        if depth >= self.max_depth or url.endswith(".pdf"):
+            return None
+
+        # Mark URL as visited
+        if not state.claim(url):
             return None
             
         try:
-            # Mark URL as visited
-            self.visited_urls.add(url)
-            
             # Fetch and parse content
-            response = requests.get(url, timeout=10, headers={'User-Agent': 'Mozilla/5.0'})
-            soup = BeautifulSoup(response.text, 'html.parser')
-            
-            # Extract main content
-            main_content = self._extract_main_content(soup)
+            main_content, links = self._page_content(url)
             
-            # Extract relevant links for further exploration
-            links = self._extract_relevant_links(soup, url)
+            # Relevant links for further exploration, not already visited
+            links = [link for link in links if not state.is_visited(link)]
             
             # Recursive exploration of linked content
             sub_content = []
             with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
                 future_to_url = {
-                    executor.submit(self._explore_url, link, depth + 1): link 
+                    executor.submit(self._explore_url, link, depth + 1, state): link 
                     for link in links[:self.max_links_per_page]
                 }
                 for future in concurrent.futures.as_completed(future_to_url):
@@ -137,87 +243,24 @@ class WebSearchAgent:
             logger.error(f"Error exploring URL {url}: {str(e)}")
             return None
 
-    def _extract_main_content(self, soup: BeautifulSoup) -> str:
-        """
-        Extract the main content from a webpage.
-        
-        Args:
-            soup: BeautifulSoup object of the webpage
-            
-        Returns:
-            str: Extracted main content
-        """
-        # Remove script and style elements
-        for script in soup(['script', 'hidden-xs',  'style', 'nav', 'footer', 'header']):
-            script.decompose()
-            
-        # Extract text from common content containers
-        content_containers = soup.find_all(['article', 'div'], class_=['content', 'main', 'tramit-steps' , 'container', 'article', 'blocs'])
-        
-        if content_containers:
-            return ' '.join(container.get_text(strip=True) for container in content_containers)
-        
-        # Fallback to body content if no specific containers found
-        return soup.body.get_text(strip=True) if soup.body else ''
-
-    def _extract_relevant_links(self, soup: BeautifulSoup, base_url: str) -> List[str]:
-        """
-        Extract relevant links from a webpage.
-        
-        Args:
-            soup: BeautifulSoup object of the webpage
-            base_url: Base URL for resolving relative links
-            
-        Returns:
-            List[str]: List of relevant URLs
-        """
-        links = []
-        base_domain = urlparse(base_url).netloc
-        
-        for link in soup.find_all('a', href=True):
-            url = urljoin(base_url, link['href'])
-            parsed_url = urlparse(url)
-            
-            # Filter links based on relevance
-            if (
-                parsed_url.netloc == base_domain and  # Same domain
-                parsed_url.scheme in ('http', 'https') and  # Valid scheme
-                '#' not in url and  # Not an anchor
-                'javascript:' not in url and  # Not JavaScript
-                url not in self.visited_urls and # Not already visited
-                ".pdf" not in url and
-                not url.endswith(".pdf")
-
-            ):
-                links.append(url)
-                
-        return links
-
-    def _synthesize_information(self, query: str, gathered_info: List[Dict]) -> str:
+    def _synthesize_information(self, query: str, gathered_info: List[Dict]) -> Dict:
         """
-        Use LLM to synthesize gathered information into a coherent response.
+        Gather the crawl of a query in the structure SelectBestSources reads.
         
         Args:
             query: Original user query
             gathered_info: List of dictionaries containing gathered information
             
         Returns:
-            str: Synthesized response
+            Dict: {'query', 'gathered_info'}, passed in memory (archived in the background if enabled)
         """
-        
-        data_to_save = {
+        crawl = {
             "query": query,
             "gathered_info": gathered_info,
         }
-
-        # Define the file path
-        filename = re.sub(r'[\\/*?:"<>|]', '_', query.replace(' ', ''))
-        file_path = f"./data/context_data_{filename}.json"
-
-        # Save the dictionary as a JSON file
-        with open(file_path, 'w') as json_file:
-            json.dump(data_to_save, json_file, indent=4)
-        return file_path
+        if self.archive is not None:
+            self.archive.save(crawl)
+        return crawl
 
 
     def generate_rag_response(self, question: str, context: str) -> str:
@@ -270,12 +313,13 @@ class WebSearchAgent:
         ]
 
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=messages,
-                temperature=0.3,
-                max_tokens=1000
-            )
+            with stage('prompt_rewrite'):
+                response = self.prompt_client.chat.completions.create(
+                    model="gpt-4o-mini",
+                    messages=messages,
+                    temperature=0.3,
+                    max_tokens=1000
+                )
             
             return response.choices[0].message.content
             
@@ -291,12 +335,14 @@ def main():
     
     base_url = os.environ["BASE_URL"]
     api_key = os.environ["OPENAI_TOKEN"]
+    gateway = LLMGateway(api_key=api_key)
     # Initialize the agent
     agent = WebSearchAgent(
         base_url=base_url,
         api_key=api_key,
         max_depth=2,
-        max_links_per_page=3
+        max_links_per_page=3,
+        gateway=gateway
     )
     
     # Example query
@@ -306,11 +352,10 @@ def main():
     query = query.split("\n")
     responses = []
 
-    select_best_sources = SelectBestSources(base_url=base_url, api_key=api_key, max_source_chars_length=500, max_simultaneous_sources=5, remove_parent_urls=True)
-    for q in query[:3]:
-    # Get response
-        response = agent.search_and_analyze(q)
-        select_best_sources.append_sources(response)
+    select_best_sources = SelectBestSources(base_url=base_url, api_key=api_key, max_source_chars_length=500, max_simultaneous_sources=5, remove_parent_urls=True, fetcher=agent.fetcher, gateway=gateway)
+    for q, response in agent.search_many(query[:3]):
+        if response:
+            select_best_sources.append_sources(response)
     responses = select_best_sources.get_final_sources(old_query)
     print(responses)
     
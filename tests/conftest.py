@@ -0,0 +1,122 @@
+import os
+import sys
+import hashlib
+import threading
+from types import SimpleNamespace
+from typing import List
+import numpy as np
+import pytest
+from werkzeug.serving import make_server
+
+# The LaIA_* modules live at the root of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DIM = 32
+
+
+def fake_vector(text: str) -> List[float]:
+    """Deterministic pseudo-random embedding of a text"""
+    seed = int.from_bytes(hashlib.sha1(text.encode("utf-8")).digest()[:4], "little")
+    return np.random.default_rng(seed).standard_normal(DIM).astype(np.float32).tolist()
+
+
+class FakeEmbeddings:
+    """Stand-in for the HuggingFace embeddings: same interface, no model, counts the texts embedded"""
+
+    def __init__(self):
+        self.embedded = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.embedded += len(texts)
+        return [fake_vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return fake_vector(text)
+
+    def __call__(self, text: str) -> List[float]:
+        return self.embed_query(text)
+
+
+class ParagraphSplitter:
+    """One chunk per paragraph"""
+
+    def split_text(self, text: str) -> List[str]:
+        return [paragraph for paragraph in text.split("\n\n") if paragraph]
+
+
+class StubLLM:
+    """OpenAI-compatible client answering every chat completion with the same text, counts the calls"""
+
+    def __init__(self, answer: str = "Segons el context [1], sí."):
+        self.answer = answer
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, **kwargs):
+        self.calls += 1
+        if kwargs.get('stream'):
+            return StubStream(self.answer)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=self.answer))])
+
+
+class StubStream:
+    def __init__(self, answer: str):
+        self.events = [SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=answer[i:i + 4]))])
+                       for i in range(0, len(answer), 4)]
+
+    def __iter__(self):
+        return iter(self.events)
+
+    def close(self):
+        pass
+
+
+LATENCY = 0.2
+MESSAGES = [{'role': 'user', 'content': "Hola"}]
+
+
+class MockLLM:
+    """LaIA_mock_llm.py served on a local port, counting the requests in flight and failing the first ones on demand"""
+
+    def __init__(self):
+        from LaIA_mock_llm import LatencyModel, ScriptedResponder, create_app
+        self.app = create_app(LatencyModel('fixed', mean=LATENCY, tokens_per_second=0), ScriptedResponder())
+        # (status, Retry-After) answered to the next requests instead of the completion
+        self.failures = []
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        self.server = make_server('127.0.0.1', 0, self._wsgi, threaded=True)
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.01,), daemon=True)
+        self.thread.start()
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}/v1"
+
+    def _wsgi(self, environ, start_response):
+        with self._lock:
+            self.requests += 1
+            failure = self.failures.pop(0) if self.failures else None
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if failure is not None:
+                status, retry_after = failure
+                headers = [('Content-Type', 'application/json')] + ([('Retry-After', retry_after)] if retry_after else [])
+                start_response(status, headers)
+                return [b'{"error": {"message": "mock failure"}}']
+            # Read whole, so the request counts as in flight until the answer is ready
+            return list(self.app(environ, start_response))
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def llm():
+    llm = MockLLM()
+    yield llm
+    llm.close()
@@ -0,0 +1,159 @@
+from conftest import FakeEmbeddings, ParagraphSplitter, StubLLM, fake_vector
+from LaIA_answer_cache import SemanticAnswerCache
+from LaIA_document_manager import DocumentManager
+from LaIA_document_store import DocumentStore
+
+QUERY = "What does the document say?"
+RESULT = {'response': "It says hello", 'citations': []}
+
+
+def manager(answer_cache, store=None, shared=None) -> DocumentManager:
+    return DocumentManager(FakeEmbeddings(), ParagraphSplitter(), store=store, shared=shared, answer_cache=answer_cache)
+
+
+def answer(cache: SemanticAnswerCache, document_manager: DocumentManager, doc_id: str) -> None:
+    """Cache an answer generated from the session's search results, as generate_response does"""
+    chunks = document_manager.search(QUERY)
+    assert doc_id in {chunk['doc_id'] for chunk in chunks}
+    cache.store(QUERY, fake_vector(QUERY), RESULT, chunks)
+
+
+def lookup(cache: SemanticAnswerCache, document_manager: DocumentManager, query: str = QUERY):
+    return cache.lookup(fake_vector(query), document_manager.search(query))
+
+
+def test_similar_query_hits_and_other_query_misses():
+    cache = SemanticAnswerCache()
+    documents = manager(cache)
+    doc_id = documents.add_document("Doc", "hello\n\nworld", 'pdf')[0].id
+    answer(cache, documents, doc_id)
+
+    assert lookup(cache, documents) == RESULT
+    assert lookup(cache, documents, "Something else entirely") is None
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 1
+
+
+def test_invalidate_document_drops_the_answers_citing_it():
+    cache = SemanticAnswerCache()
+    chunks = [{'chunk_id': "cited_0", 'doc_id': "cited", 'content': "hello"}]
+    cache.store(QUERY, fake_vector(QUERY), RESULT, chunks)
+
+    cache.invalidate_document("other")
+    assert cache.stats()['entries'] == 1
+    cache.invalidate_document("cited")
+    assert cache.stats()['entries'] == 0
+    assert cache.stats()['invalidated'] == 1
+    assert cache.lookup(fake_vector(QUERY), chunks) is None
+
+
+def test_removing_a_document_invalidates_its_answers():
+    cache = SemanticAnswerCache()
+    documents = manager(cache)
+    doc_id = documents.add_document("Doc", "hello\n\nworld", 'pdf')[0].id
+    answer(cache, documents, doc_id)
+
+    assert documents.remove_document(doc_id)
+    assert cache.stats()['invalidated'] == 1
+    assert lookup(cache, documents) is None
+
+
+def test_unlinking_a_shared_document_keeps_its_answers_for_other_sessions():
+    cache = SemanticAnswerCache()
+    shared = manager(cache)
+    first, second = manager(cache, shared=shared), manager(cache, shared=shared)
+    document, _ = first.add_shared_document("Page", "hello\n\nworld", 'web', source_url="https://example.org/")
+    second.link_shared_document(document.id)
+    answer(cache, first, document.id)
+
+    assert first.remove_document(document.id)
+    assert cache.stats()['invalidated'] == 0
+    # The session that unlinked it no longer sees the cited chunks, the other one still does
+    assert lookup(cache, first) is None
+    assert cache.stats()['stale'] == 1
+    assert lookup(cache, second) == RESULT
+
+
+def test_changed_chunks_are_not_reused():
+    cache = SemanticAnswerCache()
+    chunks = [{'chunk_id': "doc_0", 'doc_id': "doc", 'content': "hello"}]
+    cache.store(QUERY, fake_vector(QUERY), RESULT, chunks)
+
+    assert cache.lookup(fake_vector(QUERY), [{**chunks[0], 'content': "edited"}]) is None
+    assert cache.stats()['stale'] == 1
+    assert cache.lookup(fake_vector(QUERY), chunks) == RESULT
+
+
+def test_session_whose_uploads_rank_higher_gets_its_own_answer():
+    cache = SemanticAnswerCache()
+    shared = manager(cache)
+    first, second = manager(cache, shared=shared), manager(cache, shared=shared)
+    document, _ = first.add_shared_document("Page", "hello\n\nworld\n\nagain", 'web', source_url="https://example.org/")
+    answer(cache, first, document.id)
+
+    # Another session without uploads reuses the shared-web answer
+    assert lookup(cache, second) == RESULT
+    # Its upload matches the query best, so its context (and answer) would differ
+    second.add_document("Upload", QUERY, 'pdf')
+    assert lookup(cache, second) is None
+    assert cache.stats()['stale'] == 1
+
+
+def test_expired_answers_are_dropped():
+    cache = SemanticAnswerCache(ttl=0)
+    documents = manager(cache)
+    doc_id = documents.add_document("Doc", "hello\n\nworld", 'pdf')[0].id
+    answer(cache, documents, doc_id)
+
+    assert lookup(cache, documents) is None
+    assert cache.stats()['expired'] == 1
+    assert cache.stats()['entries'] == 0
+
+
+def test_refresh_invalidates_documents_removed_by_another_process(tmp_path):
+    cache = SemanticAnswerCache()
+    writer = manager(None, store=DocumentStore(str(tmp_path)))
+    doc_id = writer.add_document("Doc", "hello\n\nworld", 'pdf')[0].id
+    kept = writer.add_document("Kept", "something\n\nunrelated", 'pdf')[0].id
+    reader = manager(cache, store=DocumentStore(str(tmp_path)))
+    answer(cache, reader, doc_id)
+
+    writer.remove_document(doc_id)
+    reader.refresh()
+    assert set(reader.documents) == {kept}
+    assert cache.stats()['invalidated'] == 1
+
+
+def test_refresh_after_a_compaction_invalidates_documents_removed_before_it(tmp_path):
+    cache = SemanticAnswerCache()
+    writer = manager(None, store=DocumentStore(str(tmp_path)))
+    doc_id = writer.add_document("Doc", "hello\n\nworld", 'pdf')[0].id
+    kept = writer.add_document("Kept", "something\n\nunrelated", 'pdf')[0].id
+    reader = manager(cache, store=DocumentStore(str(tmp_path)))
+    answer(cache, reader, doc_id)
+
+    writer.remove_document(doc_id)
+    writer.compact()
+    reader.refresh()
+    assert set(reader.documents) == {kept}
+    assert cache.stats()['invalidated'] == 1
+    assert lookup(cache, reader) is None
+
+
+def test_generate_response_reuses_the_answer_without_calling_the_llm():
+    cache = SemanticAnswerCache()
+    shared = manager(cache)
+    first, second = manager(cache, shared=shared), manager(cache, shared=shared)
+    first.add_shared_document("Page", "hello\n\nworld", 'web', source_url="https://example.org/")
+    llm = StubLLM()
+
+    generated = first.generate_response(QUERY, llm)
+    streamed = []
+    reused = second.generate_response(QUERY, llm, on_token=streamed.append)
+    assert llm.calls == 1
+    assert reused == generated and streamed == [generated['response']]
+
+    # Own upload outranking the shared page: generated again
+    second.add_document("Upload", QUERY, 'pdf')
+    second.generate_response(QUERY, llm)
+    assert llm.calls == 2
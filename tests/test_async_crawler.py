@@ -0,0 +1,158 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urljoin
+import pytest
+from LaIA_async_crawler import AsyncCrawler
+from LaIA_crawl_state import CrawlState
+from LaIA_fetcher import Fetcher
+
+
+class Site:
+    """Local website whose pages are '<title>|<links>', with slow pages and pages failing a few times first"""
+
+    def __init__(self):
+        # path -> (body, seconds before answering)
+        self.pages = {}
+        # path -> number of 503 answers left before the page is served
+        self.failures = {}
+        # (path, time) of every request received
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with site._lock:
+                    site.requests.append((self.path, time.monotonic()))
+                    site.in_flight += 1
+                    site.max_in_flight = max(site.max_in_flight, site.in_flight)
+                    failing = site.failures.get(self.path, 0) > 0
+                    if failing:
+                        site.failures[self.path] -= 1
+                try:
+                    body, delay = site.pages.get(self.path, ("Not found|", 0))
+                    time.sleep(delay)
+                    body = body.encode('utf-8')
+                    self.send_response(503 if failing else 200 if self.path in site.pages else 404)
+                    self.send_header('Content-Type', 'text/html; charset=utf-8')
+                    self.send_header('Content-Length', str(len(body)))
+                    if failing:
+                        self.send_header('Retry-After', '0')
+                    self.end_headers()
+                    self.wfile.write(body)
+                finally:
+                    with site._lock:
+                        site.in_flight -= 1
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.01,), daemon=True)
+        self.thread.start()
+
+    def add(self, path: str, title: str, links=(), delay: float = 0.0) -> None:
+        self.pages[path] = (f"{title}|{' '.join(links)}", delay)
+
+    def url(self, path: str) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}{path}"
+
+    def requested(self, path: str) -> int:
+        return sum(1 for requested, _ in self.requests if requested == path)
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def site():
+    site = Site()
+    yield site
+    site.close()
+
+
+def parse_page(html: str, url: str):
+    title, links = html.split('|', 1)
+    return title, [urljoin(url, link) for link in links.split()]
+
+
+def crawler(**kwargs) -> AsyncCrawler:
+    options = dict(parse_page=parse_page, claim_url=CrawlState().claim, max_depth=3, max_links_per_page=5,
+                   allowed_content_types=None, backoff_factor=0.01)
+    options.update(kwargs)
+    return AsyncCrawler(**options)
+
+
+def titles(node):
+    return [node['main_content']] + [title for child in node['sub_content'] for title in titles(child)]
+
+
+def test_depth_and_links_per_page_limits(site):
+    site.add('/0', "zero", ['/1', '/a', '/b', '/c'])
+    site.add('/1', "one", ['/2'])
+    site.add('/2', "two", ['/3'])
+    site.add('/3', "three")
+    for path in '/a', '/b', '/c':
+        site.add(path, path)
+
+    [root] = crawler(max_depth=3, max_links_per_page=2).crawl([site.url('/0')])
+    assert sorted(titles(root)) == ["/a", "one", "two", "zero"]
+    assert root['sub_content'][0]['sub_content'][0]['depth'] == 2
+    # Past the depth limit and the links per page, pages are not even requested
+    assert site.requested('/3') == 0 and site.requested('/b') == 0
+
+
+def test_requests_to_one_host_are_limited(site):
+    pages = [f'/slow{i}' for i in range(8)]
+    site.add('/fan', "fan", pages)
+    for path in pages:
+        site.add(path, path, delay=0.1)
+
+    [root] = crawler(concurrency=8, max_per_host=2, max_links_per_page=8).crawl([site.url('/fan')])
+    assert len(root['sub_content']) == 8
+    assert site.max_in_flight == 2
+
+
+def test_host_delay_spaces_the_requests(site):
+    pages = [f'/page{i}' for i in range(5)]
+    site.add('/start', "start", pages)
+    for path in pages:
+        site.add(path, path)
+    # Same pacing as the threaded crawler's Fetcher
+    fetcher = Fetcher(min_interval=0.05)
+
+    crawler(concurrency=8, host_delay=fetcher.reserve_turn).crawl([site.url('/start')])
+    starts = sorted(started for _, started in site.requests)
+    assert len(starts) == 6
+    assert min(later - earlier for earlier, later in zip(starts, starts[1:])) > 0.03
+
+
+def test_deadline_returns_the_pages_fetched_so_far(site):
+    site.add('/root', "root", ['/fast', '/slow'])
+    site.add('/fast', "fast")
+    site.add('/slow', "slow", delay=3)
+
+    started = time.monotonic()
+    [root] = crawler(deadline=0.5).crawl([site.url('/root')])
+    assert time.monotonic() - started < 2
+    assert titles(root) == ["root", "fast"]
+
+
+def test_failed_requests_are_retried(site):
+    site.add('/flaky', "flaky")
+    site.failures['/flaky'] = 2
+
+    [page] = crawler(retries=2).crawl([site.url('/flaky')])
+    assert page['main_content'] == "flaky"
+    assert site.requested('/flaky') == 3
+
+
+def test_unreachable_pages_are_skipped_after_the_retries(site):
+    site.add('/up', "up")
+    pages = crawler(retries=1, timeout=1).crawl(["http://127.0.0.1:1/down", site.url('/up')])
+    assert [page['main_content'] for page in pages] == ["up"]
@@ -0,0 +1,153 @@
+import faiss
+import pytest
+from conftest import FakeEmbeddings, ParagraphSplitter, StubLLM
+from LaIA_document_manager import DocumentManager, NO_CONTEXT_RESPONSE
+from LaIA_document_store import DocumentStore
+from LaIA_vector_index import IndexConfig
+
+DOCUMENTS = 12
+CHUNKS = 5
+
+INDEX_CONFIGS = {
+    'ivf': IndexConfig('ivf', nlist=4, nprobe=4, migrate_threshold=40),
+    'hnsw': IndexConfig('hnsw', migrate_threshold=40),
+    'pq': IndexConfig('flat', 'pq', pq_m=8, migrate_threshold=40),
+    'ivf_pq': IndexConfig('ivf', 'pq', nlist=4, nprobe=4, pq_m=8, migrate_threshold=40),
+}
+
+
+def content(document: int) -> str:
+    return "\n\n".join(f"document {document} paragraph {chunk}" for chunk in range(CHUNKS))
+
+
+def fill(manager: DocumentManager, documents: int = DOCUMENTS):
+    return [manager.add_document(f"Document {i}", content(i), 'pdf')[0].id for i in range(documents)]
+
+
+def found_doc_ids(manager: DocumentManager, query: str, k: int = 3):
+    return [result['doc_id'] for result in manager.search(query, k=k)]
+
+
+def assert_index_consistent(manager: DocumentManager) -> None:
+    """Every index position maps to a live chunk, and every live chunk has a position"""
+    vector_store = manager.vector_store
+    live = {chunk_id for chunk_ids in manager.chunk_ids.values() for chunk_id in chunk_ids}
+    hidden = {chunk_id for chunk_ids in manager.removed_chunk_ids.values() for chunk_id in chunk_ids}
+    assert vector_store.index.ntotal == len(vector_store.index_to_docstore_id)
+    assert set(vector_store.index_to_docstore_id.values()) == live | hidden
+    for chunk_id in live:
+        assert vector_store.docstore.search(chunk_id).page_content
+
+
+@pytest.mark.parametrize('name', INDEX_CONFIGS)
+def test_removal_and_rebuild(name):
+    config = INDEX_CONFIGS[name]
+    manager = DocumentManager(FakeEmbeddings(), ParagraphSplitter(), index_config=config)
+    doc_ids = fill(manager)
+    assert not isinstance(manager.vector_store.index, faiss.IndexFlat)
+    assert manager.vector_store.index.ntotal == DOCUMENTS * CHUNKS
+
+    # 5 of 60 chunks: IVF / HNSW only hide them, PQ deletes them
+    assert manager.remove_document(doc_ids[0])
+    for chunk in range(CHUNKS):
+        assert doc_ids[0] not in found_doc_ids(manager, f"document 0 paragraph {chunk}")
+    assert_index_consistent(manager)
+
+    # Past 20% of the index removed, IVF / HNSW are rebuilt without them
+    assert manager.remove_document(doc_ids[1])
+    assert manager.remove_document(doc_ids[2])
+    assert manager.removed_chunk_ids == {}
+    assert manager.vector_store.index.ntotal == (DOCUMENTS - 3) * CHUNKS
+    assert_index_consistent(manager)
+
+    # Positions still match the docstore: every remaining chunk finds itself
+    for document in range(3, DOCUMENTS):
+        for chunk in range(CHUNKS):
+            assert doc_ids[document] in found_doc_ids(manager, f"document {document} paragraph {chunk}")
+
+    added = manager.add_document("Document new", content(99), 'pdf')[0].id
+    assert added in found_doc_ids(manager, "document 99 paragraph 2")
+    assert_index_consistent(manager)
+
+
+@pytest.mark.parametrize('name', INDEX_CONFIGS)
+def test_reopen_after_removal_rebuilds_from_stored_vectors(tmp_path, name):
+    config = INDEX_CONFIGS[name]
+    manager = DocumentManager(FakeEmbeddings(), ParagraphSplitter(), store=DocumentStore(str(tmp_path)), index_config=config)
+    doc_ids = fill(manager)
+    manager.remove_document(doc_ids[0])
+
+    embeddings = FakeEmbeddings()
+    reopened = DocumentManager(embeddings, ParagraphSplitter(), store=DocumentStore(str(tmp_path)), index_config=config)
+    assert embeddings.embedded == 0
+    assert set(reopened.documents) == set(doc_ids[1:])
+    assert not isinstance(reopened.vector_store.index, faiss.IndexFlat)
+    assert reopened.vector_store.index.ntotal == (DOCUMENTS - 1) * CHUNKS
+    assert doc_ids[0] not in found_doc_ids(reopened, "document 0 paragraph 1")
+    assert doc_ids[5] in found_doc_ids(reopened, "document 5 paragraph 1")
+
+
+def test_empty_document_is_added_persisted_and_removed(tmp_path):
+    # A scanned PDF without text, or a page whose main content is empty
+    manager = DocumentManager(FakeEmbeddings(), ParagraphSplitter(), store=DocumentStore(str(tmp_path)))
+    empty, chunk_count = manager.add_document("Scan", "", 'pdf')
+    assert chunk_count == 0
+    assert manager.search("anything") == []
+    other = manager.add_document("Document", content(1), 'pdf')[0]
+
+    reopened = DocumentManager(FakeEmbeddings(), ParagraphSplitter(), store=DocumentStore(str(tmp_path)))
+    assert set(reopened.documents) == {empty.id, other.id}
+    assert reopened.remove_document(empty.id)
+    assert reopened.vector_store.index.ntotal == CHUNKS
+
+
+def test_document_is_not_registered_when_persisting_fails(tmp_path):
+    store = DocumentStore(str(tmp_path))
+    manager = DocumentManager(FakeEmbeddings(), ParagraphSplitter(), store=store)
+
+    def fail(*args):
+        raise OSError("disk full")
+
+    store.append_document = fail
+    with pytest.raises(OSError):
+        manager.add_document("Document", content(1), 'pdf')
+    assert manager.documents == {} and manager.vector_store is None
+
+
+def test_session_without_uploads_answers_from_the_shared_knowledge_base():
+    shared = DocumentManager(FakeEmbeddings(), ParagraphSplitter())
+    first = DocumentManager(FakeEmbeddings(), ParagraphSplitter(), shared=shared)
+    first.add_shared_document("Page", content(1), 'web', source_url="https://example.org/page")
+
+    # A new session has no documents of its own, the page another session found is searched anyway
+    second = DocumentManager(FakeEmbeddings(), ParagraphSplitter(), shared=shared)
+    llm = StubLLM()
+    output = second.generate_response("document 1 paragraph 2", llm)
+    assert output['response'] == llm.answer
+    assert output['citations'][0]['source_url'] == "https://example.org/page"
+
+    # NOT_FOUND answers fall back to the web search
+    assert second.generate_response("document 1 paragraph 2", StubLLM("NOT_FOUND"))['response'] == NO_CONTEXT_RESPONSE
+    assert DocumentManager(FakeEmbeddings(), ParagraphSplitter()).generate_response("anything", llm)['response'] == NO_CONTEXT_RESPONSE
+
+
+def test_store_is_created_on_the_first_document(tmp_path):
+    opened = []
+
+    def store_factory():
+        opened.append(DocumentStore(str(tmp_path / "session")))
+        return opened[-1]
+
+    shared = DocumentManager(FakeEmbeddings(), ParagraphSplitter())
+    shared.add_document("Shared", content(1), 'web')
+    manager = DocumentManager(FakeEmbeddings(), ParagraphSplitter(), shared=shared, store_factory=store_factory)
+    # Searching and answering a session without uploads leaves nothing on disk
+    assert manager.search("document 1 paragraph 1")
+    manager.refresh()
+    assert opened == [] and not (tmp_path / "session").exists()
+
+    doc_id = manager.add_document("Document", content(2), 'pdf')[0].id
+    manager.add_document("Other", content(3), 'pdf')
+    assert len(opened) == 1 and manager.store is opened[0]
+    reopened = DocumentManager(FakeEmbeddings(), ParagraphSplitter(), store=DocumentStore(str(tmp_path / "session")))
+    assert doc_id in reopened.documents
@@ -0,0 +1,137 @@
+import os
+import numpy as np
+from LaIA_document_store import DocumentStore, LOG_FILE
+
+
+def add(store: DocumentStore, doc_id: str, rows: int, dim: int = 4) -> np.ndarray:
+    vectors = np.arange(rows * dim, dtype=np.float32).reshape(rows, dim) + hash(doc_id) % 1000
+    ids = [f"{doc_id}_{i}" for i in range(rows)]
+    store.append_document({"id": doc_id, "chunks": ids}, ids, [{"doc_id": doc_id} for _ in ids], vectors)
+    return vectors
+
+
+def loaded(store: DocumentStore):
+    return {document["id"]: (ids, np.array(vectors)) for document, ids, _, vectors in store.load()}
+
+
+def test_reopen_reads_back_documents_and_vectors(tmp_path):
+    store = DocumentStore(str(tmp_path))
+    first = add(store, "a", 3)
+    second = add(store, "b", 2)
+    store.append_link("shared-doc", True)
+
+    reopened = DocumentStore(str(tmp_path))
+    documents = loaded(reopened)
+    assert list(documents) == ["a", "b"]
+    assert documents["a"][0] == ["a_0", "a_1", "a_2"]
+    np.testing.assert_array_equal(documents["a"][1], first)
+    np.testing.assert_array_equal(documents["b"][1], second)
+    assert reopened.load_links() == {"shared-doc": True}
+
+
+def test_reopen_skips_removed_documents(tmp_path):
+    store = DocumentStore(str(tmp_path), min_compact_rows=1000)
+    add(store, "a", 3)
+    kept = add(store, "b", 2)
+    store.append_removal("a")
+
+    documents = loaded(DocumentStore(str(tmp_path)))
+    assert list(documents) == ["b"]
+    np.testing.assert_array_equal(documents["b"][1], kept)
+
+
+def test_reopen_ignores_a_torn_log_line(tmp_path):
+    store = DocumentStore(str(tmp_path))
+    add(store, "a", 2)
+    with open(os.path.join(str(tmp_path), LOG_FILE), "a", encoding="utf-8") as log:
+        log.write('{"op": "add", "document": {"id": "torn"')
+
+    reopened = DocumentStore(str(tmp_path))
+    assert list(loaded(reopened)) == ["a"]
+    # Appends go after the last complete line
+    add(reopened, "b", 1)
+    assert list(loaded(DocumentStore(str(tmp_path)))) == ["a", "b"]
+
+
+def test_compaction_keeps_live_documents_and_drops_dead_rows(tmp_path):
+    store = DocumentStore(str(tmp_path), min_compact_rows=1000)
+    add(store, "a", 4)
+    kept = add(store, "b", 2)
+    store.append_link("shared-doc", False)
+    store.append_removal("a")
+    assert os.path.getsize(tmp_path / "vectors-0.f32") == 6 * 4 * 4
+
+    store.compact()
+    assert not os.path.exists(tmp_path / "vectors-0.f32")
+    assert os.path.getsize(tmp_path / "vectors-1.f32") == 2 * 4 * 4
+
+    reopened = DocumentStore(str(tmp_path))
+    documents = loaded(reopened)
+    assert list(documents) == ["b"]
+    np.testing.assert_array_equal(documents["b"][1], kept)
+    assert reopened.load_links() == {"shared-doc": False}
+
+
+def test_removal_compacts_automatically_past_the_dead_ratio(tmp_path):
+    store = DocumentStore(str(tmp_path), compact_ratio=0.5, min_compact_rows=2)
+    add(store, "a", 1)
+    add(store, "b", 3)
+    store.append_removal("a")
+    assert os.path.exists(tmp_path / "vectors-0.f32")
+
+    store.append_removal("b")
+    assert os.path.exists(tmp_path / "vectors-1.f32")
+    assert loaded(DocumentStore(str(tmp_path))) == {}
+
+
+def test_other_instances_pick_up_appends_and_compactions(tmp_path):
+    writer = DocumentStore(str(tmp_path), min_compact_rows=1000)
+    reader = DocumentStore(str(tmp_path))
+    assert reader.load() == []
+
+    vectors = add(writer, "a", 2)
+    entries = reader.read_new_entries()
+    assert [entry["op"] for entry in entries] == ["add"]
+    np.testing.assert_array_equal(entries[0]["vectors"], vectors)
+    # The writer's own entries are not handed back to it
+    writer.load()
+    add(writer, "b", 1)
+    assert [entry["document"]["id"] for entry in writer.read_new_entries() if entry["op"] == "add"] == []
+
+    writer.append_removal("a")
+    writer.compact()
+    # Compacted by the other instance: the reader has to load the store again
+    assert reader.read_new_entries() is None
+    assert list(loaded(reader)) == ["b"]
+    assert reader.read_new_entries() == []
+
+
+def test_documents_without_chunks_are_persisted(tmp_path):
+    store = DocumentStore(str(tmp_path))
+    store.append_document({"id": "empty", "chunks": []}, [], [], np.array([], dtype=np.float32))
+    kept = add(store, "a", 2)
+    store.append_document({"id": "empty-after", "chunks": []}, [], [], np.array([], dtype=np.float32))
+
+    documents = loaded(DocumentStore(str(tmp_path)))
+    assert list(documents) == ["empty", "a", "empty-after"]
+    assert documents["empty"][0] == [] and len(documents["empty"][1]) == 0
+    np.testing.assert_array_equal(documents["a"][1], kept)
+
+
+def test_read_new_entries_skips_the_lock_when_nothing_changed(tmp_path, monkeypatch):
+    writer, reader = DocumentStore(str(tmp_path)), DocumentStore(str(tmp_path))
+    add(writer, "a", 1)
+    reader.load()
+    assert reader.read_new_entries() == []
+
+    def locked():
+        raise AssertionError("took the lock")
+
+    monkeypatch.setattr(reader, "_locked", locked)
+    assert reader.read_new_entries() == []
+    monkeypatch.undo()
+
+    add(writer, "b", 1)
+    assert [entry["document"]["id"] for entry in reader.read_new_entries()] == ["b"]
+    writer.compact()
+    assert reader.read_new_entries() is None
@@ -0,0 +1,60 @@
+import logging
+import numpy as np
+from LaIA_embedding_cache import EmbeddingCache
+
+DIM = 8
+
+
+def vectors(texts):
+    return np.array([[len(text) + i for i in range(DIM)] for text in texts], dtype=np.float32)
+
+
+def test_disk_tier_survives_a_reopen(tmp_path):
+    texts = ["a", "bb", "ccc"]
+    EmbeddingCache("model", str(tmp_path)).put_many(texts, vectors(texts))
+
+    reopened = EmbeddingCache("model", str(tmp_path))
+    found = reopened.get_many(texts + ["missing"])
+    np.testing.assert_array_equal(np.stack(found[:3]), vectors(texts))
+    assert found[3] is None
+    assert reopened.stats()['hits'] == 3
+
+
+def test_instances_sharing_a_directory_see_each_others_rows(tmp_path):
+    first, second = EmbeddingCache("model", str(tmp_path)), EmbeddingCache("model", str(tmp_path))
+    first.put_many(["a"], vectors(["a"]))
+    second.put_many(["bb"], vectors(["bb"]))
+    first.put_many(["ccc"], vectors(["ccc"]))
+
+    # Each one appended after the other's rows instead of overwriting them
+    for cache in (first, EmbeddingCache("model", str(tmp_path))):
+        assert cache.stats()['disk_entries'] == 3
+        np.testing.assert_array_equal(cache.get_many(["bb"])[0], vectors(["bb"])[0])
+
+
+def test_disk_tier_is_compacted_past_max_disk_bytes(tmp_path):
+    texts = [f"text {i}" for i in range(20)]
+    row_bytes = 4 * DIM
+    cache = EmbeddingCache("model", str(tmp_path), max_memory_entries=1, max_disk_bytes=10 * row_bytes)
+    for text in texts:
+        cache.put_many([text], vectors([text]))
+
+    stats = cache.stats()
+    assert stats['compactions'] >= 1
+    assert stats['disk_bytes'] <= 10 * row_bytes
+    assert len(list(tmp_path.glob("vectors-*.f32"))) == 1
+    # The newest rows are kept
+    reopened = EmbeddingCache("model", str(tmp_path))
+    np.testing.assert_array_equal(reopened.get_many([texts[-1]])[0], vectors([texts[-1]])[0])
+    assert reopened.get_many([texts[0]])[0] is None
+
+
+def test_another_models_directory_is_left_alone(tmp_path, caplog):
+    EmbeddingCache("model", str(tmp_path)).put_many(["a"], vectors(["a"]))
+
+    with caplog.at_level(logging.WARNING):
+        other = EmbeddingCache("other-model", str(tmp_path))
+    assert "disk tier is disabled" in caplog.text
+    other.put_many(["bb"], vectors(["bb"]))
+    assert other.get_many(["bb"])[0] is not None
+    assert EmbeddingCache("model", str(tmp_path)).stats()['disk_entries'] == 1
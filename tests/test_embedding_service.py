@@ -0,0 +1,103 @@
+import threading
+import time
+import pytest
+from conftest import FakeEmbeddings, fake_vector
+from LaIA_embedding_service import EmbeddingService
+
+TIMEOUT = 5
+
+
+class RecordingEmbeddings(FakeEmbeddings):
+    """Records every batch, optionally slow, and fails the batches containing a text starting with 'boom'"""
+
+    def __init__(self, delay: float = 0.0):
+        super().__init__()
+        self.delay = delay
+        self.batches = []
+
+    def embed_documents(self, texts):
+        self.batches.append(list(texts))
+        time.sleep(self.delay)
+        if any(text.startswith("boom") for text in texts):
+            raise ValueError("model crashed")
+        return super().embed_documents(texts)
+
+
+@pytest.fixture
+def services():
+    created = []
+
+    def create(embeddings, **kwargs):
+        service = EmbeddingService(embeddings, **kwargs)
+        created.append(service)
+        return service
+    yield create
+    for service in created:
+        service.close()
+
+
+def test_concurrent_callers_get_their_own_vectors_in_order(services):
+    embeddings = RecordingEmbeddings()
+    service = services(embeddings, max_batch_size=8, max_wait=0.05, num_workers=2)
+    requests = {caller: [f"caller {caller} chunk {i}" for i in range(1 + 5 * caller)] for caller in range(8)}
+    results = {}
+    start = threading.Barrier(len(requests))
+
+    def call(caller):
+        start.wait()
+        results[caller] = service.embed_documents(requests[caller])
+
+    threads = [threading.Thread(target=call, args=(caller,)) for caller in requests]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(TIMEOUT)
+
+    for caller, texts in requests.items():
+        assert results[caller] == [fake_vector(text) for text in texts]
+    # Coalesced into full batches rather than one call per caller and chunk
+    texts = sum(len(texts) for texts in requests.values())
+    assert max(len(batch) for batch in embeddings.batches) <= 8
+    assert len(embeddings.batches) <= texts // 8 + len(requests)
+    assert embeddings.embedded == texts
+    assert service.submit([]).result(TIMEOUT) == []
+
+
+def test_a_failing_batch_reports_the_error_to_every_waiter(services):
+    embeddings = RecordingEmbeddings()
+    # Large enough for both requests, and a wait long enough for them to share the batch
+    service = services(embeddings, max_batch_size=6, max_wait=1.0, num_workers=1)
+    failing = service.submit(["boom", "a"])
+    other = service.submit(["b", "c", "d", "e"])
+
+    for future in (failing, other):
+        with pytest.raises(ValueError, match="model crashed"):
+            future.result(TIMEOUT)
+    assert embeddings.batches == [["boom", "a", "b", "c", "d", "e"]]
+
+    # The service keeps serving later requests
+    assert service.submit(["f"]).result(TIMEOUT) == [fake_vector("f")]
+
+
+def test_the_rest_of_a_failed_request_is_not_embedded(services):
+    embeddings = RecordingEmbeddings()
+    service = services(embeddings, max_batch_size=2, max_wait=0.0, num_workers=1)
+    future = service.submit(["boom"] + [f"chunk {i}" for i in range(9)])
+    with pytest.raises(ValueError):
+        future.result(TIMEOUT)
+    service.close()
+    # Batches are only formed once the worker is free, after the first one failed
+    assert embeddings.batches == [["boom", "chunk 0"]]
+
+
+def test_close_drains_pending_work():
+    embeddings = RecordingEmbeddings(delay=0.02)
+    service = EmbeddingService(embeddings, max_batch_size=4, max_wait=0.5, num_workers=1)
+    futures = [service.submit([f"request {i} chunk {j}" for j in range(3)]) for i in range(10)]
+
+    service.close()
+    for i, future in enumerate(futures):
+        assert future.done()
+        assert future.result() == [fake_vector(f"request {i} chunk {j}") for j in range(3)]
+    with pytest.raises(RuntimeError):
+        service.submit(["late"])
@@ -0,0 +1,155 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from LaIA_fetcher import Fetcher, normalize_url
+from LaIA_page_cache import PageCache
+
+
+@pytest.mark.parametrize('url, normalized', [
+    ("HTTPS://Example.ORG/Path", "https://example.org/Path"),
+    ("https://example.org", "https://example.org/"),
+    ("https://example.org:443/a", "https://example.org/a"),
+    ("http://example.org:80/a", "http://example.org/a"),
+    ("http://example.org:8080/a", "http://example.org:8080/a"),
+    ("https://example.org/a#section", "https://example.org/a"),
+    ("  https://example.org/a  ", "https://example.org/a"),
+    ("https://example.org/a?utm_source=x&id=3&gclid=y&UTM_Medium=z", "https://example.org/a?id=3"),
+    ("https://example.org/a?b=2&a=1", "https://example.org/a?b=2&a=1"),
+    ("https://example.org/a?flag=&b=2", "https://example.org/a?flag=&b=2"),
+])
+def test_normalize_url(url, normalized):
+    assert normalize_url(url) == normalized
+
+
+def test_normalize_url_keeps_trailing_slashes():
+    # /a/ and /a can be different pages (relative links resolve differently)
+    assert normalize_url("https://example.org/a/") == "https://example.org/a/"
+    assert normalize_url("https://example.org/a/") != normalize_url("https://example.org/a")
+
+
+class Site:
+    """Local HTTP server answering conditional GETs with 304 while a page keeps its validators"""
+
+    def __init__(self):
+        # path -> (ETag, Last-Modified, body)
+        self.pages = {}
+        # (path, If-None-Match, If-Modified-Since) of every request received
+        self.requests = []
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                etag, last_modified, body = site.pages[self.path]
+                if_none_match, if_modified_since = self.headers.get('If-None-Match'), self.headers.get('If-Modified-Since')
+                site.requests.append((self.path, if_none_match, if_modified_since))
+                not_modified = if_none_match == etag if etag else (last_modified is not None and if_modified_since == last_modified)
+                self.send_response(304 if not_modified else 200)
+                if etag:
+                    self.send_header('ETag', etag)
+                if last_modified:
+                    self.send_header('Last-Modified', last_modified)
+                if not not_modified:
+                    self.send_header('Content-Type', 'text/html; charset=utf-8')
+                    self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if not not_modified:
+                    self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.01,), daemon=True)
+        self.thread.start()
+
+    def url(self, path: str) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}{path}"
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def site():
+    site = Site()
+    yield site
+    site.close()
+
+
+def fetcher(directory, ttl: float = 0, **kwargs) -> Fetcher:
+    return Fetcher(min_interval=0, retries=0, cache=PageCache(str(directory), ttl=ttl), **kwargs)
+
+
+def test_stale_page_is_revalidated_with_its_etag(site, tmp_path):
+    site.pages['/page'] = ('"v1"', None, b"<html>first</html>")
+    client = fetcher(tmp_path)
+
+    first = client.get(site.url('/page'))
+    assert (first.status_code, first.from_cache, first.text) == (200, False, "<html>first</html>")
+
+    second = client.get(site.url('/page'))
+    assert site.requests[-1] == ('/page', '"v1"', None)
+    # The 304 is answered with the cached page
+    assert (second.status_code, second.from_cache, second.text) == (200, True, "<html>first</html>")
+    assert client.cache.stats()['revalidated'] == 1
+    assert client.cache.stats()['misses'] == 1
+
+
+def test_changed_page_replaces_the_cached_one(site, tmp_path):
+    site.pages['/page'] = ('"v1"', None, b"first")
+    client = fetcher(tmp_path)
+    client.get(site.url('/page'))
+
+    site.pages['/page'] = ('"v2"', None, b"second")
+    changed = client.get(site.url('/page'))
+    assert (changed.status_code, changed.from_cache, changed.text) == (200, False, "second")
+    assert site.requests[-1] == ('/page', '"v1"', None)
+
+    client.get(site.url('/page'))
+    assert site.requests[-1] == ('/page', '"v2"', None)
+    assert client.cache.stats()['revalidated'] == 1
+
+
+def test_last_modified_is_sent_as_if_modified_since(site, tmp_path):
+    last_modified = 'Wed, 01 Jan 2025 00:00:00 GMT'
+    site.pages['/page'] = (None, last_modified, b"dated")
+    client = fetcher(tmp_path)
+    client.get(site.url('/page'))
+
+    revalidated = client.get(site.url('/page'))
+    assert site.requests[-1] == ('/page', None, last_modified)
+    assert (revalidated.from_cache, revalidated.text) == (True, "dated")
+
+
+def test_fresh_page_is_served_without_a_request(site, tmp_path):
+    site.pages['/page'] = ('"v1"', None, b"first")
+    client = fetcher(tmp_path, ttl=3600)
+    client.get(site.url('/page'))
+    cached = client.get(site.url('/page#anchor'))
+    assert len(site.requests) == 1
+    assert (cached.from_cache, cached.text) == (True, "first")
+    assert client.cache.stats()['hits'] == 1
+
+
+def test_revalidation_keeps_the_extracted_content(site, tmp_path):
+    site.pages['/page'] = ('"v1"', None, b"<html>first</html>")
+    client = fetcher(tmp_path)
+    client.get(site.url('/page'))
+    client.store_extracted(site.url('/page'), "first", ["https://example.org/"], 'bs4')
+
+    revalidated = client.get(site.url('/page'))
+    assert revalidated.extracted == {'main_content': "first", 'links': ["https://example.org/"], 'extractor': 'bs4'}
+
+
+def test_truncated_pages_are_not_cached(site, tmp_path):
+    site.pages['/page'] = ('"v1"', None, b"x" * 1000)
+    client = fetcher(tmp_path, ttl=3600, read_limit_bytes=100)
+
+    cut = client.get(site.url('/page'))
+    assert cut.truncated and len(cut.content) == 100
+    client.store_extracted(site.url('/page'), "cut", [], 'bs4')
+    again = client.get(site.url('/page'))
+    # Downloaded again without validators: nothing was stored
+    assert site.requests[-1] == ('/page', None, None)
+    assert not again.from_cache and again.extracted is None
@@ -0,0 +1,68 @@
+import pytest
+from LaIA_html_extractor import EXTRACTORS, get_extractor
+
+BASE_URL = "https://web.gencat.cat/ca/tramits/beca/"
+
+# Small pages shaped like gencat.cat ones, each exercising a rule of the reference extractor
+PAGES = {
+    'inline_script': """
+        <html><body><div class="content">
+          <p>Per demanar la beca <script>track('beca')</script> cal omplir el formulari.</p>
+        </div></body></html>""",
+    'nav_in_body': "<body>  hello  <nav>n</nav> world </body>",
+    'page_layout': """
+        <!DOCTYPE html>
+        <html lang="ca">
+        <head><title>Beques</title><style>.content { color: red }</style>
+          <script src="/analytics.js"></script></head>
+        <body>
+          <header class="main"><a href="/ca/inici/">Inici</a> Generalitat de Catalunya</header>
+          <nav><ul><li><a href="/ca/temes/">Temes</a></li><li><a href="/ca/tramits/">Tràmits</a></li></ul></nav>
+          <div class="tramit-steps">
+            <h1>Beca general</h1>
+            <ol>
+              <li>Consulteu els <a href="requisits/">requisits</a>.</li>
+              <li>Presenteu la sol·licitud <a href="#form">en línia</a> o <a href="formulari.pdf">en paper</a>.</li>
+            </ol>
+            <p>Termini: <strong>30 de juny</strong><!-- actualitzat --> de 2025.</p>
+          </div>
+          <div class="blocs"><h2>Documentació</h2><p>DNI &amp; certificat</p>
+            <a href="https://www.gencat.cat/ca/other/">Altres</a>
+            <a href="https://web.gencat.cat/ca/tramits/beca/faq">FAQ</a>
+            <a href="javascript:void(0)">Imprimir</a></div>
+          <footer><a href="/ca/avis-legal/">Avís legal</a> © Generalitat</footer>
+        </body></html>""",
+    'nested_removed': '<body><div class="content">x<nav>n<script>s</script>t</nav>y<style>z</style> w</div></body>',
+    'template': '<body><div class="main">a<template><p>tpl</p><a href="/t">t</a> x</template>b<a href="/after">c</a></div></body>',
+    'no_container': """
+        <html><body><hidden-xs>amagat</hidden-xs>
+          <p>Text <em>sense</em> contenidor</p><div class="sidebar"><a href="/ca/contacte/">Contacte</a></div>
+        </body></html>""",
+    'nested_containers': '<body><div class="container"><article class="article"><p>Dins</p></article><p>Fora</p></div></body>',
+    'no_body': "<p>Sense body</p>",
+    'empty': "",
+}
+
+FAST_EXTRACTORS = [name for name in EXTRACTORS if name != 'beautifulsoup']
+
+
+@pytest.mark.parametrize('page', PAGES)
+@pytest.mark.parametrize('name', FAST_EXTRACTORS)
+def test_same_output_as_beautifulsoup(name, page):
+    try:
+        extractor = get_extractor(name)
+    except ImportError as e:
+        pytest.skip(str(e))
+    assert extractor.extract(PAGES[page], BASE_URL) == get_extractor('beautifulsoup').extract(PAGES[page], BASE_URL)
+
+
+def test_reference_rules():
+    main_content, links = get_extractor('beautifulsoup').extract(PAGES['inline_script'], BASE_URL)
+    assert main_content == "Per demanar la becacal omplir el formulari."
+
+    main_content, links = get_extractor('beautifulsoup').extract(PAGES['page_layout'], BASE_URL)
+    # Header, nav and footer are left out, containers are joined with a space
+    assert main_content.startswith("Beca generalConsulteu elsrequisits.")
+    assert "Generalitat de Catalunya" not in main_content and "Avís legal" not in main_content
+    # Same-domain links only, no anchors, PDFs or javascript:, nor the links of the removed elements
+    assert links == [BASE_URL + "requisits/", BASE_URL + "faq"]
@@ -0,0 +1,170 @@
+import threading
+import time
+import pytest
+from LaIA_job_queue import JobQueue, QueueFull
+
+TIMEOUT = 5
+
+
+def blocking(release: threading.Event, started: threading.Event = None):
+    """Job function running until release is set"""
+    def run(job):
+        if started is not None:
+            started.set()
+        assert release.wait(TIMEOUT)
+        return job.session_id
+    return run
+
+
+def wait_for(condition, timeout: float = TIMEOUT) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def queues():
+    created = []
+
+    def create(**kwargs):
+        queue = JobQueue(**kwargs)
+        created.append(queue)
+        return queue
+    yield create
+    for queue in created:
+        queue.close()
+
+
+def test_submit_past_max_queued_raises(queues):
+    release = threading.Event()
+    queue = queues(num_workers=1, max_queued=2)
+    started = threading.Event()
+    running = queue.submit('a', blocking(release, started))
+    assert started.wait(TIMEOUT)
+    queued = [queue.submit('b', blocking(release)), queue.submit('c', blocking(release))]
+
+    with pytest.raises(QueueFull):
+        queue.submit('d', blocking(release))
+    assert queue.stats()['rejected'] == 1
+
+    release.set()
+    wait_for(lambda: all(job.status == 'done' for job in [running] + queued))
+    assert [job.result for job in queued] == ['b', 'c']
+    assert queue.stats()['completed'] == 3
+
+
+def test_one_session_cannot_fill_the_queue(queues):
+    release = threading.Event()
+    queue = queues(num_workers=1, max_queued=8, max_queued_per_session=2)
+    started = threading.Event()
+    running = queue.submit('a', blocking(release, started))
+    assert started.wait(TIMEOUT)
+    queued = [queue.submit('a', blocking(release)), queue.submit('a', blocking(release))]
+
+    with pytest.raises(QueueFull):
+        queue.submit('a', blocking(release))
+    # Other sessions still get in
+    other = queue.submit('b', blocking(release))
+    assert queue.stats()['rejected'] == 1
+
+    release.set()
+    wait_for(lambda: all(job.status == 'done' for job in [running, other] + queued))
+    # Freed slots accept the session's jobs again
+    assert queue.submit('a', lambda job: None)
+
+
+def test_a_session_runs_one_job_at_a_time_while_others_proceed(queues):
+    release_a = threading.Event()
+    queue = queues(num_workers=2, max_running_per_session=1)
+    started = threading.Event()
+    first_a = queue.submit('a', blocking(release_a, started))
+    assert started.wait(TIMEOUT)
+    second_a = queue.submit('a', lambda job: 'second')
+    b = queue.submit('b', lambda job: 'b')
+
+    # The free worker skips a's second job and runs b's
+    wait_for(lambda: b.status == 'done')
+    assert second_a.status == 'queued'
+
+    release_a.set()
+    wait_for(lambda: second_a.status == 'done')
+    assert first_a.finished <= second_a.started
+
+
+def test_cancelling_a_queued_job_never_runs_it(queues):
+    release = threading.Event()
+    cancelled_jobs = []
+    updates = []
+    queue = queues(num_workers=1, on_cancel=cancelled_jobs.append, on_update=lambda job: updates.append((job.id, job.status)))
+    started = threading.Event()
+    running = queue.submit('a', blocking(release, started))
+    assert started.wait(TIMEOUT)
+    ran = threading.Event()
+    queued = queue.submit('b', lambda job: ran.set())
+
+    assert queue.cancel(queued.id)
+    assert queued.status == 'cancelled'
+    assert cancelled_jobs == [queued]
+    assert (queued.id, 'cancelled') in updates
+    # Already finished
+    assert not queue.cancel(queued.id)
+
+    release.set()
+    wait_for(lambda: running.status == 'done')
+    assert not ran.is_set()
+    assert queue.stats()['cancelled'] == 1
+
+
+def test_cancelling_a_running_job_stops_it_at_its_next_check(queues):
+    cancelled_jobs = []
+    queue = queues(num_workers=1, on_cancel=cancelled_jobs.append)
+    started, checked = threading.Event(), threading.Event()
+
+    def work(job):
+        started.set()
+        while True:
+            job.update('working')
+            checked.set()
+            time.sleep(0.01)
+
+    job = queue.submit('a', work)
+    assert started.wait(TIMEOUT)
+    assert checked.wait(TIMEOUT)
+    assert queue.cancel(job.id)
+    wait_for(lambda: job.status == 'cancelled')
+    # The job ran, so it cleans up after itself: on_cancel is only for jobs that never started
+    assert cancelled_jobs == []
+
+
+def test_close_cancels_queued_jobs():
+    release = threading.Event()
+    cancelled_jobs = []
+    queue = JobQueue(num_workers=1, on_cancel=cancelled_jobs.append)
+    started = threading.Event()
+    running = queue.submit('a', blocking(release, started))
+    assert started.wait(TIMEOUT)
+    queued = queue.submit('b', lambda job: 'never')
+
+    closer = threading.Thread(target=queue.close)
+    closer.start()
+    wait_for(lambda: queued.status == 'cancelled')
+    release.set()
+    closer.join(TIMEOUT)
+    assert not closer.is_alive()
+    assert running.status == 'done'
+    assert cancelled_jobs == [queued]
+    with pytest.raises(RuntimeError):
+        queue.submit('c', lambda job: None)
+
+
+def test_failed_jobs_keep_their_error(queues):
+    queue = queues(num_workers=1)
+
+    def fail(job):
+        raise ValueError("boom")
+
+    job = queue.submit('a', fail)
+    wait_for(lambda: job.status == 'failed')
+    assert job.error == "boom"
+    assert queue.stats()['failed'] == 1
@@ -0,0 +1,67 @@
+import time
+from conftest import MESSAGES
+from LaIA_llm_cache import LLMResponseCache
+from LaIA_llm_gateway import LLMGateway
+
+ARGUMENTS = {'model': "mock", 'messages': MESSAGES, 'temperature': 0.1}
+
+
+def test_key_is_scoped_per_caller_endpoint_and_sampling_parameters():
+    key = LLMResponseCache.key('select_best_sources', "http://llm/v1", ARGUMENTS)
+    assert key == LLMResponseCache.key('select_best_sources', "http://llm/v1", dict(reversed(list(ARGUMENTS.items()))))
+    assert key != LLMResponseCache.key('process_prompt', "http://llm/v1", ARGUMENTS)
+    assert key != LLMResponseCache.key('select_best_sources', "http://other/v1", ARGUMENTS)
+    assert key != LLMResponseCache.key('select_best_sources', "http://llm/v1", {**ARGUMENTS, 'temperature': 0.7})
+    assert key != LLMResponseCache.key('select_best_sources', "http://llm/v1", {**ARGUMENTS, 'max_tokens': 10})
+    # How the completion is delivered does not change it
+    assert key == LLMResponseCache.key('select_best_sources', "http://llm/v1", {**ARGUMENTS, 'timeout': 5, 'stream': False})
+
+
+def gateway(llm, tmp_path, **kwargs) -> LLMGateway:
+    return LLMGateway(override_base_url=llm.base_url, api_key="key", cache=LLMResponseCache(str(tmp_path), **kwargs),
+                      cached_callers=['select_best_sources', 'process_prompt'])
+
+
+def ask(gateway: LLMGateway, caller: str, **arguments):
+    return gateway.client_for(caller).chat.completions.create(**{**ARGUMENTS, **arguments}).choices[0].message.content
+
+
+def test_completions_are_reused_per_caller_and_temperature(llm, tmp_path):
+    shared = gateway(llm, tmp_path)
+    first = ask(shared, 'select_best_sources')
+    assert ask(shared, 'select_best_sources') == first
+    assert llm.requests == 1
+
+    # Same prompt from another call site, or sampled at another temperature: new completions
+    ask(shared, 'process_prompt')
+    ask(shared, 'select_best_sources', temperature=0.7)
+    assert llm.requests == 3
+    ask(shared, 'process_prompt')
+    ask(shared, 'select_best_sources', temperature=0.7)
+    assert llm.requests == 3
+    assert shared.stats()['select_best_sources']['cache_hits'] == 2
+    assert shared.stats()['process_prompt']['cache_hits'] == 1
+
+
+def test_only_the_listed_callers_and_non_streamed_completions_are_cached(llm, tmp_path):
+    shared = gateway(llm, tmp_path)
+    ask(shared, 'answer')
+    ask(shared, 'answer')
+    assert llm.requests == 2
+
+    for _ in range(2):
+        stream = shared.client_for('select_best_sources').chat.completions.create(**ARGUMENTS, stream=True)
+        assert "".join(chunk.choices[0].delta.content or "" for chunk in stream) == "D'acord."
+    assert llm.requests == 4
+    assert shared.cache.stats()['entries'] == 0
+
+
+def test_cached_completions_survive_a_restart_until_the_ttl(llm, tmp_path):
+    ask(gateway(llm, tmp_path), 'select_best_sources')
+    ask(gateway(llm, tmp_path), 'select_best_sources')
+    assert llm.requests == 1
+
+    expired = gateway(llm, tmp_path, ttl=0.05)
+    time.sleep(0.1)
+    ask(expired, 'select_best_sources')
+    assert llm.requests == 2
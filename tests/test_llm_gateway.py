@@ -0,0 +1,72 @@
+import threading
+import time
+import openai
+import pytest
+from conftest import LATENCY, MESSAGES, MockLLM
+from LaIA_llm_gateway import LLMGateway
+
+
+def gateway(llm: MockLLM, **kwargs) -> LLMGateway:
+    return LLMGateway(override_base_url=llm.base_url, api_key="key", backoff_factor=0.01, **kwargs)
+
+
+def ask(client):
+    return client.chat.completions.create(model="mock", messages=MESSAGES).choices[0].message.content
+
+
+def test_requests_in_flight_are_limited_across_callers(llm):
+    shared = gateway(llm, max_in_flight=2)
+    clients = [shared.client_for('answer'), shared.client_for('web_search')]
+    answers = []
+    threads = [threading.Thread(target=lambda i=i: answers.append(ask(clients[i % 2]))) for i in range(6)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert answers == ["D'acord."] * 6
+    assert llm.max_in_flight == 2
+    assert time.monotonic() - started >= 3 * LATENCY
+    stats = shared.stats()
+    assert stats['answer']['calls'] == 3 and stats['web_search']['calls'] == 3
+
+
+def test_a_stream_holds_its_slot_until_it_is_read(llm):
+    shared = gateway(llm, max_in_flight=1)
+    client = shared.client_for('answer')
+    stream = client.chat.completions.create(model="mock", messages=MESSAGES, stream=True)
+    waiting = threading.Thread(target=ask, args=(client,))
+    waiting.start()
+    time.sleep(2 * LATENCY)
+    assert waiting.is_alive()
+
+    assert "".join(chunk.choices[0].delta.content or "" for chunk in stream) == "D'acord."
+    waiting.join(5)
+    assert not waiting.is_alive()
+
+
+def test_rate_limits_and_server_errors_are_retried(llm):
+    llm.failures = [('429 Too Many Requests', '0'), ('503 Service Unavailable', None)]
+    shared = gateway(llm, max_retries=2)
+    assert ask(shared.client_for('answer')) == "D'acord."
+    assert llm.requests == 3
+    assert shared.stats()['answer']['retries'] == 2
+    assert shared.stats()['answer']['failures'] == 0
+
+
+def test_the_last_error_is_raised_once_the_retries_are_exhausted(llm):
+    llm.failures = [('503 Service Unavailable', '0')] * 2
+    shared = gateway(llm, max_retries=1, max_in_flight=1)
+    client = shared.client_for('answer')
+    with pytest.raises(openai.InternalServerError):
+        ask(client)
+    assert llm.requests == 2
+    assert shared.stats()['answer']['failures'] == 1
+
+    # Errors not worth retrying are raised at once, and no failure leaks the only slot
+    llm.failures = [('400 Bad Request', None)]
+    with pytest.raises(openai.BadRequestError):
+        ask(client)
+    assert llm.requests == 3
+    assert ask(client) == "D'acord."
@@ -0,0 +1,55 @@
+import threading
+import time
+from LaIA_page_cache import PageCache, CachedPage, extracted_by
+
+URL = "https://web.gencat.cat/ca/tramits/beca/"
+
+
+def page(content: bytes = b"<p>Beca</p>") -> CachedPage:
+    return CachedPage(url=URL, status_code=200, headers={'ETag': '"v1"'}, content=content, fetched=time.time() - 60)
+
+
+def test_revalidating_an_old_copy_keeps_the_extracted_content(tmp_path):
+    cache = PageCache(str(tmp_path))
+    cache.put(URL, page())
+    # Read by a crawl before another one stored the parsed content
+    stale = cache.get(URL)
+    cache.set_extracted(URL, "Beca", ["https://web.gencat.cat/ca/a"], 'lxml')
+
+    cache.mark_revalidated(URL, stale)
+    cached = cache.get(URL)
+    assert cached.fetched == stale.fetched
+    assert extracted_by(cached.extracted, 'lxml') == {'main_content': "Beca", 'links': ["https://web.gencat.cat/ca/a"], 'extractor': 'lxml'}
+
+
+def test_concurrent_updates_are_not_lost(tmp_path):
+    cache = PageCache(str(tmp_path))
+    cache.put(URL, page())
+    fetched = cache.get(URL).fetched
+    start = threading.Barrier(8)
+
+    def set_extracted(i):
+        start.wait()
+        cache.set_extracted(URL, f"text {i}", [], 'lxml')
+
+    def revalidate():
+        start.wait()
+        cache.mark_revalidated(URL, cache.get(URL))
+
+    threads = [threading.Thread(target=set_extracted, args=(i,)) for i in range(4)] + [threading.Thread(target=revalidate) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    cached = cache.get(URL)
+    assert cached.fetched > fetched
+    assert cached.extracted['main_content'].startswith("text ")
+    assert cached.content == b"<p>Beca</p>"
+
+
+def test_set_extracted_on_an_evicted_page_does_nothing(tmp_path):
+    cache = PageCache(str(tmp_path))
+    cache.set_extracted(URL, "Beca", [], 'lxml')
+    assert cache.get(URL) is None
+    assert cache.stats()['entries'] == 0
@@ -0,0 +1,113 @@
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace
+import pytest
+from LaIA_select_best_sources import SelectBestSources
+
+BASE = "https://web.gencat.cat/ca/tramits"
+
+
+class Counter:
+    """Number of calls in flight, and the most seen at once"""
+
+    def __init__(self):
+        self.current = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        with self._lock:
+            self.current += 1
+            self.peak = max(self.peak, self.current)
+
+    def __exit__(self, *args):
+        with self._lock:
+            self.current -= 1
+
+
+class StubGateway:
+    """Gateway whose client selects the sources whose content says 'rellevant', after a random delay"""
+
+    def __init__(self):
+        self.in_flight = Counter()
+        self.prompts = []
+
+    def client_for(self, caller, base_url=None, api_key=None):
+        return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=self._create)))
+
+    def _create(self, messages, **kwargs):
+        with self.in_flight:
+            prompt = messages[-1]['content']
+            self.prompts.append(prompt)
+            # Later batches may finish first
+            time.sleep(random.uniform(0, 0.02))
+            selected = re.findall(r"Source: (\S+)\nContent: [^\n]*rellevant", prompt)
+            answer = "Les fonts són: " + ", ".join(f"({url})" for url in selected)
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=answer))])
+
+
+class StubFetcher:
+    """HEAD answers 200 except for the URLs containing 'broken'"""
+
+    def __init__(self):
+        self.in_flight = Counter()
+
+    def head(self, url):
+        with self.in_flight:
+            time.sleep(random.uniform(0, 0.01))
+            return 404 if 'broken' in url else 200
+
+
+def page(path: str, content: str, *children) -> dict:
+    return {'url': BASE + path, 'main_content': content, 'sub_content': list(children)}
+
+
+def crawl() -> dict:
+    return {'query': "beca", 'gathered_info': [
+        page("/beca", "beca rellevant",
+             page("/beca/requisits", "requisits rellevant"),
+             page("/beca/broken", "pàgina rellevant però trencada"),
+             page("/beca/terminis", "terminis"),
+             page("/beca/requisits/annex", "annex rellevant")),
+        page("/ajuts", "ajuts",
+             page("/ajuts/menjador", "menjador rellevant"),
+             page("/beca", "duplicada rellevant")),
+    ] + [page(f"/altres/{i}", "altres rellevant" if i % 3 == 0 else "altres") for i in range(20)]}
+
+
+def select(concurrency: int, remove_parent_urls: bool = False):
+    gateway, fetcher = StubGateway(), StubFetcher()
+    selector = SelectBestSources("", "", max_simultaneous_sources=3, remove_parent_urls=remove_parent_urls, fetcher=fetcher,
+                                 max_concurrent_requests=concurrency, max_concurrent_validations=concurrency, gateway=gateway)
+    selector.append_sources(crawl())
+    return selector, gateway, fetcher
+
+
+@pytest.mark.parametrize('remove_parent_urls', [False, True])
+def test_concurrent_selection_matches_sequential_processing(remove_parent_urls):
+    sequential, _, _ = select(1, remove_parent_urls)
+    for _ in range(3):
+        concurrent, gateway, fetcher = select(4, remove_parent_urls)
+        assert concurrent.get_current_sources() == sequential.get_current_sources()
+    # Batches and validations really overlapped
+    assert gateway.in_flight.peak > 1 and len(gateway.prompts) == 9
+    assert fetcher.in_flight.peak > 1
+
+
+def test_selected_sources_keep_the_crawl_order():
+    selector, _, _ = select(4)
+    assert [url for url, _ in selector.get_current_sources()] == [
+        BASE + path for path in ["/beca", "/beca/requisits", "/beca/requisits/annex", "/ajuts/menjador"]
+    ] + [f"{BASE}/altres/{i}" for i in range(0, 20, 3)]
+    # The first content crawled for a URL is kept, and unreachable pages are dropped
+    assert dict(selector.get_current_sources())[BASE + "/beca"] == "beca rellevant"
+
+
+def test_parent_urls_are_pruned_across_batches():
+    selector, _, _ = select(4, remove_parent_urls=True)
+    urls = [url for url, _ in selector.get_current_sources()]
+    # /beca and /beca/requisits were selected in another batch than /beca/requisits/annex
+    assert BASE + "/beca" not in urls and BASE + "/beca/requisits" not in urls
+    assert urls[:2] == [BASE + "/beca/requisits/annex", BASE + "/ajuts/menjador"]
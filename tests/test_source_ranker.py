@@ -0,0 +1,94 @@
+from types import SimpleNamespace
+import pytest
+from conftest import FakeEmbeddings, StubLLM
+from LaIA_embedding_cache import EmbeddingCache
+from LaIA_embedding_service import EmbeddingService
+from LaIA_select_best_sources import SelectBestSources
+from LaIA_source_ranker import BM25Ranker, EmbeddingRanker, RANKED_CHARS
+
+BASE = "https://web.gencat.cat/ca/tramits"
+
+CORPUS = [
+    "Beques de menjador escolar: sol·licitud i requisits de la beca de menjador",
+    "Ajuts per a l'adquisició de llibres de text",
+    "Beca general per a estudis universitaris",
+    "Horaris d'atenció al públic de les oficines",
+]
+
+
+def test_embedding_ranker_scores_by_cosine_similarity():
+    ranker = EmbeddingRanker(FakeEmbeddings())
+    scores = ranker.score(CORPUS[2], CORPUS)
+    assert scores[2] == pytest.approx(1.0)
+    assert all(-1.0 <= score < 0.99 for i, score in enumerate(scores) if i != 2)
+    assert ranker.score("beca", []) == []
+
+
+def test_embedding_ranker_scores_the_beginning_of_each_source():
+    beginning = "beca " * (RANKED_CHARS // 5)
+    scores = EmbeddingRanker(FakeEmbeddings()).score(beginning, [beginning + "peu de pàgina", "peu de pàgina"])
+    assert scores[0] == pytest.approx(1.0)
+
+
+def test_embedding_ranker_embeds_each_source_once():
+    embeddings = FakeEmbeddings()
+    service = EmbeddingService(embeddings, max_wait=0.0)
+    ranker = EmbeddingRanker(embeddings, embedding_service=service, embedding_cache=EmbeddingCache("model"))
+    try:
+        first = ranker.score("beca", CORPUS + [CORPUS[0]])
+        assert embeddings.embedded == len(CORPUS)
+        # A later search ranking the same pages takes them from the cache
+        assert ranker.score("beca", CORPUS) == pytest.approx(first[:len(CORPUS)])
+        assert embeddings.embedded == len(CORPUS)
+    finally:
+        service.close()
+
+
+def test_bm25_ranks_the_sources_with_the_query_terms_first():
+    scores = BM25Ranker().score("beca de menjador", CORPUS)
+    # The office hours only share "de" with the query
+    assert scores[0] > scores[2] > scores[3] > 0
+    assert BM25Ranker().score("beca menjador", CORPUS)[3] == 0
+    assert BM25Ranker.tokenize("Sol·licitud BECA") == ["sol", "licitud", "beca"]
+    assert BM25Ranker().score("beca", []) == []
+
+
+def test_bm25_penalises_long_sources():
+    short, long = "beca menjador", "beca menjador " + "altres paraules " * 50
+    scores = BM25Ranker().score("beca", [short, long, "res"])
+    assert scores[0] > scores[1] > scores[2] == 0
+
+
+class StubFetcher:
+    def head(self, url):
+        return 200
+
+
+def selector(llm: StubLLM, **kwargs) -> SelectBestSources:
+    gateway = SimpleNamespace(client_for=lambda *args, **kw: llm)
+    return SelectBestSources("", "", fetcher=StubFetcher(), gateway=gateway, ranker=BM25Ranker(), **kwargs)
+
+
+def crawl(query: str) -> dict:
+    return {'query': query, 'gathered_info': [
+        {'url': f"{BASE}/{i}", 'main_content': content, 'sub_content': []} for i, content in enumerate(CORPUS)
+    ]}
+
+
+def test_sources_scoring_accept_score_skip_the_llm():
+    llm = StubLLM(f"La font és {BASE}/2")
+    sources = selector(llm, accept_score=1.0, min_score=0.01)
+    sources.append_sources(crawl("menjador"))
+    # Only the page about the "menjador" is decisive, the others left are not relevant enough to ask about
+    assert llm.calls == 0
+    assert sources.get_final_sources("menjador") == [(f"{BASE}/0", CORPUS[0])]
+    assert llm.calls == 0
+
+
+def test_sources_below_accept_score_go_to_the_llm():
+    llm = StubLLM(f"La font és {BASE}/2")
+    sources = selector(llm, accept_score=1.0, top_k=2)
+    sources.append_sources(crawl("beca de menjador"))
+    # The menjador page is accepted, the best of the rest is sent to the LLM which picks /2
+    assert llm.calls == 1
+    assert [url for url, _ in sources.get_current_sources()] == [f"{BASE}/0", f"{BASE}/2"]
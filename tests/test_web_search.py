@@ -0,0 +1,58 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import requests
+from LaIA_fetcher import Fetcher, BodyTooLarge, UnsupportedContentType
+from LaIA_web_search import WebSearchAgent
+
+# path -> (status, Content-Type, body)
+PAGES = {
+    '/page': (200, 'text/html; charset=utf-8', b'<body><div class="content"><p>Beca general</p></div></body>'),
+    '/document.pdf': (200, 'application/pdf', b'%PDF-1.4'),
+    '/large': (200, 'text/html', b'<p>' + b'x' * 4096 + b'</p>'),
+}
+
+
+@pytest.fixture(scope='module')
+def site():
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            status, content_type, body = PAGES.get(self.path, (404, 'text/html', b'Not found'))
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, args=(0.01,), daemon=True).start()
+    yield lambda path: f"http://127.0.0.1:{server.server_address[1]}{path}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def agent():
+    return WebSearchAgent("http://127.0.0.1:1", "key", fetcher=Fetcher(max_body_bytes=1024, retries=0))
+
+
+def test_simple_web_returns_the_main_content(site, agent):
+    assert agent.simple_web(site('/page')) == "Beca general"
+
+
+@pytest.mark.parametrize('path, error', [
+    ('/document.pdf', UnsupportedContentType),
+    ('/large', BodyTooLarge),
+    ('/missing', requests.HTTPError),
+])
+def test_simple_web_raises_the_reason_the_page_cannot_be_added(site, agent, path, error):
+    with pytest.raises(error):
+        agent.simple_web(site(path))
+
+
+def test_simple_web_raises_on_connection_errors(agent):
+    with pytest.raises(requests.ConnectionError):
+        agent.simple_web("http://127.0.0.1:1/page")